@@ -0,0 +1,3 @@
+#!/bin/bash
+cd "$(dirname "$0")" || exit
+docker-compose exec db mariadb -uroot -ptest book_club -e "CALL rebuild_book_stats();"
@@ -35,6 +35,7 @@ CREATE TABLE users
     description   VARCHAR(256) NULL     DEFAULT NULL,
 
     deleted       BOOLEAN      NOT NULL DEFAULT FALSE,
+    version       INTEGER      NOT NULL DEFAULT 0,
     created_at    DATETIME              DEFAULT CURRENT_TIMESTAMP,
     updated_at    DATETIME     NULL     DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
 
@@ -51,12 +52,14 @@ CREATE TABLE clubs
     description VARCHAR(2048) NULL     DEFAULT NULL,
 
     deleted     BOOLEAN       NOT NULL DEFAULT FALSE,
+    version     INTEGER       NOT NULL DEFAULT 0,
     created_at  DATETIME               DEFAULT CURRENT_TIMESTAMP,
     updated_at  DATETIME      NULL     DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
 
     PRIMARY KEY pk_clubs (id),
     UNIQUE INDEX idx_clubs_handle (handle),
     INDEX idx_clubs_deleted (deleted),
+    FULLTEXT INDEX ftx_clubs_text (description),
     CONSTRAINT FOREIGN KEY fg_club_owner (owner_id) REFERENCES users (id) ON DELETE SET NULL ON UPDATE CASCADE
 ) ENGINE = InnoDB;
 
@@ -69,13 +72,15 @@ CREATE TABLE books
     pages       INTEGER      NULL     DEFAULT NULL,
 
     deleted     BOOLEAN      NOT NULL DEFAULT FALSE,
+    version     INTEGER      NOT NULL DEFAULT 0,
     created_at  DATETIME              DEFAULT CURRENT_TIMESTAMP,
     updated_at  DATETIME     NULL     DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
 
     PRIMARY KEY pk_books (id),
     UNIQUE INDEX idx_books_handle (handle),
     INDEX idx_books_pages (pages),
-    INDEX idx_books_deleted (deleted)
+    INDEX idx_books_deleted (deleted),
+    FULLTEXT INDEX ftx_books_text (full_name, description)
 ) ENGINE = InnoDB;
 
 CREATE TABLE comments
@@ -113,7 +118,8 @@ CREATE TABLE reviews
 
     PRIMARY KEY pk_reviews (id),
     UNIQUE INDEX reviews_user_id (user_id, book_id),
-    INDEX reviews_book_id (book_id),
+    INDEX reviews_book_id (book_id, created_at),
+    FULLTEXT INDEX ftx_reviews_text (title, content),
     CONSTRAINT chk_stars CHECK (stars <= 5 AND stars >= 1),
     CONSTRAINT FOREIGN KEY fk_reviews_user_id (user_id) REFERENCES users (id) ON UPDATE CASCADE ON DELETE SET NULL,
     CONSTRAINT FOREIGN KEY fk_reviews_book_id (book_id) REFERENCES books (id) ON UPDATE CASCADE ON DELETE CASCADE
@@ -171,40 +177,47 @@ CREATE TABLE review_comment_link
     CONSTRAINT FOREIGN KEY fk_ccl_child_id (comment_id) REFERENCES comments (id) ON UPDATE CASCADE ON DELETE CASCADE
 ) ENGINE = InnoDB;
 
+CREATE TABLE book_stats
+(
+    book_id   INTEGER NOT NULL,
+    reviews   BIGINT  NOT NULL DEFAULT 0,
+    stars     BIGINT  NOT NULL DEFAULT 0,
+    readers   BIGINT  NOT NULL DEFAULT 0,
+    completed BIGINT  NOT NULL DEFAULT 0,
+    pending   BIGINT  NOT NULL DEFAULT 0,
+    liked     BIGINT  NOT NULL DEFAULT 0,
+    disliked  BIGINT  NOT NULL DEFAULT 0,
+
+    PRIMARY KEY pk_book_stats (book_id),
+    CONSTRAINT FOREIGN KEY fk_book_stats_book_id (book_id) REFERENCES books (id) ON UPDATE CASCADE ON DELETE CASCADE
+) ENGINE = InnoDB;
+
+-- Collection versions for conditional requests, bumped by triggers on every write to the collection
+CREATE TABLE collection_versions
+(
+    name    VARCHAR(16) NOT NULL,
+    version BIGINT      NOT NULL DEFAULT 0,
+
+    PRIMARY KEY pk_collection_versions (name)
+) ENGINE = InnoDB;
+
+INSERT INTO collection_versions (name)
+VALUES ('users'),
+       ('books'),
+       ('clubs'),
+       ('reviews');
+
 -- views
 CREATE DEFINER = 'bk_read_only'@'localhost' SQL SECURITY DEFINER VIEW books_statistics AS
-SELECT b.handle                 AS handle,
-       IFNULL(r.stars, 1)       AS rating,
-       IFNULL(reader.cnt, 0)    AS readers,
-       IFNULL(completed.cnt, 0) AS completed,
-       IFNULL(wtr.cnt, 0)       AS pending,
-       IFNULL(liked.cnt, 0)     AS liked,
-       IFNULL(disliked.cnt, 0)  AS disliked
+SELECT b.handle                                                                          AS handle,
+       CAST(IF(bs.reviews = 0, 1, ROUND(bs.stars / bs.reviews * 2, 2)) AS DECIMAL(7, 2)) AS rating,
+       bs.readers                                                                        AS readers,
+       bs.completed                                                                      AS completed,
+       bs.pending                                                                        AS pending,
+       bs.liked                                                                          AS liked,
+       bs.disliked                                                                       AS disliked
 FROM books b
-         LEFT JOIN (SELECT book_id AS id, ROUND(AVG(r.stars) * 2, 2) AS stars
-                    FROM reviews r
-                    GROUP BY r.book_id) AS r ON b.id = r.id
-         LEFT JOIN (SELECT book_id AS id, COUNT(*) AS cnt
-                    FROM user_books
-                    WHERE reading_status = 'reading'
-                    GROUP BY book_id) AS reader ON b.id = reader.id
-         LEFT JOIN (SELECT book_id AS id, COUNT(*) AS cnt
-                    FROM user_books
-                    WHERE reading_status = 'complete'
-                    GROUP BY book_id) AS completed ON b.id = completed.id
-         LEFT JOIN (SELECT book_id AS id, COUNT(*) AS cnt
-                    FROM user_books
-                    WHERE reading_status = 'pending'
-                    GROUP BY book_id) AS wtr ON b.id = wtr.id
-         LEFT JOIN (SELECT book_id AS id, COUNT(*) AS cnt
-                    FROM user_books
-                    WHERE liked = TRUE
-                    GROUP BY book_id) AS liked ON b.id = liked.id
-         LEFT JOIN (SELECT book_id AS id, COUNT(*) AS cnt
-                    FROM user_books
-                    WHERE liked = FALSE
-                    GROUP BY book_id) AS disliked ON b.id = disliked.id
-ORDER BY b.handle;
+         JOIN book_stats bs ON b.id = bs.book_id;
 
 -- Trigger
 DELIMITER $$
@@ -220,4 +233,269 @@ BEGIN
       AND new.book_id = ubl.book_id;
 END $$
 
+-- Book statistics
+CREATE TRIGGER trg_book_stats_book
+    AFTER INSERT
+    ON books
+    FOR EACH ROW
+BEGIN
+    INSERT INTO book_stats (book_id) VALUES (new.id);
+END $$
+
+CREATE TRIGGER trg_book_stats_review_insert
+    AFTER INSERT
+    ON reviews
+    FOR EACH ROW
+BEGIN
+    UPDATE book_stats bs
+    SET bs.reviews = bs.reviews + 1,
+        bs.stars   = bs.stars + new.stars
+    WHERE bs.book_id = new.book_id;
+END $$
+
+CREATE TRIGGER trg_book_stats_review_update
+    AFTER UPDATE
+    ON reviews
+    FOR EACH ROW
+BEGIN
+    UPDATE book_stats bs
+    SET bs.reviews = bs.reviews - 1,
+        bs.stars   = bs.stars - old.stars
+    WHERE bs.book_id = old.book_id;
+    UPDATE book_stats bs
+    SET bs.reviews = bs.reviews + 1,
+        bs.stars   = bs.stars + new.stars
+    WHERE bs.book_id = new.book_id;
+END $$
+
+CREATE TRIGGER trg_book_stats_review_delete
+    AFTER DELETE
+    ON reviews
+    FOR EACH ROW
+BEGIN
+    UPDATE book_stats bs
+    SET bs.reviews = bs.reviews - 1,
+        bs.stars   = bs.stars - old.stars
+    WHERE bs.book_id = old.book_id;
+END $$
+
+CREATE TRIGGER trg_book_stats_ubl_insert
+    AFTER INSERT
+    ON user_books
+    FOR EACH ROW
+BEGIN
+    UPDATE book_stats bs
+    SET bs.readers   = bs.readers + (new.reading_status <=> 'reading'),
+        bs.completed = bs.completed + (new.reading_status <=> 'complete'),
+        bs.pending   = bs.pending + (new.reading_status <=> 'pending'),
+        bs.liked     = bs.liked + (new.liked <=> TRUE),
+        bs.disliked  = bs.disliked + (new.liked <=> FALSE)
+    WHERE bs.book_id = new.book_id;
+END $$
+
+CREATE TRIGGER trg_book_stats_ubl_update
+    AFTER UPDATE
+    ON user_books
+    FOR EACH ROW
+BEGIN
+    UPDATE book_stats bs
+    SET bs.readers   = bs.readers - (old.reading_status <=> 'reading'),
+        bs.completed = bs.completed - (old.reading_status <=> 'complete'),
+        bs.pending   = bs.pending - (old.reading_status <=> 'pending'),
+        bs.liked     = bs.liked - (old.liked <=> TRUE),
+        bs.disliked  = bs.disliked - (old.liked <=> FALSE)
+    WHERE bs.book_id = old.book_id;
+    UPDATE book_stats bs
+    SET bs.readers   = bs.readers + (new.reading_status <=> 'reading'),
+        bs.completed = bs.completed + (new.reading_status <=> 'complete'),
+        bs.pending   = bs.pending + (new.reading_status <=> 'pending'),
+        bs.liked     = bs.liked + (new.liked <=> TRUE),
+        bs.disliked  = bs.disliked + (new.liked <=> FALSE)
+    WHERE bs.book_id = new.book_id;
+END $$
+
+CREATE TRIGGER trg_book_stats_ubl_delete
+    AFTER DELETE
+    ON user_books
+    FOR EACH ROW
+BEGIN
+    UPDATE book_stats bs
+    SET bs.readers   = bs.readers - (old.reading_status <=> 'reading'),
+        bs.completed = bs.completed - (old.reading_status <=> 'complete'),
+        bs.pending   = bs.pending - (old.reading_status <=> 'pending'),
+        bs.liked     = bs.liked - (old.liked <=> TRUE),
+        bs.disliked  = bs.disliked - (old.liked <=> FALSE)
+    WHERE bs.book_id = old.book_id;
+END $$
+
+-- Cascading deletes don't fire triggers, so user_books rows of deleted users are handled here
+CREATE TRIGGER trg_book_stats_user_delete
+    BEFORE DELETE
+    ON users
+    FOR EACH ROW
+BEGIN
+    UPDATE book_stats bs
+        JOIN (SELECT book_id,
+                     SUM(reading_status <=> 'reading')  AS readers,
+                     SUM(reading_status <=> 'complete') AS completed,
+                     SUM(reading_status <=> 'pending')  AS pending,
+                     SUM(liked <=> TRUE)                AS liked,
+                     SUM(liked <=> FALSE)               AS disliked
+              FROM user_books
+              WHERE user_id = old.id
+              GROUP BY book_id) AS ubl ON ubl.book_id = bs.book_id
+    SET bs.readers   = bs.readers - ubl.readers,
+        bs.completed = bs.completed - ubl.completed,
+        bs.pending   = bs.pending - ubl.pending,
+        bs.liked     = bs.liked - ubl.liked,
+        bs.disliked  = bs.disliked - ubl.disliked;
+END $$
+
+-- Row and collection versions
+CREATE TRIGGER trg_users_version
+    BEFORE UPDATE
+    ON users
+    FOR EACH ROW
+BEGIN
+    SET new.version = old.version + 1;
+END $$
+
+CREATE TRIGGER trg_users_collection_insert
+    AFTER INSERT
+    ON users
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'users';
+END $$
+
+CREATE TRIGGER trg_users_collection_update
+    AFTER UPDATE
+    ON users
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'users';
+END $$
+
+CREATE TRIGGER trg_users_collection_delete
+    AFTER DELETE
+    ON users
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'users';
+END $$
+
+CREATE TRIGGER trg_books_version
+    BEFORE UPDATE
+    ON books
+    FOR EACH ROW
+BEGIN
+    SET new.version = old.version + 1;
+END $$
+
+CREATE TRIGGER trg_books_collection_insert
+    AFTER INSERT
+    ON books
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'books';
+END $$
+
+CREATE TRIGGER trg_books_collection_update
+    AFTER UPDATE
+    ON books
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'books';
+END $$
+
+CREATE TRIGGER trg_books_collection_delete
+    AFTER DELETE
+    ON books
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'books';
+END $$
+
+CREATE TRIGGER trg_clubs_version
+    BEFORE UPDATE
+    ON clubs
+    FOR EACH ROW
+BEGIN
+    SET new.version = old.version + 1;
+END $$
+
+CREATE TRIGGER trg_clubs_collection_insert
+    AFTER INSERT
+    ON clubs
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'clubs';
+END $$
+
+CREATE TRIGGER trg_clubs_collection_update
+    AFTER UPDATE
+    ON clubs
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'clubs';
+END $$
+
+CREATE TRIGGER trg_clubs_collection_delete
+    AFTER DELETE
+    ON clubs
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'clubs';
+END $$
+
+CREATE TRIGGER trg_reviews_collection_insert
+    AFTER INSERT
+    ON reviews
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'reviews';
+END $$
+
+CREATE TRIGGER trg_reviews_collection_update
+    AFTER UPDATE
+    ON reviews
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'reviews';
+END $$
+
+CREATE TRIGGER trg_reviews_collection_delete
+    AFTER DELETE
+    ON reviews
+    FOR EACH ROW
+BEGIN
+    UPDATE collection_versions SET version = version + 1 WHERE name = 'reviews';
+END $$
+
+-- Backfill or fix book statistics, CALL rebuild_book_stats();
+CREATE PROCEDURE rebuild_book_stats()
+BEGIN
+    REPLACE INTO book_stats (book_id, reviews, stars, readers, completed, pending, liked, disliked)
+    SELECT b.id,
+           IFNULL(r.reviews, 0),
+           IFNULL(r.stars, 0),
+           IFNULL(ubl.readers, 0),
+           IFNULL(ubl.completed, 0),
+           IFNULL(ubl.pending, 0),
+           IFNULL(ubl.liked, 0),
+           IFNULL(ubl.disliked, 0)
+    FROM books b
+             LEFT JOIN (SELECT book_id, COUNT(*) AS reviews, SUM(stars) AS stars
+                        FROM reviews
+                        GROUP BY book_id) AS r ON b.id = r.book_id
+             LEFT JOIN (SELECT book_id,
+                               SUM(reading_status <=> 'reading')  AS readers,
+                               SUM(reading_status <=> 'complete') AS completed,
+                               SUM(reading_status <=> 'pending')  AS pending,
+                               SUM(liked <=> TRUE)                AS liked,
+                               SUM(liked <=> FALSE)               AS disliked
+                        FROM user_books
+                        GROUP BY book_id) AS ubl ON b.id = ubl.book_id;
+END $$
+
 DELIMITER ;
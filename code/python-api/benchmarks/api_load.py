@@ -0,0 +1,422 @@
+"""
+Load test for the HTTP API
+
+Seeds a database, drives every route in paths.py in-process through httpx at fixed concurrency levels
+and reports latency percentiles, requests per second and database queries per request as JSON.
+
+The database is a fresh SQLite file by default, set --url (or book_club_db_url) to use a MySQL database
+with the schema from database/setup/init.sql. Writes are committed, seeded rows are prefixed with a run id.
+The synchronous engine is always used, book_club_async is ignored. SQLite serializes transactions,
+so only its single connection numbers are comparable to MySQL.
+
+Usage:
+    python benchmarks/api_load.py [--requests 200] [--concurrency 1,8,32] [--output results.json]
+    python benchmarks/api_load.py --baseline results.json   # exits with 1 on regressions
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import NamedTuple, Callable, Tuple, Dict, Any, List, Optional, Awaitable
+
+import httpx
+
+from seed import Volumes, sqlite_schema, sqlite_locking, seed
+
+Request = Tuple[str, str, Dict[str, Any]]
+
+
+class Context:
+    """
+    State of one scenario run, key is unique to the run and used for new handles
+    """
+
+    def __init__(self, seeded, key: str):
+        self.seeded = seeded
+        self.key = key
+        self.state: Any = None
+
+
+class Scenario(NamedTuple):
+    name: str
+    route: str
+    request: Callable[[int, Context], Request]
+    prepare: Optional[Callable[[httpx.AsyncClient, int, Context], Awaitable[Any]]] = None
+
+
+def get(url: str, **kwargs) -> Request:
+    return "GET", url, kwargs
+
+
+def spread(i: int) -> int:
+    """
+    Visit seeded rows in a scattered but repeatable order
+    """
+    return i * 7919
+
+
+async def created(client: httpx.AsyncClient, n: int, ctx: Context, collection: str, item: Callable[[str], Dict]):
+    """
+    Create the resources a DELETE scenario removes
+    """
+    r = await client.post(f"/{collection}:bulk", json=[item(f"{ctx.key}{i}") for i in range(0, n)])
+    assert r.status_code == 200 and r.json()["failed"] == 0, r.text
+
+
+async def etags(client: httpx.AsyncClient, n: int, ctx: Context) -> Dict[int, str]:
+    tags = dict()
+    for i in range(0, min(n, 50)):
+        tags[i] = (await client.get(f"/books/{ctx.seeded.book(spread(i))}")).headers.get("etag", "")
+    return tags
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("entrypoint", "entrypoint", lambda i, c: get("/")),
+    Scenario(
+        "users page", "get_users_resource",
+        lambda i, c: get("/users", params={"limit": 20, "after": c.seeded.user(spread(i))})
+    ),
+    Scenario(
+        "users prefix filter", "get_users_resource",
+        lambda i, c: get("/users", params={"limit": 20, "prefix": c.seeded.user(i)[:-1]})
+    ),
+    Scenario(
+        "books page", "get_books_resource",
+        lambda i, c: get("/books", params={"limit": 20, "after": c.seeded.book(spread(i))})
+    ),
+    Scenario(
+        "books sorted by pages", "get_books_resource",
+        lambda i, c: get("/books", params={"limit": 20, "sort": "-pages", "min_pages": 100 + i % 1000})
+    ),
+    Scenario(
+        "books stream", "get_books_resource",
+        lambda i, c: get("/books", params={"stream": True, "min_pages": 100 + i % 1000, "max_pages": 150 + i % 1000})
+    ),
+    Scenario(
+        "clubs page", "get_clubs_resource",
+        lambda i, c: get("/clubs", params={"limit": 20, "after": c.seeded.club(spread(i))})
+    ),
+    Scenario(
+        "search", "search_resource",
+        lambda i, c: get("/search", params={"q": ["dragon river", "winter", "silver machine"][i % 3], "limit": 20})
+    ),
+    Scenario("user", "get_user_resource", lambda i, c: get(f"/users/{c.seeded.user(spread(i))}")),
+    Scenario("book", "get_book_resource", lambda i, c: get(f"/books/{c.seeded.book(spread(i))}")),
+    Scenario(
+        "book not modified", "get_book_resource",
+        lambda i, c: get(
+            f"/books/{c.seeded.book(spread(i % len(c.state)))}",
+            headers={"If-None-Match": c.state[i % len(c.state)]}
+        ),
+        etags
+    ),
+    Scenario("club", "get_club_resource", lambda i, c: get(f"/clubs/{c.seeded.club(spread(i))}")),
+    Scenario(
+        "books batch get", "get_books_batch",
+        lambda i, c: ("POST", "/books:batchGet", {"json": [c.seeded.book(spread(i * 20 + j)) for j in range(0, 20)]})
+    ),
+    Scenario(
+        "users batch get", "get_users_batch",
+        lambda i, c: ("POST", "/users:batchGet", {"json": [c.seeded.user(spread(i * 20 + j)) for j in range(0, 20)]})
+    ),
+    Scenario(
+        "clubs batch get", "get_clubs_batch",
+        lambda i, c: ("POST", "/clubs:batchGet", {"json": [c.seeded.club(spread(i * 20 + j)) for j in range(0, 20)]})
+    ),
+    Scenario(
+        "user books", "get_user_books_resource",
+        lambda i, c: get(f"/users/{c.seeded.user(spread(i))}/books", params={"limit": 20, "stats": True})
+    ),
+    Scenario(
+        "book reviews", "get_book_reviews_resource",
+        lambda i, c: get(f"/books/{c.seeded.review(spread(i))[1]}/reviews", params={"limit": 20})
+    ),
+    Scenario(
+        "review comments", "get_review_comments_resource",
+        lambda i, c: get("/books/{1}/reviews/{0}/comments".format(*c.seeded.commented(i)), params={"limit": 20})
+    ),
+    Scenario(
+        "add book", "add_book_resource",
+        lambda i, c: ("POST", "/books", {"json": {"handle": f"{c.key}{i}", "full_name": "New", "pages": i}})
+    ),
+    Scenario(
+        "add user", "add_user_resource",
+        lambda i, c: ("POST", "/users", {"json": {"username": f"{c.key}{i}", "description": "New"}})
+    ),
+    Scenario(
+        "add club", "add_club_resource",
+        lambda i, c: ("POST", "/clubs", {"json": {"handle": f"{c.key}{i}", "owner": c.seeded.user(i)}})
+    ),
+    Scenario(
+        "bulk books x10", "add_books_bulk",
+        lambda i, c: ("POST", "/books:bulk", {"json": [
+            {"handle": f"{c.key}{i}-{j}", "full_name": "Bulk"} for j in range(0, 10)
+        ]})
+    ),
+    Scenario(
+        "bulk users x10", "add_users_bulk",
+        lambda i, c: ("POST", "/users:bulk", {"json": [{"username": f"{c.key}{i}-{j}"} for j in range(0, 10)]})
+    ),
+    Scenario(
+        "bulk clubs x10", "add_clubs_bulk",
+        lambda i, c: ("POST", "/clubs:bulk", {"json": [
+            {"handle": f"{c.key}{i}-{j}", "owner": c.seeded.user(i)} for j in range(0, 10)
+        ]})
+    ),
+    Scenario(
+        "edit user", "edit_user_resource",
+        lambda i, c: ("PUT", f"/users/{c.seeded.user(i)}", {"json": {
+            "username": c.seeded.user(i), "description": f"Edited {c.key}{i}"
+        }})
+    ),
+    Scenario(
+        "edit book", "edit_book_resource",
+        lambda i, c: ("PUT", f"/books/{c.seeded.book(i)}", {"json": {
+            "handle": c.seeded.book(i), "full_name": f"Edited {c.key}{i}"
+        }})
+    ),
+    Scenario(
+        "edit club", "edit_club_resource",
+        lambda i, c: ("PUT", f"/clubs/{c.seeded.club(i)}", {"json": {
+            "handle": c.seeded.club(i),
+            "owner": c.seeded.user(i % c.seeded.volumes.clubs),
+            "description": f"Edited {c.key}{i}"
+        }})
+    ),
+    Scenario(
+        "delete user", "delete_user_resource",
+        lambda i, c: ("DELETE", f"/users/{c.key}{i}", {}),
+        lambda client, n, c: created(client, n, c, "users", lambda h: {"username": h})
+    ),
+    Scenario(
+        "delete book", "delete_book_resource",
+        lambda i, c: ("DELETE", f"/books/{c.key}{i}", {}),
+        lambda client, n, c: created(client, n, c, "books", lambda h: {"handle": h, "full_name": "Deleted"})
+    ),
+    Scenario(
+        "delete club", "delete_club_resource",
+        lambda i, c: ("DELETE", f"/clubs/{c.key}{i}", {}),
+        lambda client, n, c: created(client, n, c, "clubs", lambda h: {"handle": h, "owner": c.seeded.user(0)})
+    ),
+]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Nearest rank percentile of sorted values
+    """
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Queries:
+    """
+    Counts statements executed on the application engine, explicit BEGINs (SQLite) are not queries
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self.record)
+
+    def record(self, _connection, _cursor, statement: str, *_):
+        if not statement.startswith("BEGIN"):
+            self.count += 1
+
+
+async def measure(
+        client: httpx.AsyncClient,
+        scenario: Scenario,
+        ctx: Context,
+        queries: Queries,
+        requests: int,
+        warmup: int,
+        concurrency: int
+) -> Dict[str, Any]:
+    if scenario.prepare is not None:
+        ctx.state = await scenario.prepare(client, warmup + requests, ctx)
+    for i in range(requests, requests + warmup):
+        m, url, kwargs = scenario.request(i, ctx)
+        await client.request(m, url, **kwargs)
+    indexes = iter(range(0, requests))
+    latencies: List[float] = list()
+    statuses = Counter()
+    method = scenario.request(0, ctx)[0]
+
+    async def worker():
+        for i in indexes:
+            m, url, kwargs = scenario.request(i, ctx)
+            start = time.perf_counter()
+            r = await client.request(m, url, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[r.status_code] += 1
+
+    before = queries.count
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(0, concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "scenario": scenario.name,
+        "route": scenario.route,
+        "method": method,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": sum(n for s, n in statuses.items() if s >= 400),
+        "status": {str(s): n for s, n in sorted(statuses.items())},
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 3),
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3),
+        },
+        "rps": round(requests / elapsed, 1),
+        "queries_per_request": round((queries.count - before) / requests, 2),
+    }
+
+
+def regressions(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """
+    Compare p95 latency and queries per request against a previous run
+
+    :param results:     Results of this run
+    :param baseline:    Results of the baseline run
+    :param tolerance:   Allowed relative p95 increase
+    :return:            Descriptions of regressions
+    """
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline}
+    found = list()
+    for r in results:
+        b = previous.get((r["scenario"], r["concurrency"]))
+        if b is None:
+            continue
+        name = f"{r['scenario']} (c={r['concurrency']})"
+        if r["latency_ms"]["p95"] > b["latency_ms"]["p95"] * (1 + tolerance):
+            found.append(f"{name}: p95 {b['latency_ms']['p95']} -> {r['latency_ms']['p95']} ms")
+        if r["queries_per_request"] > b["queries_per_request"]:
+            found.append(f"{name}: queries {b['queries_per_request']} -> {r['queries_per_request']}")
+        if r["errors"] > b["errors"]:
+            found.append(f"{name}: errors {b['errors']} -> {r['errors']}")
+    return found
+
+
+async def run(args: argparse.Namespace, seeded, api, engine) -> List[Dict[str, Any]]:
+    # Blocking data access runs in the default executor, size it like the server would
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.threads))
+    queries = Queries(engine)
+    results = list()
+    transport = httpx.ASGITransport(app=api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        runs = 0
+        for scenario in SCENARIOS:
+            if args.only and not any(o in scenario.name or o == scenario.route for o in args.only):
+                continue
+            for concurrency in args.concurrency:
+                runs += 1
+                ctx = Context(seeded, f"{seeded.prefix}{runs:x}-")
+                result = await measure(client, scenario, ctx, queries, args.requests, args.warmup, concurrency)
+                results.append(result)
+                print(
+                    f"{scenario.name:<24} c={concurrency:<3} "
+                    f"p50 {result['latency_ms']['p50']:>8.2f} ms  "
+                    f"p95 {result['latency_ms']['p95']:>8.2f} ms  "
+                    f"p99 {result['latency_ms']['p99']:>8.2f} ms  "
+                    f"{result['rps']:>8.1f} rps  "
+                    f"{result['queries_per_request']:>5.2f} q/req  "
+                    f"{result['errors']} errors",
+                    file=sys.stderr
+                )
+    return results
+
+
+def main():
+    defaults = Volumes()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("book_club_db_url"), help="Database url (default: new SQLite file)")
+    for field in Volumes._fields:
+        parser.add_argument(f"--{field.replace('_', '-')}", type=int, default=getattr(defaults, field))
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario and level")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests before each measurement")
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 8, 32])
+    parser.add_argument("--threads", type=int, default=40, help="Worker threads for blocking calls (40)")
+    parser.add_argument("--only", action="append", help="Run scenarios whose name contains this or route equals this")
+    parser.add_argument("--output", help="Write results here instead of stdout")
+    parser.add_argument("--baseline", help="Results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p95 increase (0.2)")
+    args = parser.parse_args()
+
+    url = args.url
+    if url is None:
+        url = f"sqlite:///{tempfile.mkdtemp()}/bookclub-benchmark.db?check_same_thread=false&timeout=30"
+    os.environ["book_club_db_url"] = url
+    os.environ.pop("book_club_async", None)
+    if url.startswith("sqlite"):
+        sqlite_schema(url).dispose()
+
+    from bookclub import api
+    from bookclub.data import support
+
+    engine = support.sync_engine()
+    if engine.dialect.name == "sqlite":
+        sqlite_locking(engine)
+    volumes = Volumes(**{f: getattr(args, f) for f in Volumes._fields})
+    start = time.perf_counter()
+    db = support.SessionLocal()
+    try:
+        seeded = seed(db, volumes)
+    finally:
+        db.close()
+    seeding = time.perf_counter() - start
+    print(f"seeded {volumes} in {seeding:.1f} s", file=sys.stderr)
+
+    results = asyncio.run(run(args, seeded, api, engine))
+
+    from fastapi.routing import APIRoute
+    from bookclub.resources import paths
+    routes = {r.name for r in api.routes if isinstance(r, APIRoute) and r.endpoint.__module__ == paths.__name__}
+    uncovered = sorted(routes - {s.route for s in SCENARIOS})
+    if uncovered:
+        print(f"routes without a scenario: {', '.join(uncovered)}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": engine.url.get_backend_name(),
+            "volumes": volumes._asdict(),
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "threads": args.threads,
+            "seed_seconds": round(seeding, 2),
+            "uncovered_routes": uncovered,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f)["results"], args.tolerance)
+        for r in found:
+            print(f"REGRESSION {r}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
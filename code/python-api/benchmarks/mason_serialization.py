@@ -0,0 +1,69 @@
+"""
+Microbenchmark for Mason response serialization
+
+Compares the response_model path (validation + jsonable_encoder + JSONResponse)
+against MasonResponse for a Books collection with controls on every item.
+
+Usage:
+    python benchmarks/mason_serialization.py [items] [rounds]
+"""
+import asyncio
+import sys
+import timeit
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from bookclub.data.model import Book, Books
+from bookclub.mason import Control, MasonResponse
+
+
+def payload(items: int) -> Books:
+    books = Books(items=[
+        Book(
+            handle=f"book-{i}",
+            full_name=f"Book number {i}",
+            description="A benchmark book",
+            pages=i % 2000
+        ) for i in range(0, items)
+    ])
+    for b in books.items:
+        href = f"http://localhost:8000/books/{b.handle}"
+        b.controls = {
+            "self": Control.construct(href=href, method="GET"),
+            "edit": Control.construct(href=href, method="PUT"),
+            "delete": Control.construct(href=href, method="DELETE"),
+            "bc:home": Control.construct(href="http://localhost:8000/"),
+        }
+    return books
+
+
+def response_model_path(books: Books, field) -> bytes:
+    content = asyncio.run(serialize_response(
+        field=field,
+        response_content=books,
+        exclude_defaults=True,
+        exclude_none=True
+    ))
+    return JSONResponse(content).body
+
+
+def mason_path(books: Books) -> bytes:
+    return MasonResponse(books).body
+
+
+def main(items: int = 10000, rounds: int = 5):
+    books = payload(items)
+    field = create_response_field(name="Response_get_books_resource", type_=Books)
+    assert len(response_model_path(books, field)) > 0 and len(mason_path(books)) > 0
+    old = min(timeit.repeat(lambda: response_model_path(books, field), number=1, repeat=rounds))
+    new = min(timeit.repeat(lambda: mason_path(books), number=1, repeat=rounds))
+    print(f"items:          {items}")
+    print(f"response_model: {old * 1000:.1f} ms")
+    print(f"MasonResponse:  {new * 1000:.1f} ms")
+    print(f"speedup:        {old / new:.1f}x")
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
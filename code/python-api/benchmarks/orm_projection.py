@@ -0,0 +1,115 @@
+"""
+Microbenchmark for building external models from ORM instances versus column projections
+
+Reads the same seeded users, books and clubs either as ORM entities converted with from_orm,
+the way the reads used to work, or as the column projections data_access uses now.
+Every read uses a new session, so identity map and instance state costs are included.
+
+The database is a fresh SQLite file unless book_club_db_url points to a database with init.sql loaded.
+
+Usage:
+    python benchmarks/orm_projection.py [rows] [rounds]
+"""
+import os
+import sys
+import tempfile
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+from seed import Volumes, sqlite_schema, seed
+
+
+def readers(prefix: str) -> Dict[str, Tuple[Callable, Callable]]:
+    """
+    Old and new read of every collection, both return external models
+    """
+    from sqlalchemy.orm import joinedload
+    from bookclub.data import data_access as da
+    from bookclub.data.model import db_models as internal
+    from bookclub.data.model import data_models as external
+
+    def old_club(c: internal.Club) -> external.Club:
+        return external.Club(
+            owner=(c.owner.username if c.owner.deleted != 1 else "deleted") if c.owner_id is not None else None,
+            **external.ClubInternalBase.from_orm(c).dict(exclude_none=True)
+        )
+
+    user, book, club = internal.User, internal.Book, internal.Club
+    return {
+        "users": (
+            lambda db: [
+                external.User.from_orm(x) for x in
+                db.query(user).where(user.username.startswith(prefix)).order_by(user.username)
+            ],
+            lambda db: [
+                external.User(**da._values(x, da.USER_COLUMNS)) for x in
+                db.query(*da.USER_COLUMNS).where(user.username.startswith(prefix)).order_by(user.username)
+            ]
+        ),
+        "books": (
+            lambda db: [
+                external.Book.from_orm(x) for x in
+                db.query(book).where(book.handle.startswith(prefix)).order_by(book.handle)
+            ],
+            lambda db: [
+                external.Book(**da._values(x, da.BOOK_COLUMNS)) for x in
+                db.query(*da.BOOK_COLUMNS).where(book.handle.startswith(prefix)).order_by(book.handle)
+            ]
+        ),
+        "clubs": (
+            lambda db: [
+                old_club(x) for x in
+                db.query(club).options(joinedload(club.owner)).where(club.handle.startswith(prefix)).order_by(
+                    club.handle
+                )
+            ],
+            lambda db: [
+                da._club(x) for x in
+                da._clubs(db).where(club.handle.startswith(prefix)).order_by(club.handle)
+            ]
+        ),
+    }
+
+
+def timed(session: Callable, read: Callable, rounds: int) -> Tuple[float, List]:
+    def run():
+        db = session()
+        try:
+            return read(db)
+        finally:
+            db.close()
+
+    return min(timeit.repeat(run, number=1, repeat=rounds)), run()
+
+
+def main(rows: int = 2000, rounds: int = 5):
+    url = os.getenv("book_club_db_url")
+    if url is None:
+        url = f"sqlite:///{tempfile.mkdtemp()}/bookclub-projection.db"
+        os.environ["book_club_db_url"] = url
+        sqlite_schema(url).dispose()
+    os.environ.pop("book_club_async", None)
+
+    from bookclub.data import support
+    support.init(url, test=False)
+
+    db = support.SessionLocal()
+    try:
+        seeded = seed(db, Volumes(users=rows, books=rows, clubs=rows, user_books=0, reviews=0, comments=0))
+    finally:
+        db.close()
+
+    print(f"rows:   {rows}")
+    for name, (old, new) in readers(seeded.prefix).items():
+        old_time, old_items = timed(support.SessionLocal, old, rounds)
+        new_time, new_items = timed(support.SessionLocal, new, rounds)
+        assert old_items == new_items and len(new_items) == rows
+        print(
+            f"{name + ':':<7} from_orm {old_time / rows * 1e6:.1f} us/row, "
+            f"projection {new_time / rows * 1e6:.1f} us/row, "
+            f"speedup {old_time / new_time:.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
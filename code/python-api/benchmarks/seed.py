@@ -0,0 +1,246 @@
+"""
+Benchmark database setup and seeding
+
+MySQL databases need the schema from database/setup/init.sql, SQLite databases get an approximation of it:
+the tables are created from the ORM models with case-insensitive text like the _ci collations
+and the triggers are ported, except that the books_statistics view is missing. Seeded rows are
+prefixed with a run id, so a seeded database can be reused or shared with other data.
+
+Importing the bookclub modules takes a while, so they are imported only when needed.
+"""
+import random
+import string
+from typing import NamedTuple, List, Tuple
+
+from sqlalchemy import create_engine, event, text, DefaultClause
+from sqlalchemy.dialects.mysql import ENUM, TINYINT
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+
+WORDS = [
+    "dragon", "river", "garden", "winter", "empire", "harbor", "silver", "forest", "machine", "letter",
+    "island", "shadow", "mirror", "summer", "castle", "voyage", "engine", "orchard", "signal", "desert",
+]
+
+
+class Volumes(NamedTuple):
+    users: int = 1000
+    books: int = 2000
+    clubs: int = 200
+    user_books: int = 5000
+    reviews: int = 2000
+    comments: int = 2000
+
+
+class Seeded(NamedTuple):
+    prefix: str
+    volumes: Volumes
+
+    def user(self, i: int) -> str:
+        return f"{self.prefix}u{i % self.volumes.users}"
+
+    def book(self, i: int) -> str:
+        return f"{self.prefix}b{i % self.volumes.books}"
+
+    def club(self, i: int) -> str:
+        return f"{self.prefix}c{i % self.volumes.clubs}"
+
+    def review(self, i: int) -> Tuple[str, str]:
+        """
+        (user, book) of a seeded review
+        """
+        i = i % self.volumes.reviews
+        return self.user(i), self.book(i // self.volumes.users)
+
+    def commented(self, i: int) -> Tuple[str, str]:
+        """
+        (user, book) of a seeded review with comments
+        """
+        return self.review(i * self.volumes.users % max(self.volumes.reviews, 1))
+
+
+@compiles(ENUM, "sqlite")
+def _sqlite_enum(*_, **__):
+    return "VARCHAR(16)"
+
+
+@compiles(TINYINT, "sqlite")
+def _sqlite_tinyint(*_, **__):
+    return "INTEGER"
+
+
+SQLITE_TRIGGERS = [
+    "CREATE TRIGGER trg_books_stats AFTER INSERT ON books BEGIN INSERT INTO book_stats (book_id) VALUES (new.id); END",
+    "INSERT INTO collection_versions (name) VALUES ('users'), ('books'), ('clubs'), ('reviews')",
+]
+
+# Book statistics like in init.sql, SQLite deletes user_books rows of deleted users with triggers
+_UBL_STATS = (
+    "UPDATE book_stats SET readers = readers {op} ({row}.reading_status IS 'reading'), "
+    "completed = completed {op} ({row}.reading_status IS 'complete'), "
+    "pending = pending {op} ({row}.reading_status IS 'pending'), "
+    "liked = liked {op} ({row}.liked IS 1), disliked = disliked {op} ({row}.liked IS 0) "
+    "WHERE book_id = {row}.book_id;"
+)
+_REVIEW_STATS = (
+    "UPDATE book_stats SET reviews = reviews {op} 1, stars = stars {op} {row}.stars WHERE book_id = {row}.book_id;"
+)
+SQLITE_TRIGGERS.extend([
+    "CREATE TRIGGER trg_review_status AFTER INSERT ON reviews BEGIN "
+    "UPDATE user_books SET reviewed = 1 WHERE user_id = new.user_id AND book_id = new.book_id; END",
+    "CREATE TRIGGER trg_book_stats_review_insert AFTER INSERT ON reviews BEGIN "
+    + _REVIEW_STATS.format(op='+', row='new') + " END",
+    "CREATE TRIGGER trg_book_stats_review_update AFTER UPDATE ON reviews BEGIN "
+    + _REVIEW_STATS.format(op='-', row='old') + " " + _REVIEW_STATS.format(op='+', row='new') + " END",
+    "CREATE TRIGGER trg_book_stats_review_delete AFTER DELETE ON reviews BEGIN "
+    + _REVIEW_STATS.format(op='-', row='old') + " END",
+    "CREATE TRIGGER trg_book_stats_ubl_insert AFTER INSERT ON user_books BEGIN "
+    + _UBL_STATS.format(op='+', row='new') + " END",
+    "CREATE TRIGGER trg_book_stats_ubl_update AFTER UPDATE ON user_books BEGIN "
+    + _UBL_STATS.format(op='-', row='old') + " " + _UBL_STATS.format(op='+', row='new') + " END",
+    "CREATE TRIGGER trg_book_stats_ubl_delete AFTER DELETE ON user_books BEGIN "
+    + _UBL_STATS.format(op='-', row='old') + " END",
+])
+
+# Row and collection versions like in init.sql, SQLite can't assign to new so the row is updated again
+for _table in ('users', 'books', 'clubs'):
+    SQLITE_TRIGGERS.append(
+        f"CREATE TRIGGER trg_{_table}_version AFTER UPDATE ON {_table} WHEN new.version = old.version "
+        f"BEGIN UPDATE {_table} SET version = old.version + 1 WHERE id = new.id; END"
+    )
+for _table in ('users', 'books', 'clubs', 'reviews'):
+    for _event in ('INSERT', 'UPDATE', 'DELETE'):
+        SQLITE_TRIGGERS.append(
+            f"CREATE TRIGGER trg_{_table}_collection_{_event.lower()} AFTER {_event} ON {_table} "
+            f"BEGIN UPDATE collection_versions SET version = version + 1 WHERE name = '{_table}'; END"
+        )
+
+
+def sqlite_schema(url: str) -> Engine:
+    """
+    Create the schema in an empty SQLite database
+
+    :param url: SQLite url
+    :return:    Engine
+    """
+    from bookclub.data.model import db_models as internal
+    for table in internal.metadata.sorted_tables:
+        for column in table.columns:
+            if getattr(column.type, 'collation', None):
+                column.type.collation = 'NOCASE' if column.type.collation.endswith('_ci') else None
+            default = column.server_default
+            if default is not None and hasattr(default.arg, 'text'):
+                if 'current_timestamp' in default.arg.text:
+                    column.server_default = DefaultClause(text("CURRENT_TIMESTAMP"))
+                elif 'uuid_short' in default.arg.text:
+                    column.server_default = DefaultClause(text("(abs(random()) % 1000000000000)"))
+    engine = create_engine(url)
+    internal.metadata.create_all(engine, tables=[
+        t for t in internal.metadata.sorted_tables if t.name != 'books_statistics'
+    ])
+    with engine.begin() as c:
+        for statement in SQLITE_TRIGGERS:
+            c.execute(text(statement))
+    return engine
+
+
+def sqlite_locking(engine: Engine):
+    """
+    Take the write lock when a transaction begins
+
+    Deferred SQLite transactions that read before writing deadlock each other under concurrency,
+    so concurrent requests queue on the lock instead. Readers still see WAL snapshots.
+
+    :param engine:  SQLite engine without connections yet
+    """
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, _):
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _ids(db: Session, cls, column, prefix: str) -> List[int]:
+    return [
+        r[0] for r in db.query(cls.id).where(column.startswith(prefix, autoescape=True)).order_by(cls.id).all()
+    ]
+
+
+def seed(db: Session, volumes: Volumes, prefix: str = None) -> Seeded:
+    """
+    Seed users, books and clubs through the bulk data access functions and the rest with plain inserts
+
+    :param db:      ORM Session, committed at the end
+    :param volumes: Number of rows to create
+    :param prefix:  Prefix of all handles (default: random)
+    :return:        Seeded data
+    """
+    from bookclub import data as da
+    from bookclub.data.model import db_models as internal
+    rnd = random.Random(str(volumes))
+    if prefix is None:
+        prefix = ''.join(random.choice(string.ascii_lowercase) for _ in range(0, 6)) + '-'
+    seeded = Seeded(prefix, volumes)
+
+    def words(n: int) -> str:
+        return ' '.join(rnd.choice(WORDS) for _ in range(0, n))
+
+    da.bulk_create_users([
+        (i, da.NewUser(username=seeded.user(i), description=f"A reader of {words(3)}"))
+        for i in range(0, volumes.users)
+    ], db)
+    da.bulk_create_books([
+        (i, da.NewBook(
+            handle=seeded.book(i),
+            full_name=f"The {words(2)}".title(),
+            description=f"A book about {words(8)}",
+            pages=rnd.randint(50, 1500)
+        )) for i in range(0, volumes.books)
+    ], db)
+    da.bulk_create_clubs([
+        (i, da.NewClub(handle=seeded.club(i), owner=seeded.user(i), description=f"We read {words(4)}"))
+        for i in range(0, volumes.clubs)
+    ], db)
+    users = _ids(db, internal.User, internal.User.username, prefix)
+    books = _ids(db, internal.Book, internal.Book.handle, prefix)
+
+    pairs = len(users) * len(books)
+
+    def pair(j: int) -> Tuple[int, int]:
+        return users[j % len(users)], books[(j // len(users)) % len(books)]
+
+    if volumes.user_books:
+        db.execute(internal.UserBook.__table__.insert(), [
+            dict(
+                user_id=u,
+                book_id=b,
+                reading_status=rnd.choice(['pending', 'reading', 'complete']),
+                liked=rnd.choice([None, 0, 1]),
+                current_page=rnd.randint(0, 50)
+            ) for u, b in map(pair, range(max(0, pairs - volumes.user_books), pairs))
+        ])
+    if volumes.reviews:
+        db.execute(internal.Review.__table__.insert(), [
+            dict(user_id=u, book_id=b, stars=rnd.randint(1, 5), title=words(3), content=f"I liked the {words(12)}")
+            for u, b in map(pair, range(0, volumes.reviews))
+        ])
+    if volumes.comments and volumes.reviews:
+        # All comments go to the reviews of the first user, see Seeded.commented
+        db.execute(internal.Comment.__table__.insert(), [
+            dict(user_id=users[i % len(users)], content=f"{prefix} {words(6)}") for i in range(0, volumes.comments)
+        ])
+        reviews = [r[0] for r in db.query(internal.Review.id).where(internal.Review.user_id == users[0]).all()]
+        comments = _ids(db, internal.Comment, internal.Comment.content, prefix + ' ')
+        db.execute(internal.t_review_comment_link.insert(), [
+            dict(review_id=reviews[i % len(reviews)], comment_id=c) for i, c in enumerate(comments)
+        ])
+    db.commit()
+    return seeded
+
+
+__all__ = ['Volumes', 'Seeded', 'sqlite_schema', 'sqlite_locking', 'seed']
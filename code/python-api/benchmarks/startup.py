@@ -0,0 +1,130 @@
+"""
+Cold start of the API
+
+Every round starts a new interpreter that imports bookclub.app, creates the application, runs the startup
+events and sends two requests, and reports the time of each phase. Modules are loaded from the bytecode cache,
+the first round fills it and is not measured. The medians of all rounds are printed, compare them with
+an earlier --output by passing it as --baseline.
+
+The database is a fresh SQLite file unless --url (or book_club_db_url) points to a database with init.sql loaded.
+
+Usage:
+    python benchmarks/startup.py [--rounds 10] [--path /books?limit=20] [--output startup.json] [--baseline startup.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from seed import Volumes, sqlite_schema, seed
+
+"""
+Phases in the order they run, each in milliseconds
+"""
+PHASES = ("import", "create_app", "startup", "first_request", "second_request", "total")
+
+
+def child(path: str):
+    """
+    Measure one cold start and print the phases as JSON
+    """
+    import httpx
+
+    started = time.perf_counter()
+    from bookclub.app import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+
+    async def requests() -> List[float]:
+        done = [time.perf_counter()]
+        await app.router.startup()
+        done.append(time.perf_counter())
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for _ in range(0, 2):
+                response = await client.get(path)
+                assert response.status_code == 200, response.text
+                done.append(time.perf_counter())
+        await app.router.shutdown()
+        return done
+
+    begun, up, first, second = asyncio.run(requests())
+    print(json.dumps({
+        "import": (imported - started) * 1000,
+        "create_app": (created - imported) * 1000,
+        "startup": (up - begun) * 1000,
+        "first_request": (first - up) * 1000,
+        "second_request": (second - first) * 1000,
+        "total": (first - started) * 1000,
+    }))
+
+
+def measure(rounds: int, path: str) -> Dict[str, float]:
+    samples: Dict[str, List[float]] = {p: list() for p in PHASES}
+    for n in range(0, rounds + 1):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", path],
+            check=True,
+            stdout=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        if n == 0:
+            continue
+        for phase, ms in json.loads(out).items():
+            samples[phase].append(ms)
+    return {p: round(statistics.median(v), 2) for p, v in samples.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("book_club_db_url"), help="Database url (default: new SQLite file)")
+    parser.add_argument("--rounds", type=int, default=10, help="Measured cold starts")
+    parser.add_argument("--path", default="/books?limit=20", help="Path of both requests")
+    parser.add_argument("--output", help="Write the medians as JSON to this file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child)
+        return
+
+    url = args.url
+    if url is None:
+        url = f"sqlite:///{tempfile.mkdtemp()}/bookclub-startup.db?check_same_thread=false"
+    os.environ["book_club_db_url"] = url
+    os.environ.pop("book_club_async", None)
+    if url.startswith("sqlite"):
+        sqlite_schema(url).dispose()
+        from bookclub.data import support
+        support.init(url, test=False)
+        db = support.SessionLocal()
+        try:
+            seed(db, Volumes(users=50, books=50, clubs=10, user_books=0, reviews=0, comments=0))
+        finally:
+            db.close()
+
+    results = measure(args.rounds, args.path)
+    previous = dict()
+    if args.baseline:
+        with open(args.baseline) as f:
+            previous = json.load(f)
+    for phase in PHASES:
+        line = f"{phase:<16} {results[phase]:>9.2f} ms"
+        if phase in previous:
+            line += f"  (was {previous[phase]:.2f} ms)"
+        print(line, file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
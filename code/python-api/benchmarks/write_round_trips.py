@@ -0,0 +1,125 @@
+"""
+Database round trips per write request
+
+Runs the POST, PUT and DELETE scenarios of the load test one request at a time and counts the statements
+every request sends to the database by kind, savepoints included. A conflicting create is sent last,
+it has to answer 409. Run it before and after a change to the transaction handling and compare,
+or pass --baseline to print the difference to an earlier --output.
+
+The database is a fresh SQLite file unless --url (or book_club_db_url) points to a database with init.sql loaded.
+
+Usage:
+    python benchmarks/write_round_trips.py [--requests 20] [--output trips.json] [--baseline trips.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from collections import Counter
+from typing import Dict, Any, List
+
+import httpx
+
+from api_load import SCENARIOS, Context
+from seed import Volumes, sqlite_schema, seed
+
+"""
+Route name prefixes of the write routes
+"""
+WRITES = ("add_", "edit_", "delete_")
+
+
+class Statements:
+    """
+    Counts statements by their first keyword, explicit BEGINs (SQLite) are not round trips of their own
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.kinds = Counter()
+        event.listen(engine, "before_cursor_execute", self.record)
+
+    def record(self, _connection, _cursor, statement: str, *_):
+        kind = statement.lstrip().split(None, 1)[0].upper()
+        if kind != "BEGIN":
+            self.kinds[kind] += 1
+
+
+async def run(requests: int, seeded, api, statements: Statements) -> List[Dict[str, Any]]:
+    results = list()
+    transport = httpx.ASGITransport(app=api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for n, scenario in enumerate(SCENARIOS):
+            if not scenario.route.startswith(WRITES):
+                continue
+            ctx = Context(seeded, f"{seeded.prefix}t{n:x}-")
+            if scenario.prepare is not None:
+                ctx.state = await scenario.prepare(client, requests, ctx)
+            before = statements.kinds.copy()
+            statuses = Counter()
+            for i in range(0, requests):
+                method, url, kwargs = scenario.request(i, ctx)
+                statuses[(await client.request(method, url, **kwargs)).status_code] += 1
+            kinds = statements.kinds - before
+            results.append({
+                "scenario": scenario.name,
+                "status": {str(s): c for s, c in sorted(statuses.items())},
+                "statements_per_request": round(sum(kinds.values()) / requests, 2),
+                "savepoints_per_request": round(
+                    sum(kinds[k] for k in ("SAVEPOINT", "RELEASE", "ROLLBACK")) / requests, 2
+                ),
+                "by_kind": {k: round(v / requests, 2) for k, v in sorted(kinds.items())},
+            })
+        response = await client.post("/books", json={"handle": seeded.book(0), "full_name": "Conflict"})
+        assert response.status_code == 409, response.text
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("book_club_db_url"), help="Database url (default: new SQLite file)")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per scenario")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    url = args.url
+    if url is None:
+        url = f"sqlite:///{tempfile.mkdtemp()}/bookclub-trips.db?check_same_thread=false"
+    os.environ["book_club_db_url"] = url
+    os.environ.pop("book_club_async", None)
+    if url.startswith("sqlite"):
+        sqlite_schema(url).dispose()
+
+    from bookclub import api
+    from bookclub.data import support
+
+    db = support.SessionLocal()
+    try:
+        seeded = seed(db, Volumes(users=200, books=200, clubs=50, user_books=0, reviews=0, comments=0))
+    finally:
+        db.close()
+
+    results = asyncio.run(run(args.requests, seeded, api, Statements(support.sync_engine())))
+    previous = dict()
+    if args.baseline:
+        with open(args.baseline) as f:
+            previous = {r["scenario"]: r for r in json.load(f)}
+    for r in results:
+        line = (
+            f"{r['scenario']:<16} {r['statements_per_request']:>6.2f} statements  "
+            f"{r['savepoints_per_request']:>5.2f} savepoint  {r['status']}"
+        )
+        b = previous.get(r["scenario"])
+        if b is not None:
+            line += f"  (was {b['statements_per_request']:.2f} / {b['savepoints_per_request']:.2f})"
+        print(line, file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,16 @@
-from . import data, mason, resources, utils
-from .api import api
+"""
+Book club API, the application is built on first access of api and the subpackages are imported lazily
+"""
+from importlib import import_module
 
 __all__ = ['api', 'data', 'mason', 'resources', 'utils']
+
+
+def __getattr__(name: str):
+    if name == 'api':
+        from .app import create_app
+        globals()['api'] = create_app()
+        return globals()['api']
+    if name in __all__:
+        return import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
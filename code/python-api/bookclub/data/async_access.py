@@ -0,0 +1,119 @@
+"""
+Async port of the data access functions
+
+Every public function of data_access is available here as a coroutine function with the same signature,
+streaming functions become async iterators. Awaiting them never blocks the event loop:
+
+- With an AsyncSession (init(..., asynchronous=True)) they run in the session greenlet through run_sync
+- With a plain Session they run in the thread pool
+"""
+import inspect
+from contextlib import asynccontextmanager, contextmanager
+from functools import wraps, lru_cache
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, List
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from . import data_access, support
+from .data_access import STREAM_BATCH_SIZE
+
+
+@lru_cache(maxsize=None)
+def _signature(func: Callable) -> inspect.Signature:
+    return inspect.signature(func)
+
+
+async def call(func: Callable, *args, **kwargs) -> Any:
+    """
+    Call a synchronous function taking a db parameter without blocking
+
+    :param func:    Function to call, must have a parameter named db
+    :param args:    Pass-through to func
+    :param kwargs:  Pass-through to func
+    :return:        Return value of func
+    """
+    bound = _signature(func).bind(*args, **kwargs)
+    db = bound.arguments['db']
+    if isinstance(db, AsyncSession):
+        def run(session):
+            bound.arguments['db'] = session
+            return func(*bound.args, **bound.kwargs)
+
+        return await db.run_sync(run)
+    else:
+        return await run_in_threadpool(func, *args, **kwargs)
+
+
+async def iterate(func: Callable, *args, **kwargs) -> AsyncIterator:
+    """
+    Iterate a synchronous generator function taking a db parameter without blocking
+
+    Items are fetched in batches of STREAM_BATCH_SIZE.
+
+    :param func:    Generator function, must have a parameter named db
+    :param args:    Pass-through to func
+    :param kwargs:  Pass-through to func
+    :return:        Async iterator over the items
+    """
+    bound = _signature(func).bind(*args, **kwargs)
+    db = bound.arguments['db']
+    if isinstance(db, AsyncSession):
+        bound.arguments['db'] = db.sync_session
+    items = func(*bound.args, **bound.kwargs)
+
+    def batch(_=None) -> List:
+        return list(islice(items, STREAM_BATCH_SIZE))
+
+    while True:
+        out = await (db.run_sync(batch) if isinstance(db, AsyncSession) else run_in_threadpool(batch))
+        if len(out) == 0:
+            break
+        for item in out:
+            yield item
+
+
+def port(func: Callable) -> Callable:
+    """
+    Port a data access function
+
+    :param func:    Function to port
+    :return:        Coroutine function or async generator function for generators
+    """
+    if inspect.isgeneratorfunction(func):
+        @wraps(func)
+        def ported(*args, **kwargs) -> AsyncIterator:
+            return iterate(func, *args, **kwargs)
+    else:
+        @wraps(func)
+        async def ported(*args, **kwargs) -> Any:
+            return await call(func, *args, **kwargs)
+    return ported
+
+
+@asynccontextmanager
+async def session():
+    """
+    Open a session outside of dependency injection, e.g. for streaming responses
+
+    Same transaction handling as the database dependency.
+    """
+    if support.async_mode:
+        async with asynccontextmanager(support.database)() as db:
+            yield db
+    else:
+        cm = contextmanager(support.database)()
+        db = await run_in_threadpool(cm.__enter__)
+        try:
+            yield db
+        except BaseException as e:
+            if not await run_in_threadpool(cm.__exit__, type(e), e, e.__traceback__):
+                raise
+        else:
+            await run_in_threadpool(cm.__exit__, None, None, None)
+
+
+globals().update({name: port(getattr(data_access, name)) for name in data_access.__all__})
+
+__all__ = ['call', 'iterate', 'port', 'session', *data_access.__all__]
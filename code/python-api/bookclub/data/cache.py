@@ -0,0 +1,209 @@
+"""
+Process local entity reference cache
+
+Caches the (id, deleted, handle) of entities by handle, so write paths don't have to query
+them again for every request. The data access functions invalidate the entries they write, once during
+the write and once more when the transaction ends, committed or rolled back. Every invalidation gets a
+generation, and a reference is only cached if its key wasn't invalidated since the transaction that read
+it began, so a transaction with an older snapshot can't put back what a concurrent write dropped.
+Other processes can't invalidate entries, so stale entries live at most TTL seconds.
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import NamedTuple, Optional, Tuple, Dict, Hashable, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from ..utils.metrics import CACHE_LOOKUPS, CACHE_ENTRIES
+
+_PENDING = 'bookclub_entity_keys'
+_LOCAL = 'bookclub_entity_refs'
+_SINCE = 'bookclub_entity_generation'
+
+
+class Ref(NamedTuple):
+    """
+    Reference to an entity
+    """
+    id: int
+    deleted: bool
+    handle: str
+
+
+class EntityCache:
+    """
+    LRU cache with a TTL for entity references
+
+    Keys are (entity, handle) tuples. The generations of the last size invalidated keys are kept,
+    older ones only raise a floor that refuses all puts from transactions that began before it.
+    """
+
+    def __init__(self, size: int = 4096, ttl: float = 30):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._floor = 0
+        self._lock = Lock()
+        self._entries: Dict[Hashable, Tuple[float, Ref]] = OrderedDict()
+        self._invalidated: Dict[Hashable, int] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Ref]:
+        """
+        Get a reference
+
+        :param key: Cache key
+        :return:    Reference or None if not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                CACHE_LOOKUPS.inc('miss')
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.inc('hit')
+            return entry[1]
+
+    def put(self, key: Hashable, ref: Ref, since: int = None):
+        """
+        Cache a reference, evicting the least recently used one if full
+
+        :param key:     Cache key
+        :param ref:     Reference
+        :param since:   Generation when the reading transaction began, the reference isn't cached
+                        if the key was invalidated after it
+        """
+        if self.size <= 0:
+            return
+        with self._lock:
+            if since is not None and (self._floor > since or self._invalidated.get(key, -1) > since):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, ref)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            CACHE_ENTRIES.set(len(self._entries))
+
+    def invalidate(self, *keys: Hashable):
+        """
+        Remove references from the cache
+
+        :param keys: Cache keys
+        """
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+                self._invalidated[key] = self.generation
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > max(self.size, 1):
+                self._floor = max(self._floor, self._invalidated.popitem(last=False)[1])
+            CACHE_ENTRIES.set(len(self._entries))
+
+    def get_read(self, db: Session, key: Hashable) -> Optional[Ref]:
+        """
+        Get a reference for the current transaction of a session
+
+        :param db:  ORM Session
+        :param key: Cache key
+        :return:    Reference or None if not cached or expired
+        """
+        if key not in db.info.get(_PENDING, ()):
+            return self.get(key)
+        ref = db.info.get(_LOCAL, {}).get(key)
+        if ref is None:
+            self.misses += 1
+            CACHE_LOOKUPS.inc('miss')
+        else:
+            self.hits += 1
+            CACHE_LOOKUPS.inc('hit')
+        return ref
+
+    def put_read(self, db: Session, key: Hashable, ref: Ref):
+        """
+        Cache a reference read in the current transaction of a session
+
+        Keys the transaction wrote itself are only cached for the session until it ends,
+        the writes might never be committed.
+
+        :param db:  ORM Session
+        :param key: Cache key
+        :param ref: Reference
+        """
+        if key in db.info.get(_PENDING, ()):
+            db.info.setdefault(_LOCAL, dict())[key] = ref
+        else:
+            self.put(key, ref, db.info.get(_SINCE))
+
+    def invalidate_on_commit(self, db: Session, *keys: Hashable):
+        """
+        Invalidate now and again when the transaction ends
+
+        References read by other transactions before the commit would otherwise be cached with the old data,
+        after a rollback the keys are dropped in case this transaction cached its own uncommitted writes.
+
+        :param db:      ORM Session
+        :param keys:    Cache keys
+        """
+        self.invalidate(*keys)
+        db.info.setdefault(_PENDING, set()).update(keys)
+        local = db.info.get(_LOCAL)
+        if local is not None:
+            for key in keys:
+                local.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all references from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            CACHE_ENTRIES.set(0)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Cache statistics
+
+        :return: Dict of size, hits and misses
+        """
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+entities = EntityCache(
+    size=int(os.getenv("book_club_cache_size", 4096)),
+    ttl=float(os.getenv("book_club_cache_ttl", 30))
+)
+
+
+@event.listens_for(Session, "after_begin")
+def _begin(session: Session, *_):
+    session.info.setdefault(_SINCE, entities.generation)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _end(session: Session, transaction):
+    """
+    Savepoints end too, the keys are kept for the outermost transaction
+    """
+    if transaction.parent is not None:
+        return
+    session.info.pop(_SINCE, None)
+    session.info.pop(_LOCAL, None)
+    keys: Iterable[Hashable] = session.info.pop(_PENDING, ())
+    if keys:
+        entities.invalidate(*keys)
+
+
+__all__ = ['Ref', 'EntityCache', 'entities']
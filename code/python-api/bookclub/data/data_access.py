@@ -3,33 +3,106 @@ Utilities for interacting with the database
 
 No checking for duplicates is needed, all public function handle it by themselves.
 On any error (duplicate, missing etc.) a HTTPError is thrown with an appropriate error code
+
+Writes share the transaction of the session. Savepoints are only used where a failed statement is recovered from
+and the transaction goes on, like in the bulk imports. Any other failed write fails the whole transaction.
 """
-from typing import Union, Tuple, Optional, Type, Any, TypeVar, Dict, NoReturn, Set
+import re
+from contextlib import contextmanager
+from itertools import islice
+from typing import Union, Tuple, Optional, Type, Any, TypeVar, Dict, NoReturn, Set, List, Iterator, Iterable, Callable, \
+    NamedTuple
 
-from sqlalchemy import text
+from sqlalchemy import text, select, or_, and_, false, func, case, type_coerce
 from sqlalchemy.engine import Connection, Row
-from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import Session, DeclarativeMeta, SessionTransaction
+from sqlalchemy.exc import NoResultFound, IntegrityError
+from sqlalchemy.orm import Session, DeclarativeMeta, Query, aliased
+from sqlalchemy.types import NullType
 
 from .model import data_models as external
 from .model import db_models as internal
 from .model import path_models as paths
+from .cache import entities, Ref
+from .responses import responses, tag
+from .search import indexes
 from ..utils import *
 
 T = TypeVar('T', bound=DeclarativeMeta)
 
+STREAM_BATCH_SIZE: int = 500
+BULK_BATCH_SIZE: int = 1000
+
+"""
+Book statistics columns from the book_stats table (bs), maintained by triggers in the database
+"""
+STATS_COLUMNS: str = """
+    COALESCE(bs.readers, 0) AS readers,
+    COALESCE(bs.completed, 0) AS completed,
+    COALESCE(bs.pending, 0) AS pending,
+    COALESCE(bs.liked, 0) AS liked,
+    COALESCE(bs.disliked, 0) AS disliked,
+    CASE WHEN COALESCE(bs.reviews, 0) = 0 THEN 1 ELSE ROUND(bs.stars * 2.0 / bs.reviews, 2) END AS rating
+"""
+
+"""
+Reading status values of the external model that are named differently in the database
+"""
+DB_STATUS: Dict[str, str] = {
+    external.StatusEnum.completed.value: 'complete'
+}
+EXTERNAL_STATUS: Dict[str, str] = {v: k for k, v in DB_STATUS.items()}
+
+"""
+Constraint violations by MySQL error code, other dialects are recognized from the error message
+"""
+MYSQL_VIOLATIONS: Dict[int, str] = {
+    1062: 'unique',  # ER_DUP_ENTRY
+    1586: 'unique',  # ER_DUP_ENTRY_WITH_KEY_NAME
+    1216: 'foreign_key',  # ER_NO_REFERENCED_ROW
+    1452: 'foreign_key',  # ER_NO_REFERENCED_ROW_2
+}
+
+"""
+Columns of the external models, reads select these instead of loading ORM instances
+"""
+USER_COLUMNS: Tuple[Any, ...] = (internal.User.username, internal.User.description)
+BOOK_COLUMNS: Tuple[Any, ...] = (
+    internal.Book.handle,
+    internal.Book.full_name,
+    internal.Book.description,
+    internal.Book.pages
+)
+CLUB_COLUMNS: Tuple[Any, ...] = (internal.Club.handle, internal.Club.description)
+REVIEW_COLUMNS: Tuple[Any, ...] = (internal.Review.stars, internal.Review.title, internal.Review.content)
+
 
 #
 # Common checker functions for getting important values and handle not found states
 #
 
-def __delete(orm_resource: DeclarativeMeta, nested: SessionTransaction, hard: bool):
+def __delete(orm_resource: DeclarativeMeta, db: Session, hard: bool):
     if hard:
-        nested.session.delete(orm_resource)
+        db.delete(orm_resource)
     else:
         orm_resource.deleted = 1
 
 
+def _values(source: Any, columns: Iterable[Any]) -> Dict[str, Any]:
+    """
+    Model values from a row or an instance, None values are left out
+
+    :param source:  Row or ORM instance
+    :param columns: ORM columns to read by key
+    :return:        Values by column key
+    """
+    out = dict()
+    for c in columns:
+        v = getattr(source, c.key)
+        if v is not None:
+            out[c.key] = v
+    return out
+
+
 def __get_handle(cls: Type[T], handle: str, db: Session, throw: bool = True) -> Optional[T]:
     """
     Get any orm class by handle attribute
@@ -91,6 +164,77 @@ def _get_club(handle: str, db: Session, throw: bool = True) -> Optional[internal
     return __get_handle(internal.Club, handle, db, throw)
 
 
+def _handle_column(cls: Type[T]) -> Any:
+    """
+    Get the identifying column of an ORM class
+
+    :param cls: ORM Class
+    :return:    Column
+    """
+    return internal.User.username if cls is internal.User else getattr(cls, 'handle')
+
+
+def _key(cls: Type[T], handle: str) -> Tuple[str, str]:
+    """
+    Entity cache key, handles match case-insensitively in the database
+
+    :param cls:     ORM Class
+    :param handle:  Handle (username for users)
+    :return:        Key
+    """
+    return cls.__name__, handle.casefold()
+
+
+def _ref(cls: Type[T], handle: str, db: Session, throw: bool = True) -> Ref:
+    """
+    Get a cached reference to an entity by handle (username for users)
+
+    Only use this where the id is enough, the reference is not an ORM instance.
+
+    :param cls:     ORM Class
+    :param handle:  Value of handle to filter by
+    :param db:      ORM Session
+    :param throw:   Throw a HTTPException on deleted entity
+    :return:        Reference
+    """
+    key = _key(cls, handle)
+    ref = entities.get_read(db, key)
+    if ref is None:
+        column = _handle_column(cls)
+        res = db.query(cls.id, cls.deleted, column).where(column == handle).first()
+        if res is None:
+            raise NotFound(f"{cls.__name__} not found: {handle}")
+        ref = Ref(res[0], bool(res[1]), res[2])
+        entities.put_read(db, key, ref)
+    if ref.deleted and throw:
+        raise NotFound(f"{cls.__name__} deleted: {handle}")
+    return ref
+
+
+"""
+Search indexes with documents of an ORM class, reviews show the book handle and the username
+"""
+SEARCH_INDEXES: Dict[str, Tuple[str, ...]] = {
+    'Book': ('book', 'review'),
+    'Club': ('club',),
+    'Review': ('review',),
+    'User': ('review',),
+}
+
+
+def _invalidate(cls: Type[T], *handles: str, db: Session):
+    """
+    Invalidate cached references, responses and search indexes after a write
+
+    :param cls:     ORM Class
+    :param handles: Handles to invalidate
+    :param db:      ORM Session of the write
+    """
+    entities.invalidate_on_commit(db, *(_key(cls, h) for h in handles))
+    responses.invalidate_on_commit(db, tag(cls.__name__), *(tag(cls.__name__, h) for h in handles))
+    indexes.invalidate_on_commit(db, *SEARCH_INDEXES.get(cls.__name__, ()))
+
+
 def _get_comment(uuid: int, db: Session, throw: bool = True) -> Optional[internal.Comment]:
     """
     Get a comment
@@ -110,36 +254,88 @@ def _get_comment(uuid: int, db: Session, throw: bool = True) -> Optional[interna
             return None
 
 
-def _get_review(user: str, book: str, db: Session, throw: bool = True) -> Optional[internal.Review]:
+def _get_review(user: Ref, book: Ref, db: Session, throw: bool = True) -> Optional[internal.Review]:
     """
     Get a review
 
-    :param user:    Username
-    :param book:    Book handle
+    :param user:    User reference
+    :param book:    Book reference
     :param db:      ORM session
     :param throw:   Throws a HTTPException if not found (default: True)
     :return:        A Review, or None if not throw
     """
-    res = db.query(internal.Review).where(internal.Review.user == user).where(internal.Review.book == book).first()
+    res = db.query(internal.Review).where(
+        internal.Review.user_id == user.id
+    ).where(
+        internal.Review.book_id == book.id
+    ).first()
     if res:
         return res
     else:
         if throw:
-            raise NotFound(f"Review not found: ({user}, {book})")
+            raise NotFound(f"Review not found: ({user.handle}, {book.handle})")
         else:
             return None
 
 
-def _check_handle_available(cls: Type[T], handle: str, db: Session) -> NoReturn:
+def _violation(error: IntegrityError, dialect: str) -> Optional[str]:
     """
-    Check availability of a handle and throw an error if it already exists
+    Find out which kind of constraint a statement violated
 
-    :param cls:     ORM Class
-    :param handle:  Handle to check
+    :param error:   Error raised by the statement
+    :param dialect: Name of the database dialect
+    :return:        'unique', 'foreign_key' or None for anything else
+    """
+    if dialect == 'mysql':
+        args = getattr(error.orig, 'args', ())
+        return MYSQL_VIOLATIONS.get(args[0]) if len(args) != 0 else None
+    message = str(error.orig).upper()
+    if 'UNIQUE' in message or 'DUPLICATE' in message:
+        return 'unique'
+    if 'FOREIGN KEY' in message:
+        return 'foreign_key'
+    return None
+
+
+def _violates(error: IntegrityError, column: str) -> bool:
+    """
+    Whether the error message names a column or an index named after it, e.g. books.handle or idx_books_handle
+
+    :param error:   Error raised by the statement
+    :param column:  Column name
+    :return:        True if the column is named
+    """
+    return re.search(rf"(?<![a-z0-9]){column}(?![a-z0-9])", str(error.orig).lower()) is not None
+
+
+@contextmanager
+def _constraints(cls: Type[T], handle: str, db: Session) -> Iterator[None]:
+    """
+    Translate constraint violations of the writes in the block to HTTP errors
+
+    The unique handle index decides whether a handle is taken, so creates and renames don't need to check first.
+    A duplicate raises AlreadyExists and a missing referenced row NotFound, other errors are raised as they are.
+    Only a duplicate in the handle column is reported as a taken handle, other unique keys get a generic message.
+    The writes need to be flushed in the block. Without a savepoint the failed flush deactivates the transaction,
+    so the database dependency rolls it back instead of committing.
+
+    :param cls:     ORM Class of the written entity
+    :param handle:  Handle (username for users) being written
     :param db:      ORM Session
     """
-    if db.query(cls).where(getattr(cls, 'handle') == handle).count() != 0:
-        raise AlreadyExists(f"{cls.__name__} with handle {handle} already exists")
+    try:
+        yield
+    except IntegrityError as e:
+        violation = _violation(e, db.get_bind().dialect.name)
+        if violation == 'unique':
+            if cls is internal.User and _violates(e, 'username'):
+                raise AlreadyExists(f"Username {handle} is taken")
+            if cls is not internal.User and hasattr(cls, 'handle') and _violates(e, 'handle'):
+                raise AlreadyExists(f"{cls.__name__} with handle {handle} already exists")
+            raise AlreadyExists(f"Conflicting {cls.__name__} for {handle}")
+        if violation == 'foreign_key':
+            raise NotFound(f"Referenced resource of {cls.__name__} {handle} not found")
+        raise
 
 
 def _add(
@@ -152,6 +348,8 @@ def _add(
     """
     Add an ORM entity to session
 
+    The entity is flushed, so constraint violations are raised here.
+
     :param e:   External entity model
     :param i:   Internal entity model
     :param db:  ORM Session
@@ -159,28 +357,31 @@ def _add(
     """
     if extra is None:
         extra = {}
-    with db.begin_nested() as nested:
-        no = i(**e.dict(exclude_none=True, exclude=exclude), **extra, deleted=False)
-        nested.session.add(no)
-        return no
+    no = i(**e.dict(exclude_none=True, exclude=exclude), **extra, deleted=False)
+    db.add(no)
+    db.flush()
+    return no
 
 
 def _modify(i: T, d: Dict[str, Any], db: Session) -> bool:
     """
-    Modify orm instance in a transaction
+    Modify orm instance
+
+    Changes are flushed, so constraint violations are raised here.
 
     :param i:   Instance to modify
     :param d:   Dict for field references
     :param db:  ORM Session
     :return:    Whether the object changed as a result
     """
-    with db.begin_nested():
-        changed = False
-        for k in d:
-            if getattr(i, k) != d[k]:
-                changed = True
-                setattr(i, k, d[k])
-        return changed
+    changed = False
+    for k in d:
+        if getattr(i, k) != d[k]:
+            changed = True
+            setattr(i, k, d[k])
+    if changed:
+        db.flush()
+    return changed
 
 
 #
@@ -194,8 +395,9 @@ def create_book(book: external.NewBook, db: Session) -> str:
     :param db:   ORM Session
     :return:     Handle of the newly created book
     """
-    _check_handle_available(internal.Book, book.handle, db)
-    return _add(book, internal.Book, db).handle
+    _invalidate(internal.Book, book.handle, db=db)
+    with _constraints(internal.Book, book.handle, db):
+        return _add(book, internal.Book, db).handle
 
 
 def update_book(old_handle: str, book: external.NewBook, db: Session) -> Optional[str]:
@@ -207,11 +409,11 @@ def update_book(old_handle: str, book: external.NewBook, db: Session) -> Optiona
     :param db:          ORM Session
     :return:            Handle of the modified book if the resource changed, else None
     """
-    if old_handle != book.handle:
-        _check_handle_available(internal.Book, book.handle, db)
     b = _get_book(old_handle, db)
     d = book.dict(exclude_none=True)
-    return book.handle if _modify(b, d, db) else None
+    _invalidate(internal.Book, old_handle, book.handle, db=db)
+    with _constraints(internal.Book, book.handle, db):
+        return book.handle if _modify(b, d, db) else None
 
 
 def get_book(handle: str, db: Session, stats: bool = False, user: Union[str, external.User] = None) -> Union[
@@ -250,9 +452,9 @@ def get_book(handle: str, db: Session, stats: bool = False, user: Union[str, ext
             if stats:
                 s = text(
                     f"""
-                    SELECT *, :uname as user FROM books b 
-                    RIGHT JOIN user_books ubl ON ubl.book_id=b.id 
-                    RIGHT JOIN books_statistics bs ON bs.handle=b.handle
+                    SELECT b.*, ubl.*, {STATS_COLUMNS}, :uname as user FROM books b 
+                    JOIN user_books ubl ON ubl.book_id=b.id 
+                    LEFT JOIN book_stats bs ON bs.book_id=b.id
                     WHERE b.handle=:handle
                     AND ubl.user_id=(SELECT id FROM users WHERE username=:uname)
                     """
@@ -274,25 +476,59 @@ def get_book(handle: str, db: Session, stats: bool = False, user: Union[str, ext
             if stats:
                 s = text(
                     f"""
-                    SELECT * FROM books b
-                    RIGHT JOIN books_statistics bs ON bs.handle=b.handle
+                    SELECT b.*, {STATS_COLUMNS} FROM books b
+                    LEFT JOIN book_stats bs ON bs.book_id=b.id
                     WHERE b.handle=:handle
                     """
                 )
                 r: Row = c.execute(s, handle=handle).one()
                 out = external.StatBook(**to_dict(r))
             else:
-                result = db.query(internal.Book).where(
+                result = db.query(*BOOK_COLUMNS, internal.Book.deleted).where(
                     internal.Book.handle == handle
                 ).one()
                 if result.deleted:
                     raise NotFound(f"Book deleted: {handle}")
-                out = external.Book.from_orm(result)
+                out = external.Book(**_values(result, BOOK_COLUMNS))
     except NoResultFound:
         raise NotFound(f"Failed to find data for book: {handle}")
     return out
 
 
+def rebuild_book_stats(db: Session) -> NoReturn:
+    """
+    Rebuild all book statistics from the underlying tables
+
+    Statistics are maintained by triggers, this is only needed for backfilling.
+    MySQL runs the stored procedure of init.sql, other databases the same rebuild in plain SQL.
+
+    :param db:  ORM Session
+    """
+    if db.get_bind().dialect.name == 'mysql':
+        db.execute(text("CALL rebuild_book_stats()"))
+        return
+    bs = internal.t_book_stats
+    r = internal.Review.__table__
+    ubl = internal.UserBook.__table__
+
+    def count(*where: Any) -> Any:
+        return select(func.count()).select_from(ubl).where(ubl.c.book_id == bs.c.book_id, *where).scalar_subquery()
+
+    db.execute(bs.insert().from_select(
+        ['book_id'],
+        select(internal.Book.id).where(internal.Book.id.notin_(select(bs.c.book_id)))
+    ))
+    db.execute(bs.update().values(
+        reviews=select(func.count()).select_from(r).where(r.c.book_id == bs.c.book_id).scalar_subquery(),
+        stars=select(func.coalesce(func.sum(r.c.stars), 0)).where(r.c.book_id == bs.c.book_id).scalar_subquery(),
+        readers=count(ubl.c.reading_status == 'reading'),
+        completed=count(ubl.c.reading_status == 'complete'),
+        pending=count(ubl.c.reading_status == 'pending'),
+        liked=count(ubl.c.liked == 1),
+        disliked=count(ubl.c.liked == 0)
+    ))
+
+
 def delete_book(book: Union[str, external.NewBook], db: Session, hard: bool = False) -> NoReturn:
     """
     Soft delete a book
@@ -307,8 +543,8 @@ def delete_book(book: Union[str, external.NewBook], db: Session, hard: bool = Fa
     else:
         handle = book.handle
     b = _get_book(handle, db, throw=not hard)
-    with db.begin_nested() as nested:
-        __delete(b, nested, hard)
+    __delete(b, db, hard)
+    _invalidate(internal.Book, handle, db=db)
 
 
 #
@@ -322,7 +558,7 @@ def create_comment(comment: external.NewComment, db: Session) -> int:
     :param db:      ORM Session
     :return:        UUID of the newly created comment
     """
-    u = _get_user(comment.user, db)
+    u = _ref(internal.User, comment.user, db)
     return _add(
         comment,
         internal.Comment,
@@ -355,11 +591,14 @@ def get_comment(uuid: int, db: Session) -> external.CommentMason:
     :param db:   ORM Session
     :return:     External comment model
     """
-    c = _get_comment(uuid, db)
-    return external.CommentMason(
-        user=c.user.username if c.user_id is not None else None,
-        **external.CommentInternalBase.from_orm(c).dict(exclude_none=True)
-    )
+    c = db.query(internal.Comment.uuid, internal.Comment.content, internal.User.username).select_from(
+        internal.Comment
+    ).outerjoin(
+        internal.User, internal.User.id == internal.Comment.user_id
+    ).where(internal.Comment.uuid == uuid).first()
+    if c is None:
+        raise NotFound(f"Comment not found: {uuid}")
+    return external.CommentMason(user=c.username, uuid=c.uuid, content=c.content)
 
 
 def delete_comment(comment: Union[int, external.Comment], db: Session, hard: bool = False) -> NoReturn:
@@ -371,8 +610,7 @@ def delete_comment(comment: Union[int, external.Comment], db: Session, hard: boo
     :param db:      ORM Session
     """
     c = _get_comment(comment.uuid, db)
-    with db.begin_nested() as nested:
-        __delete(c, nested, hard)
+    __delete(c, db, hard)
 
 
 #
@@ -386,8 +624,9 @@ def create_review(review: external.NewReview, db: Session) -> Tuple[str, str]:
     :param db:      ORM Session
     :return:        Tuple(username, book_handle)
     """
-    u = _get_user(review.user, db)
-    b = _get_book(review.book, db)
+    u = _ref(internal.User, review.user, db)
+    b = _ref(internal.Book, review.book, db)
+    indexes.invalidate_on_commit(db, *SEARCH_INDEXES['Review'])
     _add(
         review,
         internal.Review,
@@ -398,7 +637,7 @@ def create_review(review: external.NewReview, db: Session) -> Tuple[str, str]:
             'book_id': b.id
         }
     )
-    return u.username, b.handle
+    return u.handle, b.handle
 
 
 def update_review(review: external.NewReview, db: Session) -> bool:
@@ -409,11 +648,47 @@ def update_review(review: external.NewReview, db: Session) -> bool:
     :param db:      ORM Session
     :return:        Whether the resource changed as a result
     """
-    r = _get_review(review.user, review.book, db)
+    r = _get_review(_ref(internal.User, review.user, db), _ref(internal.Book, review.book, db), db)
     d = review.dict(exclude_none=True, exclude={'user', 'book'})
+    indexes.invalidate_on_commit(db, *SEARCH_INDEXES['Review'])
     return _modify(r, d, db)
 
 
+def _find_review(username: str, handle: str, db: Session) -> Row:
+    """
+    Find a review by author and book in one query
+
+    :param username:    Username of the author
+    :param handle:      Book handle
+    :param db:          ORM Session
+    :return:            Row of review id, REVIEW_COLUMNS, username and handle
+    """
+    res = db.query(
+        internal.Review.id,
+        *REVIEW_COLUMNS,
+        internal.User.username,
+        internal.Book.handle
+    ).select_from(internal.Review).join(
+        internal.User, internal.User.id == internal.Review.user_id
+    ).join(
+        internal.Book, internal.Book.id == internal.Review.book_id
+    ).where(
+        internal.User.username == username
+    ).where(
+        internal.User.deleted != 1
+    ).where(
+        internal.Book.handle == handle
+    ).where(
+        internal.Book.deleted != 1
+    ).first()
+    if res is None:
+        # Raises the right error for missing users and books
+        u = _ref(internal.User, username, db)
+        b = _ref(internal.Book, handle, db)
+        raise NotFound(f"Review not found: ({u.handle}, {b.handle})")
+    return res
+
+
 def get_review(user: Union[str, external.NewUser], book: Union[str, external.NewBook], db: Session) -> external.Review:
     """
     Get a review
@@ -423,23 +698,12 @@ def get_review(user: Union[str, external.NewUser], book: Union[str, external.New
     :param db:      ORM Session
     :return:        External review model
     """
-    u: internal.User
-    b: internal.Book
-
-    if isinstance(user, str):
-        u = _get_user(user, db)
-    else:
-        u = _get_user(user.username, db)
-    if isinstance(book, str):
-        b = _get_book(book, db)
-    else:
-        b = _get_book(book.handle, db)
-
-    return external.Review(
-        user=u.username,
-        book=b.handle,
-        **external.ReviewInternalBase.from_orm(_get_review(u.username, b.handle, db)).dict(exclude_none=True)
+    r = _find_review(
+        user if isinstance(user, str) else user.username,
+        book if isinstance(book, str) else book.handle,
+        db
     )
+    return external.Review(user=r.username, book=r.handle, **_values(r, REVIEW_COLUMNS))
 
 
 def delete_review(
@@ -457,20 +721,20 @@ def delete_review(
     r: internal.Review
     if isinstance(review, tuple):
         up = review[1]
-        u: internal.User
+        u: Ref
         if isinstance(up, str):
-            u = _get_user(up, db, throw=not hard)
+            u = _ref(internal.User, up, db, throw=not hard)
         else:
-            u = _get_user(up.username, db, throw=not hard)
+            u = _ref(internal.User, up.username, db, throw=not hard)
         bp = review[0]
-        b: internal.Book
+        b: Ref
         if isinstance(bp, str):
-            b = _get_book(bp, db)
+            b = _ref(internal.Book, bp, db)
         else:
-            b = _get_book(bp.handle, db)
-        r = _get_review(u.username, b.handle, db)
-        with db.begin_nested() as nested:
-            __delete(r, nested, hard)
+            b = _ref(internal.Book, bp.handle, db)
+        r = _get_review(u, b, db)
+        indexes.invalidate_on_commit(db, *SEARCH_INDEXES['Review'])
+        __delete(r, db, hard)
 
 
 #
@@ -484,9 +748,8 @@ def create_user(user: external.NewUser, db: Session) -> str:
     :param db:      ORM Session
     :return:        Username of the newly crated user
     """
-    if db.query(internal.User).where(internal.User.username == user.username).count() != 0:
-        raise AlreadyExists(f"Username {user.username} is taken")
-    else:
+    _invalidate(internal.User, user.username, db=db)
+    with _constraints(internal.User, user.username, db):
         return _add(user, internal.User, db).username
 
 
@@ -499,18 +762,11 @@ def update_user(old_username: str, user: external.NewUser, db: Session) -> Optio
     :param db:              ORM Session
     :return:                Username of the modified resource or None if it didn't change
     """
-    if old_username != user.username:
-        if db.query(internal.User).where(internal.User.username == user.username).count() != 0:
-            raise AlreadyExists(f"Username {user.username} is taken")
     u = _get_user(old_username, db)
-    changed = False
     d = user.dict(exclude_none=True)
-    with db.begin_nested():
-        for k in d:
-            if getattr(u, k) != d[k]:
-                changed = True
-                setattr(u, k, d[k])
-    return user.username if changed else None
+    _invalidate(internal.User, old_username, user.username, db=db)
+    with _constraints(internal.User, user.username, db):
+        return user.username if _modify(u, d, db) else None
 
 
 def get_user(username: str, db: Session) -> external.User:
@@ -521,7 +777,12 @@ def get_user(username: str, db: Session) -> external.User:
     :param db:          ORM Session
     :return:            External user model
     """
-    return external.User.from_orm(_get_user(username, db))
+    res = db.query(*USER_COLUMNS, internal.User.deleted).where(internal.User.username == username).first()
+    if res is None:
+        raise NotFound(f"User not found: {username}")
+    if res.deleted:
+        raise NotFound(f"User deleted: {username}")
+    return external.User(**_values(res, USER_COLUMNS))
 
 
 def delete_user(user: Union[str, external.NewUser], db: Session, hard: bool = False) -> NoReturn:
@@ -539,8 +800,8 @@ def delete_user(user: Union[str, external.NewUser], db: Session, hard: bool = Fa
         else:
             username = user.username
         u = _get_user(username, db, throw=not hard)
-        with db.begin_nested() as nested:
-            __delete(u, nested, hard)
+        __delete(u, db, hard)
+        _invalidate(internal.User, username, db=db)
 
 
 #
@@ -554,17 +815,18 @@ def create_club(club: external.NewClub, db: Session) -> str:
     :param db:      ORM Session
     :return:        Newly created club handle
     """
-    _check_handle_available(internal.Club, club.handle, db)
     owner = None
     if club.owner is not None:
-        owner = _get_user(club.owner, db)
-    return _add(
-        club,
-        internal.Club,
-        db,
-        exclude={'owner'},
-        extra={'owner_id': owner.id if owner is not None else None}
-    ).handle
+        owner = _ref(internal.User, club.owner, db)
+    _invalidate(internal.Club, club.handle, db=db)
+    with _constraints(internal.Club, club.handle, db):
+        return _add(
+            club,
+            internal.Club,
+            db,
+            exclude={'owner'},
+            extra={'owner_id': owner.id if owner is not None else None}
+        ).handle
 
 
 def update_club(old_handle: str, club: external.NewClub, db: Session) -> Optional[str]:
@@ -576,18 +838,44 @@ def update_club(old_handle: str, club: external.NewClub, db: Session) -> Optiona
     :param db:          ORM Session
     :return:            Handle of modified resource or None if no change happened
     """
-    if old_handle != club.handle:
-        _check_handle_available(internal.Club, club.handle, db)
     c = _get_club(old_handle, db)
-    owner = _get_user(club.owner, db)
+    owner = _ref(internal.User, club.owner, db)
     d = club.dict(exclude_none=True, exclude={'owner'})
-    with db.begin_nested():
-        changed = False
-        if c.owner_id != owner.id:
-            changed = True
-            c.owner_id = owner.id
-        changed = changed or _modify(c, d, db)
-        return club.handle if changed else None
+    d['owner_id'] = owner.id
+    _invalidate(internal.Club, old_handle, club.handle, db=db)
+    with _constraints(internal.Club, club.handle, db):
+        return club.handle if _modify(c, d, db) else None
+
+
+def _clubs(db: Session) -> Query:
+    """
+    Query for club rows with the owner joined
+
+    The owner is an alias, so subqueries on users in the filters are not correlated with it.
+
+    :param db:  ORM Session
+    :return:    Query selecting CLUB_COLUMNS, owner and owner_deleted
+    """
+    owner = aliased(internal.User)
+    return db.query(
+        *CLUB_COLUMNS,
+        owner.username.label('owner'),
+        owner.deleted.label('owner_deleted')
+    ).select_from(internal.Club).outerjoin(owner, owner.id == internal.Club.owner_id)
+
+
+def _club(c: Row, bypass_delete: bool = False) -> external.Club:
+    """
+    Build an external club model from a _clubs row
+
+    :param c:               Club row
+    :param bypass_delete:   Bypass deleted check for the owner
+    :return:                External Club model
+    """
+    values = _values(c, CLUB_COLUMNS)
+    if c.owner is not None:
+        values['owner'] = c.owner if c.owner_deleted != 1 or bypass_delete else "deleted"
+    return external.Club(**values)
 
 
 def get_club(handle: str, db: Session, bypass_delete: bool = False) -> external.Club:
@@ -599,15 +887,12 @@ def get_club(handle: str, db: Session, bypass_delete: bool = False) -> external.
     :param db:              ORM Session
     :return:                External Club model
     """
-    c = _get_club(handle, db)
-    return external.Club(
-        owner=(
-            c.owner.username
-            if c.owner.deleted != 1 or bypass_delete
-            else "deleted"
-        ) if c.owner_id is not None else None,
-        **external.ClubInternalBase.from_orm(c).dict(exclude_none=True)
-    )
+    c = _clubs(db).add_columns(internal.Club.deleted).where(internal.Club.handle == handle).first()
+    if c is None:
+        raise NotFound(f"Club not found: {handle}")
+    if c.deleted:
+        raise NotFound(f"Club deleted: {handle}")
+    return _club(c, bypass_delete)
 
 
 def delete_club(club: Union[str, external.NewClub], db: Session, hard: bool = False) -> NoReturn:
@@ -623,13 +908,36 @@ def delete_club(club: Union[str, external.NewClub], db: Session, hard: bool = Fa
         c = _get_club(club, db, throw=not hard)
     else:
         c = _get_club(club.handle, db, throw=not hard)
-    with db.begin_nested() as nested:
-        __delete(c, nested, hard)
+    __delete(c, db, hard)
+    _invalidate(internal.Club, c.handle, db=db)
 
 
 #
 # User book
 #
+def _user_book(book: internal.Book, record: internal.UserBook, username: str) -> external.UserBook:
+    """
+    Build a user book from loaded instances
+
+    :param book:        Book instance
+    :param record:      User book instance
+    :param username:    Username of the record
+    :return:            External user book model
+    """
+    d = dict(
+        reading_status=EXTERNAL_STATUS.get(record.reading_status, record.reading_status),
+        reviewed=record.reviewed,
+        ignored=record.ignored,
+        liked=record.liked,
+        page=record.current_page
+    )
+    return external.UserBook(
+        **{k: v for k, v in d.items() if v is not None},
+        **_values(book, BOOK_COLUMNS),
+        user=username
+    )
+
+
 def store_user_book(
         model: external.NewUserBook,
         db: Session,
@@ -639,43 +947,49 @@ def store_user_book(
     Function for storing user book records
 
     Mainly intended for creating and updating user book records.
+    The book and the existing record are read in one query and the response is built from them.
+    The record is flushed, so constraint violations are raised here. A stale cached reference to the book is
+    dropped and read again.
 
     :param model:       UBL model
     :param db:          ORM Session
     :param overwrite:   Whether to overwrite (update) existing records
     :return:            User book instance
     """
-    u = _get_user(model.user, db)
-    b = _get_book(model.handle, db)
-
-    existing = db.query(internal.UserBook).where(
-        internal.UserBook.user_id == u.id
-    ).where(
-        internal.UserBook.book_id == b.id
-    ).first()
+    u = _ref(internal.User, model.user, db)
+
+    def read(ref: Ref) -> Optional[Row]:
+        return db.query(internal.Book, internal.UserBook).outerjoin(
+            internal.UserBook,
+            and_(internal.UserBook.book_id == internal.Book.id, internal.UserBook.user_id == u.id)
+        ).where(internal.Book.id == ref.id).first()
+
+    b = _ref(internal.Book, model.handle, db)
+    row = read(b)
+    if row is None:
+        # The cached reference is stale, another process removed or recreated the book
+        entities.invalidate_on_commit(db, _key(internal.Book, model.handle))
+        b = _ref(internal.Book, model.handle, db)
+        row = read(b)
+        if row is None:
+            raise NotFound(f"{internal.Book.__name__} not found: {model.handle}")
+    book, existing = row
 
     d = model.dict(exclude_none=True, exclude={'user', 'handle'})
-    with db.begin_nested():
-        new_record: internal.UserBook
-        if existing and not overwrite:
-            raise AlreadyExists(f"User {u.username} already has a record for {b.handle}")
+    if 'reading_status' in d:
+        d['reading_status'] = DB_STATUS.get(d['reading_status'], d['reading_status'])
+    if existing and not overwrite:
+        raise AlreadyExists(f"User {u.handle} already has a record for {b.handle}")
+    with _constraints(internal.UserBook, b.handle, db):
+        if existing:
+            new_record = existing
+            for k in d:
+                setattr(new_record, k, d[k])
         else:
-            if existing:
-                new_record = existing
-                for k in d:
-                    setattr(new_record, k, d[k])
-            else:
-                new_record = internal.UserBook(user_id=u.id, book_id=b.id, **d)
-        if not existing:
-            with db.begin_nested():
-                db.add(new_record)
-        db.refresh(new_record)
-        # Its not dumb if it works, right?
-        return external.UserBook(
-            **external.UserBookInternalBase.from_orm(new_record).dict(exclude_none=True),
-            **external.Book.from_orm(new_record.book).dict(exclude_none=True),
-            user=new_record.user.username,
-        )
+            new_record = internal.UserBook(user_id=u.id, book_id=b.id, **{'reviewed': False, 'ignored': False, **d})
+            db.add(new_record)
+        db.flush()
+    return _user_book(book, new_record, u.handle)
 
 
 def modify_user_book_ignore_status(
@@ -696,51 +1010,1090 @@ def modify_user_book_ignore_status(
     :param db:          ORM Session
     :param ignored:     Ignored status (default: True)
     """
-    b = _get_book((book if isinstance(book, str) else book.handle) if ubl is None else ubl.handle, db)
-    u = _get_user((user if isinstance(user, str) else user.username) if ubl is None else ubl.user, db)
-    with db.begin_nested():
+    b = _ref(internal.Book, (book if isinstance(book, str) else book.handle) if ubl is None else ubl.handle, db)
+    u = _ref(internal.User, (user if isinstance(user, str) else user.username) if ubl is None else ubl.user, db)
+    try:
+        r: internal.UserBook = db.query(internal.UserBook).where(
+            internal.UserBook.user_id == u.id
+        ).where(
+            internal.UserBook.book_id == b.id
+        ).one()
+        r.ignored = ignored
+    except NoResultFound:
+        raise NotFound(f"User {u.handle} has no record for {b.handle}")
+
+
+#
+# Upsert
+#
+def _upsert(
+        cls: Type[T],
+        handle: str,
+        values: Dict[str, Any],
+        db: Session,
+        nullable: Tuple[str, ...] = ()
+) -> external.UpsertStatusEnum:
+    """
+    Create or update an entity with one locking read and one write
+
+    The row is read with SELECT ... FOR UPDATE, so concurrent upserts of the same handle are serialized.
+    Deleted entities are recreated, which drops everything linked to the old one. The new row continues
+    the version of the old one, so it never repeats a version (and ETag) the old row had.
+
+    :param cls:         ORM Class
+    :param handle:      Handle (username for users) of the entity
+    :param values:      Column values, None values are left untouched
+    :param db:          ORM Session
+    :param nullable:    Columns that are set to NULL when their value is None
+    :return:            What happened
+    """
+    values = {k: v for k, v in values.items() if v is not None or k in nullable}
+    row = db.query(cls).where(_handle_column(cls) == handle).with_for_update().first()
+    _invalidate(cls, handle, db=db)
+    with _constraints(cls, handle, db):
+        if row is not None and not row.deleted:
+            changed = False
+            for k in values:
+                if getattr(row, k) != values[k]:
+                    changed = True
+                    setattr(row, k, values[k])
+            db.flush()
+            return external.UpsertStatusEnum.updated if changed else external.UpsertStatusEnum.unchanged
+        if row is not None:
+            values['version'] = row.version + 1
+            db.delete(row)
+            db.flush()
+        db.add(cls(**values, deleted=False))
+        db.flush()
+    return external.UpsertStatusEnum.created if row is None else external.UpsertStatusEnum.recreated
+
+
+def upsert_book(handle: str, book: external.NewBook, db: Session) -> external.UpsertStatusEnum:
+    """
+    Create, recreate or update a book
+
+    :param handle:  Book handle
+    :param book:    External book model
+    :param db:      ORM Session
+    :return:        What happened
+    """
+    return _upsert(internal.Book, handle, book.dict(), db)
+
+
+def upsert_user(username: str, user: external.NewUser, db: Session) -> external.UpsertStatusEnum:
+    """
+    Create, recreate or update a user
+
+    :param username:    Username
+    :param user:        External user model
+    :param db:          ORM Session
+    :return:            What happened
+    """
+    return _upsert(internal.User, username, user.dict(), db)
+
+
+def upsert_club(handle: str, club: external.NewClub, db: Session) -> external.UpsertStatusEnum:
+    """
+    Create, recreate or update a club, a club without an owner loses its current one
+
+    :param handle:  Club handle
+    :param club:    External club model
+    :param db:      ORM Session
+    :return:        What happened
+    """
+    values = club.dict(exclude={'owner'})
+    values['owner_id'] = _ref(internal.User, club.owner, db).id if club.owner is not None else None
+    return _upsert(internal.Club, handle, values, db, nullable=('owner_id',))
+
+
+#
+# Versions
+#
+def _version(cls: Type[T], handle: str, db: Session) -> Optional[str]:
+    """
+    Row id and version of an entity, changes on every update of the row and when it is recreated
+
+    :param cls:     ORM Class
+    :param handle:  Handle (username for users)
+    :param db:      ORM Session
+    :return:        Version or None if not found or deleted
+    """
+    column = _handle_column(cls)
+    r = db.query(cls.id, cls.version).where(column == handle).where(cls.deleted != 1).first()
+    return None if r is None else f"{r.id}.{r.version}"
+
+
+def get_book_version(handle: str, db: Session) -> Optional[str]:
+    """
+    Version of a book representation
+
+    :param handle:  Book handle
+    :param db:      ORM Session
+    :return:        Version or None if not found or deleted
+    """
+    return _version(internal.Book, handle, db)
+
+
+def get_user_version(username: str, db: Session) -> Optional[str]:
+    """
+    Version of a user representation
+
+    :param username:    Username
+    :param db:          ORM Session
+    :return:            Version or None if not found or deleted
+    """
+    return _version(internal.User, username, db)
+
+
+def get_club_version(handle: str, db: Session) -> Optional[str]:
+    """
+    Version of a club representation, includes the owner since the owner name is a part of it
+
+    :param handle:  Club handle
+    :param db:      ORM Session
+    :return:        Version or None if not found or deleted
+    """
+    r = db.query(internal.Club.id, internal.Club.version, internal.User.id, internal.User.version).outerjoin(
+        internal.User, internal.User.id == internal.Club.owner_id
+    ).where(internal.Club.handle == handle).where(internal.Club.deleted != 1).first()
+    return None if r is None else ".".join(str(v) for v in r)
+
+
+"""
+Collections whose representation depends on each collection
+"""
+COLLECTION_DEPENDENCIES: Dict[str, Tuple[str, ...]] = {
+    'users': ('users',),
+    'books': ('books',),
+    'clubs': ('clubs', 'users'),
+    'reviews': ('reviews', 'books', 'users')
+}
+
+
+def get_collection_version(name: str, db: Session) -> str:
+    """
+    Version of a collection, maintained by triggers on every write
+
+    :param name:    Collection name (users, books, clubs)
+    :param db:      ORM Session
+    :return:        Version
+    """
+    names = COLLECTION_DEPENDENCIES[name]
+    table = internal.t_collection_versions
+    versions = dict(db.execute(select(table.c.name, table.c.version).where(table.c.name.in_(names))).all())
+    return ".".join(str(versions.get(n)) for n in names)
+
+
+#
+# Search
+#
+"""
+Full-text queries for MySQL, each one is ranked and limited before the results are merged
+"""
+SEARCH_QUERIES: Dict[external.SearchTypeEnum, str] = {
+    external.SearchTypeEnum.book: """
+        SELECT 'book' AS type, b.handle AS handle, NULL AS user, b.full_name AS title,
+               MATCH (b.full_name, b.description) AGAINST (:q) AS score
+        FROM books b
+        WHERE b.deleted = 0 AND MATCH (b.full_name, b.description) AGAINST (:q)
+        ORDER BY score DESC LIMIT :n
+    """,
+    external.SearchTypeEnum.club: """
+        SELECT 'club' AS type, c.handle AS handle, NULL AS user, NULL AS title,
+               MATCH (c.description) AGAINST (:q) AS score
+        FROM clubs c
+        WHERE c.deleted = 0 AND MATCH (c.description) AGAINST (:q)
+        ORDER BY score DESC LIMIT :n
+    """,
+    external.SearchTypeEnum.review: """
+        SELECT 'review' AS type, b.handle AS handle, u.username AS user, r.title AS title,
+               MATCH (r.title, r.content) AGAINST (:q) AS score
+        FROM reviews r
+                 JOIN books b ON b.id = r.book_id
+                 LEFT JOIN users u ON u.id = r.user_id
+        WHERE r.deleted = 0 AND b.deleted = 0 AND MATCH (r.title, r.content) AGAINST (:q)
+        ORDER BY score DESC LIMIT :n
+    """
+}
+
+"""
+Documents for the in-process fallback index as (handle, user, title, indexed text, indexed text)
+"""
+SEARCH_DOCUMENTS: Dict[external.SearchTypeEnum, str] = {
+    external.SearchTypeEnum.book: """
+        SELECT b.handle, NULL, b.full_name, b.full_name, b.description
+        FROM books b WHERE b.deleted = 0
+    """,
+    external.SearchTypeEnum.club: """
+        SELECT c.handle, NULL, NULL, c.description, NULL
+        FROM clubs c WHERE c.deleted = 0
+    """,
+    external.SearchTypeEnum.review: """
+        SELECT b.handle, u.username, r.title, r.title, r.content
+        FROM reviews r
+                 JOIN books b ON b.id = r.book_id
+                 LEFT JOIN users u ON u.id = r.user_id
+        WHERE r.deleted = 0 AND b.deleted = 0
+    """
+}
+
+
+def _search_index(t: external.SearchTypeEnum, q: str, n: int, db: Session) -> List[Tuple[Any, ...]]:
+    """
+    Search with the in-process index, rebuilt if the collection changed
+
+    :param t:   Type of documents
+    :param q:   Query
+    :param n:   Maximum amount of results
+    :param db:  ORM Session
+    :return:    Rows of (type, handle, user, title, score)
+    """
+
+    def load():
+        for handle, user, title, first, second in db.execute(text(SEARCH_DOCUMENTS[t])):
+            yield (handle, user, title), f"{first or ''} {second or ''}"
+
+    index = indexes.get(t.value, get_collection_version(t.value + 's', db), load)
+    return [(t.value, *key, score) for key, score in index.search(q)[:n]]
+
+
+def search(
+        q: str,
+        db: Session,
+        page: paths.SearchPage = None,
+        types: Iterable[external.SearchTypeEnum] = None
+) -> Tuple[paths.SearchResults, Optional[paths.SearchPage], Optional[paths.SearchPage]]:
+    """
+    Full-text search over books, clubs and reviews ordered by relevance
+
+    Uses FULLTEXT indexes on MySQL and an in-process inverted index on other databases.
+
+    :param q:       Query
+    :param db:      ORM Session
+    :param page:    Requested page (default: first page)
+    :param types:   Types of results to include (default: all)
+    :return:        Tuple(SearchResults, next page, previous page)
+    """
+    if page is None:
+        page = paths.SearchPage()
+    limit = max(1, min(page.limit, paths.MAX_PAGE_SIZE))
+    offset = max(0, min(page.offset, paths.MAX_SEARCH_OFFSET))
+    types = list(types or external.SearchTypeEnum)
+    n = offset + limit + 1
+    if db.get_bind().dialect.name == 'mysql':
+        rows = db.execute(
+            text(
+                "SELECT * FROM ("
+                + " UNION ALL ".join(f"({SEARCH_QUERIES[t]})" for t in types)
+                + ") AS hits ORDER BY score DESC, type, handle LIMIT :limit OFFSET :offset"
+            ),
+            dict(q=q, n=n, limit=limit + 1, offset=offset)
+        ).all()
+    else:
+        rows = sorted(
+            (r for t in types for r in _search_index(t, q, n, db)),
+            key=lambda r: (-r[4], r[0], r[1])
+        )[offset:offset + limit + 1]
+    more = len(rows) > limit and offset + limit <= paths.MAX_SEARCH_OFFSET
+    items = [
+        external.SearchHit(type=r[0], handle=r[1], user=r[2], title=r[3], score=round(float(r[4]), 4))
+        for r in rows[:limit]
+    ]
+    next_page = paths.SearchPage(limit=limit, offset=offset + limit) if more else None
+    prev_page = paths.SearchPage(limit=limit, offset=max(0, offset - limit)) if offset > 0 else None
+    return paths.SearchResults(query=q, items=items), next_page, prev_page
+
+
+#
+# Reading list
+#
+def get_user_books(
+        username: str,
+        db: Session,
+        page: paths.Page = None,
+        status: external.StatusEnum = None,
+        stats: bool = False
+) -> Tuple[paths.UserBooks, Optional[paths.Page], Optional[paths.Page]]:
+    """
+    Get a page of the books of a user in one query
+
+    Ordered by book id, so the rows come from the user_books primary key in order.
+    The cursors are book handles.
+
+    :param username:    Username
+    :param db:          ORM Session
+    :param page:        Requested page (default: first page)
+    :param status:      Only include books with this reading status (default: all)
+    :param stats:       Whether book stats should be included (default: false)
+    :return:            Tuple(UserBooks, next page, previous page)
+    """
+    u = _ref(internal.User, username, db)
+    ubl = internal.UserBook
+    book = internal.Book
+    columns = [
+        book.handle,
+        book.full_name,
+        book.description,
+        book.pages,
+        ubl.reading_status,
+        ubl.reviewed,
+        ubl.ignored,
+        ubl.liked,
+        ubl.current_page.label('page')
+    ]
+    if stats:
+        bs = internal.t_book_stats.c
+        columns.extend(func.coalesce(c, 0).label(c.key) for c in (
+            bs.readers, bs.completed, bs.pending, bs.liked, bs.disliked
+        ))
+        columns.append(case(
+            (func.coalesce(bs.reviews, 0) == 0, 1),
+            else_=func.round(bs.stars * 2.0 / bs.reviews, 2)
+        ).label('rating'))
+    query = db.query(*columns).select_from(ubl).join(book, book.id == ubl.book_id)
+    if stats:
+        query = query.outerjoin(internal.t_book_stats, internal.t_book_stats.c.book_id == ubl.book_id)
+    query = query.where(ubl.user_id == u.id).where(book.deleted != 1)
+    if status is not None:
+        query = query.where(ubl.reading_status == DB_STATUS.get(status.value, status.value))
+    rows, next_page, prev_page = _paginate(
+        query,
+        book.handle,
+        page,
+        (ubl.book_id, ubl.book_id, False),
+        db.query(book.id, book.id)
+    )
+    model = external.StatUserBook if stats else external.UserBook
+    items = list()
+    for r in rows:
+        d = {k: v for k, v in r._asdict().items() if v is not None}
+        if 'reading_status' in d:
+            d['reading_status'] = EXTERNAL_STATUS.get(d['reading_status'], d['reading_status'])
+        items.append(model(**d, user=u.handle))
+    return paths.UserBooks(items=items), next_page, prev_page
+
+
+#
+# Discussion
+#
+def _author(username: Optional[str], deleted: Optional[int]) -> str:
+    return username if username is not None and not deleted else "deleted"
+
+
+def get_book_reviews(
+        book: str,
+        db: Session,
+        page: paths.Page = None
+) -> Tuple[paths.Reviews, Optional[paths.Page], Optional[paths.Page]]:
+    """
+    Get a page of the reviews of a book, newest first
+
+    Authors are joined into the same query. The cursors are opaque review ids.
+
+    :param book:    Book handle
+    :param db:      ORM Session
+    :param page:    Requested page (default: first page)
+    :return:        Tuple(Reviews, next page, previous page)
+    """
+    b = _ref(internal.Book, book, db)
+    r = internal.Review
+    u = internal.User
+    rows, next_page, prev_page = _paginate(
+        db.query(r.id, *REVIEW_COLUMNS, u.username, u.deleted.label('user_deleted')).select_from(
+            r
+        ).outerjoin(
+            u, u.id == r.user_id
+        ).where(r.book_id == b.id).where(r.deleted != 1),
+        r.id,
+        page,
+        (r.created_at, r.id, True)
+    )
+    return paths.Reviews(items=[
+        external.Review(
+            user=_author(x.username, x.user_deleted),
+            book=b.handle,
+            **_values(x, REVIEW_COLUMNS)
+        ) for x in rows
+    ]), next_page, prev_page
+
+
+def get_review_comments(
+        user: str,
+        book: str,
+        db: Session,
+        page: paths.Page = None
+) -> Tuple[paths.Comments, Optional[paths.Page], Optional[paths.Page]]:
+    """
+    Get a page of the comments on a review, oldest first
+
+    Authors are joined into the same query. The cursors are comment uuids.
+
+    :param user:    Username of the review author
+    :param book:    Book handle
+    :param db:      ORM Session
+    :param page:    Requested page (default: first page)
+    :return:        Tuple(Comments, next page, previous page)
+    """
+    review = _find_review(user, book, db)
+    link = internal.t_review_comment_link
+    c = internal.Comment
+    u = internal.User
+    rows, next_page, prev_page = _paginate(
+        db.query(c.id, c.uuid, c.content, u.username, u.deleted.label('user_deleted')).select_from(
+            link
+        ).join(
+            c, c.id == link.c.comment_id
+        ).outerjoin(
+            u, u.id == c.user_id
+        ).where(link.c.review_id == review.id).where(c.deleted != 1),
+        c.uuid,
+        page,
+        (c.created_at, c.id, False)
+    )
+    return paths.Comments(items=[
+        external.CommentMason(uuid=x.uuid, content=x.content, user=_author(x.username, x.user_deleted))
+        for x in rows
+    ]), next_page, prev_page
+
+
+#
+# Bulk
+#
+def _bulk_create(
+        cls: Type[T],
+        items: Iterable[Tuple[int, Any]],
+        db: Session,
+        seen: Set[str] = None,
+        exclude: Set[str] = None,
+        resolve: Callable[[List[Any], Session], Callable[[Any], Dict[str, Any]]] = None
+) -> List[external.BulkItem]:
+    """
+    Insert new entities in batches of BULK_BATCH_SIZE
+
+    Each batch takes one IN query for existing handles and one executemany insert.
+    Handles are compared case-insensitively like the database collation does.
+    If a batch still hits a unique constraint it is retried row by row in savepoints.
+
+    :param cls:     ORM Class
+    :param items:   Tuples of (index, external model)
+    :param db:      ORM Session
+    :param seen:    Handles already imported, updated in place for calling this in chunks (default: None)
+    :param exclude: Fields of the external model that are not columns (default: None)
+    :param resolve: Gets a batch and returns a function for the extra columns of an item,
+                    the function raises NotFound for missing references (default: None)
+    :return:        Status of every item
+    """
+    if seen is None:
+        seen = set()
+    column = _handle_column(cls)
+    table = cls.__table__
+    out: List[external.BulkItem] = list()
+    items = iter(items)
+    while True:
+        batch = list(islice(items, BULK_BATCH_SIZE))
+        if len(batch) == 0:
+            break
+        taken = {
+            h.casefold() for h in db.execute(
+                select(column).where(column.in_({getattr(e, column.key) for _, e in batch}))
+            ).scalars()
+        }
+        extra = resolve([e for _, e in batch], db) if resolve is not None else (lambda _: {})
+        rows: List[Tuple[external.BulkItem, Dict[str, Any]]] = list()
+        for index, e in batch:
+            handle = getattr(e, column.key)
+            key = handle.casefold()
+            if key in seen:
+                out.append(external.BulkItem(index=index, handle=handle, status='duplicate'))
+            elif key in taken:
+                out.append(external.BulkItem(
+                    index=index,
+                    handle=handle,
+                    status='exists',
+                    message=f"{cls.__name__} with handle {handle} already exists"
+                ))
+            else:
+                try:
+                    row = {**e.dict(exclude=exclude), **extra(e), 'deleted': False}
+                except NotFound as ex:
+                    out.append(external.BulkItem(index=index, handle=handle, status='not_found', message=ex.detail))
+                    continue
+                seen.add(key)
+                item = external.BulkItem(index=index, handle=handle, status='created')
+                rows.append((item, row))
+                out.append(item)
+        if len(rows) == 0:
+            continue
         try:
-            r: internal.UserBook = db.query(internal.UserBook).where(
-                internal.UserBook.user_id == u.id
-            ).where(
-                internal.UserBook.book_id == b.id
-            ).one()
-            r.ignored = ignored
-        except NoResultFound:
-            raise NotFound(f"User {u.username} has no record for {b.handle}")
-
-
-def get_users(db: Session) -> paths.Users:
-    u = paths.Users(
-        items=[external.User.from_orm(x) for x in db.query(internal.User).where(internal.User.deleted != 1).all()]
+            with db.begin_nested():
+                db.execute(table.insert(), [row for _, row in rows])
+        except IntegrityError:
+            for item, row in rows:
+                try:
+                    with db.begin_nested():
+                        db.execute(table.insert(), row)
+                except IntegrityError:
+                    item.status = 'exists'
+                    item.message = f"{cls.__name__} with handle {item.handle} already exists"
+        _invalidate(cls, *(item.handle for item, _ in rows), db=db)
+    return out
+
+
+def bulk_create_books(
+        books: Iterable[Tuple[int, external.NewBook]],
+        db: Session,
+        seen: Set[str] = None
+) -> List[external.BulkItem]:
+    """
+    Create many books
+
+    :param books:   Tuples of (index, external book model)
+    :param db:      ORM Session
+    :param seen:    Handles already imported in previous calls (default: None)
+    :return:        Status of every book
+    """
+    return _bulk_create(internal.Book, books, db, seen)
+
+
+def bulk_create_users(
+        users: Iterable[Tuple[int, external.NewUser]],
+        db: Session,
+        seen: Set[str] = None
+) -> List[external.BulkItem]:
+    """
+    Create many users
+
+    :param users:   Tuples of (index, external user model)
+    :param db:      ORM Session
+    :param seen:    Usernames already imported in previous calls (default: None)
+    :return:        Status of every user
+    """
+    return _bulk_create(internal.User, users, db, seen)
+
+
+def _owners(clubs: List[external.NewClub], db: Session) -> Callable[[external.NewClub], Dict[str, Any]]:
+    """
+    Resolve the owners of a batch of clubs with one query
+
+    :param clubs:   External club models
+    :param db:      ORM Session
+    :return:        Function giving the owner_id column of a club
+    """
+    names = {c.owner for c in clubs if c.owner is not None}
+    owners: Dict[str, Ref] = dict()
+    if len(names) != 0:
+        for r in db.query(internal.User.id, internal.User.deleted, internal.User.username).where(
+                internal.User.username.in_(names)
+        ):
+            owners[r[2].casefold()] = Ref(r[0], bool(r[1]), r[2])
+
+    def owner_id(club: external.NewClub) -> Dict[str, Any]:
+        if club.owner is None:
+            return {'owner_id': None}
+        ref = owners.get(club.owner.casefold())
+        if ref is None or ref.deleted:
+            raise NotFound(f"User not found/deleted: {club.owner}")
+        return {'owner_id': ref.id}
+
+    return owner_id
+
+
+def bulk_create_clubs(
+        clubs: Iterable[Tuple[int, external.NewClub]],
+        db: Session,
+        seen: Set[str] = None
+) -> List[external.BulkItem]:
+    """
+    Create many clubs
+
+    :param clubs:   Tuples of (index, external club model)
+    :param db:      ORM Session
+    :param seen:    Handles already imported in previous calls (default: None)
+    :return:        Status of every club
+    """
+    return _bulk_create(internal.Club, clubs, db, seen, exclude={'owner'}, resolve=_owners)
+
+
+#
+# Collections
+#
+class Listing(NamedTuple):
+    """
+    Declarative filters and sort orders of a collection
+
+    Only the names in filters and sorts are accepted, each one compiles to a condition or an ordering on an indexed
+    column. Sorts other than the key are paginated by (column, tiebreak) with the key as the cursor.
+    """
+    key: Any
+    tiebreak: Any
+    filters: Dict[str, Callable[[Any], Any]]
+    sorts: Dict[str, Any]
+
+
+USERS = Listing(
+    key=internal.User.username,
+    tiebreak=internal.User.id,
+    filters={
+        'prefix': lambda v: internal.User.username.startswith(v, autoescape=True)
+    },
+    sorts={
+        'username': internal.User.username
+    }
+)
+
+BOOKS = Listing(
+    key=internal.Book.handle,
+    tiebreak=internal.Book.id,
+    filters={
+        'min_pages': lambda v: internal.Book.pages >= v,
+        'max_pages': lambda v: internal.Book.pages <= v
+    },
+    sorts={
+        'handle': internal.Book.handle,
+        'pages': internal.Book.pages
+    }
+)
+
+CLUBS = Listing(
+    key=internal.Club.handle,
+    tiebreak=internal.Club.id,
+    filters={
+        'owner': lambda v: internal.Club.owner_id == select(internal.User.id).where(
+            internal.User.username == v
+        ).scalar_subquery()
+    },
+    sorts={
+        'handle': internal.Club.handle
+    }
+)
+
+
+def _filter(listing: Listing, query: Query, filters: Optional[Dict[str, Any]]) -> Query:
+    """
+    Apply filters to a collection query
+
+    :param listing: Collection description
+    :param query:   ORM Query
+    :param filters: Filter names and values, None values are skipped (default: None)
+    :return:        Filtered query
+    """
+    for name, value in (filters or {}).items():
+        if value is None:
+            continue
+        condition = listing.filters.get(name)
+        if condition is None:
+            raise BadRequest(f"Unknown filter: {name}")
+        query = query.where(condition(value))
+    return query
+
+
+def _order(listing: Listing, sort: Optional[str]) -> Optional[Tuple[Any, Any, bool]]:
+    """
+    Resolve a sort parameter, a leading - sorts in descending order
+
+    :param listing: Collection description
+    :param sort:    Sort name or None for key order
+    :return:        Tuple(column, tiebreak, descending) or None for key order
+    """
+    if sort is None:
+        return None
+    descending = sort.startswith('-')
+    column = listing.sorts.get(sort[1:] if descending else sort)
+    if column is None:
+        raise BadRequest(f"Unknown sort: {sort}")
+    if column is listing.key and not descending:
+        return None
+    return column, listing.tiebreak, descending
+
+
+def _beyond(column: Any, value: Any, larger: bool) -> Any:
+    """
+    Condition for values past a value in one direction, NULL is the smallest value like in MySQL and SQLite
+
+    :param column:  Column
+    :param value:   Value
+    :param larger:  Direction
+    :return:        Condition
+    """
+    if larger:
+        return column.isnot(None) if value is None else column > value
+    return false() if value is None else or_(column < value, column.is_(None))
+
+
+def _seek(
+        query: Query,
+        key: Any,
+        cursor: Optional[str],
+        order: Tuple[Any, Any, bool],
+        larger: bool,
+        lookup: Query = None
+) -> Query:
+    """
+    Order a query by (column, tiebreak) and continue past the cursor row, whose values are looked up first
+
+    :param query:   ORM Query
+    :param key:     Unique ORM column the cursor refers to
+    :param cursor:  Key value of the cursor row or None to start from the beginning
+    :param order:   Tuple(column, tiebreak, descending), only the columns are used
+    :param larger:  Direction, True for ascending
+    :param lookup:  Query selecting (column, tiebreak) for the cursor lookup (default: the two columns)
+    :return:        Ordered query
+    """
+    column, tiebreak, _ = order
+    if cursor is not None:
+        # The value goes back as stored, SQLite compares its timestamp strings with bound datetimes as text
+        raw = type_coerce(column, NullType())
+        if lookup is None:
+            lookup = query.session.query(raw, tiebreak)
+        values = lookup.where(key == cursor).first()
+        if values is None:
+            raise BadRequest(f"Unknown cursor: {cursor}")
+        query = query.where(or_(
+            _beyond(raw, values[0], larger),
+            and_(
+                raw.is_(None) if values[0] is None else raw == values[0],
+                tiebreak > values[1] if larger else tiebreak < values[1]
+            )
+        ))
+    if larger:
+        return query.order_by(column.asc(), tiebreak.asc())
+    return query.order_by(column.desc(), tiebreak.desc())
+
+
+def _paginate(
+        query: Query,
+        key: Any,
+        page: Optional[paths.Page],
+        order: Tuple[Any, Any, bool] = None,
+        lookup: Query = None
+) -> Tuple[List[Any], Optional[paths.Page], Optional[paths.Page]]:
+    """
+    Keyset pagination over a unique key
+
+    Fetches one extra row to find out if there is more data in the paging direction.
+    With an order the rows are sorted by (column, tiebreak) instead, the values of the cursor row are looked up first.
+
+    :param query:   ORM Query to paginate
+    :param key:     Unique ORM column to use as the key
+    :param page:    Requested page or None for the first page
+    :param order:   Tuple(column, tiebreak, descending) to sort by (default: key)
+    :param lookup:  Query selecting (column, tiebreak) for the cursor lookup (default: the two columns)
+    :return:        Tuple(rows, next page, previous page)
+    """
+    if page is None:
+        page = paths.Page()
+    limit = max(1, min(page.limit, paths.MAX_PAGE_SIZE))
+    backwards = page.after is None and page.before is not None
+    if order is None:
+        if backwards:
+            rows = query.where(key < page.before).order_by(key.desc()).limit(limit + 1).all()
+        elif page.after is not None:
+            rows = query.where(key > page.after).order_by(key).limit(limit + 1).all()
+        else:
+            rows = query.order_by(key).limit(limit + 1).all()
+    else:
+        cursor = page.before if backwards else page.after
+        rows = _seek(query, key, cursor, order, order[2] == backwards, lookup).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    if len(rows) == 0:
+        return rows, None, None
+    first = getattr(rows[0], key.key)
+    last = getattr(rows[-1], key.key)
+    next_page = paths.Page(limit=limit, after=last) if more or backwards else None
+    prev_page = paths.Page(limit=limit, before=first) if (more and backwards) or page.after is not None else None
+    return rows, next_page, prev_page
+
+
+def get_users(
+        db: Session,
+        page: paths.Page = None,
+        filters: Dict[str, Any] = None,
+        sort: str = None
+) -> Tuple[paths.Users, Optional[paths.Page], Optional[paths.Page]]:
+    """
+    Get a page of users ordered by username
+
+    :param db:      ORM Session
+    :param page:    Requested page (default: first page)
+    :param filters: Filters allowed in USERS (default: None)
+    :param sort:    Sort allowed in USERS (default: username)
+    :return:        Tuple(Users, next page, previous page)
+    """
+    rows, next_page, prev_page = _paginate(
+        _filter(USERS, db.query(*USER_COLUMNS).where(internal.User.deleted != 1), filters),
+        USERS.key,
+        page,
+        _order(USERS, sort)
     )
-    return u
+    return paths.Users(items=[external.User(**_values(x, USER_COLUMNS)) for x in rows]), next_page, prev_page
 
 
-def get_books(db: Session) -> paths.Books:
-    u = paths.Books(
-        items=[external.Book.from_orm(x) for x in db.query(internal.Book).where(internal.Book.deleted != 1).all()]
+def get_books(
+        db: Session,
+        page: paths.Page = None,
+        filters: Dict[str, Any] = None,
+        sort: str = None
+) -> Tuple[paths.Books, Optional[paths.Page], Optional[paths.Page]]:
+    """
+    Get a page of books ordered by handle
+
+    :param db:      ORM Session
+    :param page:    Requested page (default: first page)
+    :param filters: Filters allowed in BOOKS (default: None)
+    :param sort:    Sort allowed in BOOKS (default: handle)
+    :return:        Tuple(Books, next page, previous page)
+    """
+    rows, next_page, prev_page = _paginate(
+        _filter(BOOKS, db.query(*BOOK_COLUMNS).where(internal.Book.deleted != 1), filters),
+        BOOKS.key,
+        page,
+        _order(BOOKS, sort)
     )
-    return u
+    return paths.Books(items=[external.Book(**_values(x, BOOK_COLUMNS)) for x in rows]), next_page, prev_page
 
 
-def get_clubs(db: Session, bypass_delete: bool = False) -> paths.Clubs:
-    club = db.query(internal.Club).where(internal.Club.deleted != 1).all()
-    iu = [
-        external.ClubInternalBase.from_orm(x) for x in club
-    ]
-    u = list()
-    for c, ic in zip(club, iu):
-        if hasattr(c, 'owner') and c.owner is not None:
-            u.append(external.Club(**ic.dict(), owner=(
-                c.owner.username
-                if c.owner.deleted != 1 or bypass_delete
-                else "deleted"
-            ) if c.owner_id is not None else None))
+def get_clubs(
+        db: Session,
+        page: paths.Page = None,
+        bypass_delete: bool = False,
+        filters: Dict[str, Any] = None,
+        sort: str = None
+) -> Tuple[paths.Clubs, Optional[paths.Page], Optional[paths.Page]]:
+    """
+    Get a page of clubs ordered by handle
+
+    :param db:              ORM Session
+    :param page:            Requested page (default: first page)
+    :param bypass_delete:   Bypass deleted check for owners
+    :param filters:         Filters allowed in CLUBS (default: None)
+    :param sort:            Sort allowed in CLUBS (default: handle)
+    :return:                Tuple(Clubs, next page, previous page)
+    """
+    rows, next_page, prev_page = _paginate(
+        _filter(
+            CLUBS,
+            _clubs(db).where(internal.Club.deleted != 1),
+            filters
+        ),
+        CLUBS.key,
+        page,
+        _order(CLUBS, sort)
+    )
+    return paths.Clubs(items=[_club(x, bypass_delete) for x in rows]), next_page, prev_page
+
+
+def _batch(
+        query: Query,
+        cls: Type[T],
+        handles: Iterable[str],
+        build: Callable[[Row], Any]
+) -> Tuple[List[Any], List[external.MissingItem]]:
+    """
+    Get entities by handle with one IN query
+
+    Items are in the order of the first occurrence of their handle, rows that only match case insensitively
+    (MySQL collation) are matched to the handle they were requested with.
+
+    :param query:   Query selecting the model columns and the deleted column of cls
+    :param cls:     ORM Class
+    :param handles: Handles (usernames for users), at most MAX_BATCH_SIZE different ones
+    :param build:   Builds the external model from a row
+    :return:        Tuple(items, missing handles)
+    """
+    handles = list(dict.fromkeys(handles))
+    if len(handles) > paths.MAX_BATCH_SIZE:
+        raise BadRequest(f"At most {paths.MAX_BATCH_SIZE} handles can be requested at once")
+    column = _handle_column(cls)
+    found: Dict[str, Row] = dict()
+    folded: Dict[str, Row] = dict()
+    if len(handles) != 0:
+        for r in query.where(column.in_(handles)):
+            found[getattr(r, column.key)] = r
+            folded.setdefault(getattr(r, column.key).casefold(), r)
+    items = list()
+    missing = list()
+    for h in handles:
+        r = found.get(h) or folded.get(h.casefold())
+        if r is None:
+            missing.append(external.MissingItem(handle=h, status=external.MissingStatusEnum.not_found))
+        elif r.deleted:
+            missing.append(external.MissingItem(handle=h, status=external.MissingStatusEnum.deleted))
         else:
-            u.append(ic)
-    u = paths.Clubs(items=u)
-    return u
+            items.append(build(r))
+    return items, missing
+
+
+def get_users_by_handle(usernames: Iterable[str], db: Session) -> paths.Users:
+    """
+    Get many users by username in one query
+
+    :param usernames:   Usernames, at most MAX_BATCH_SIZE different ones
+    :param db:          ORM Session
+    :return:            Users found and the usernames that were not
+    """
+    items, missing = _batch(
+        db.query(*USER_COLUMNS, internal.User.deleted),
+        internal.User,
+        usernames,
+        lambda r: external.User(**_values(r, USER_COLUMNS))
+    )
+    return paths.Users(items=items, missing=missing)
+
+
+def get_books_by_handle(handles: Iterable[str], db: Session) -> paths.Books:
+    """
+    Get many books by handle in one query
+
+    :param handles: Handles, at most MAX_BATCH_SIZE different ones
+    :param db:      ORM Session
+    :return:        Books found and the handles that were not
+    """
+    items, missing = _batch(
+        db.query(*BOOK_COLUMNS, internal.Book.deleted),
+        internal.Book,
+        handles,
+        lambda r: external.Book(**_values(r, BOOK_COLUMNS))
+    )
+    return paths.Books(items=items, missing=missing)
+
+
+def get_clubs_by_handle(handles: Iterable[str], db: Session, bypass_delete: bool = False) -> paths.Clubs:
+    """
+    Get many clubs by handle in one query
+
+    :param handles:         Handles, at most MAX_BATCH_SIZE different ones
+    :param db:              ORM Session
+    :param bypass_delete:   Bypass deleted check for owners
+    :return:                Clubs found and the handles that were not
+    """
+    items, missing = _batch(
+        _clubs(db).add_columns(internal.Club.deleted),
+        internal.Club,
+        handles,
+        lambda r: _club(r, bypass_delete)
+    )
+    return paths.Clubs(items=items, missing=missing)
+
+
+def _stream(
+        query: Query,
+        key: Any,
+        after: Optional[str],
+        order: Tuple[Any, Any, bool] = None,
+        limit: int = None
+) -> Iterator[Any]:
+    """
+    Stream rows in key order using a server-side cursor
+
+    Rows are fetched in batches of STREAM_BATCH_SIZE, so memory use doesn't depend on table size.
+    With an order the rows are sorted by (column, tiebreak) instead, like in _paginate.
+
+    :param query:   ORM Query to stream
+    :param key:     Unique ORM column to order by
+    :param after:   Key value to resume after (default: None)
+    :param order:   Tuple(column, tiebreak, descending) to sort by (default: key)
+    :param limit:   Maximum number of rows (default: all)
+    :return:        Row iterator
+    """
+    if order is None:
+        if after is not None:
+            query = query.where(key > after)
+        query = query.order_by(key)
+    else:
+        query = _seek(query, key, after, order, not order[2])
+    if limit is not None:
+        query = query.limit(limit)
+    return query.execution_options(stream_results=True).yield_per(STREAM_BATCH_SIZE)
+
+
+def stream_users(
+        db: Session,
+        after: str = None,
+        filters: Dict[str, Any] = None,
+        sort: str = None,
+        limit: int = None
+) -> Iterator[external.User]:
+    """
+    Stream all users ordered by username
+
+    :param db:      ORM Session
+    :param after:   Username to resume after (default: None)
+    :param filters: Filters allowed in USERS (default: None)
+    :param sort:    Sort allowed in USERS (default: username)
+    :param limit:   Maximum number of users (default: all)
+    :return:        External user model iterator
+    """
+    for x in _stream(
+            _filter(USERS, db.query(*USER_COLUMNS).where(internal.User.deleted != 1), filters),
+            USERS.key,
+            after,
+            _order(USERS, sort),
+            limit
+    ):
+        yield external.User(**_values(x, USER_COLUMNS))
+
+
+def stream_books(
+        db: Session,
+        after: str = None,
+        filters: Dict[str, Any] = None,
+        sort: str = None,
+        limit: int = None
+) -> Iterator[external.Book]:
+    """
+    Stream all books ordered by handle
+
+    :param db:      ORM Session
+    :param after:   Handle to resume after (default: None)
+    :param filters: Filters allowed in BOOKS (default: None)
+    :param sort:    Sort allowed in BOOKS (default: handle)
+    :param limit:   Maximum number of books (default: all)
+    :return:        External book model iterator
+    """
+    for x in _stream(
+            _filter(BOOKS, db.query(*BOOK_COLUMNS).where(internal.Book.deleted != 1), filters),
+            BOOKS.key,
+            after,
+            _order(BOOKS, sort),
+            limit
+    ):
+        yield external.Book(**_values(x, BOOK_COLUMNS))
+
+
+def stream_clubs(
+        db: Session,
+        after: str = None,
+        bypass_delete: bool = False,
+        filters: Dict[str, Any] = None,
+        sort: str = None,
+        limit: int = None
+) -> Iterator[external.Club]:
+    """
+    Stream all clubs ordered by handle
+
+    :param db:              ORM Session
+    :param after:           Handle to resume after (default: None)
+    :param bypass_delete:   Bypass deleted check for owners
+    :param filters:         Filters allowed in CLUBS (default: None)
+    :param sort:            Sort allowed in CLUBS (default: handle)
+    :param limit:           Maximum number of clubs (default: all)
+    :return:                External club model iterator
+    """
+    for c in _stream(
+            _filter(
+                CLUBS,
+                _clubs(db).where(internal.Club.deleted != 1),
+                filters
+            ),
+            CLUBS.key,
+            after,
+            _order(CLUBS, sort),
+            limit
+    ):
+        yield _club(c, bypass_delete)
 
 
 __all__ = [
@@ -765,9 +2118,30 @@ __all__ = [
     'create_review',
     'create_comment',
     'modify_user_book_ignore_status',
+    'rebuild_book_stats',
     'store_user_book',
     # more
     'get_users',
     'get_books',
-    'get_clubs'
+    'get_clubs',
+    'get_users_by_handle',
+    'get_books_by_handle',
+    'get_clubs_by_handle',
+    'stream_users',
+    'stream_books',
+    'stream_clubs',
+    'bulk_create_books',
+    'bulk_create_users',
+    'bulk_create_clubs',
+    'get_book_version',
+    'get_user_version',
+    'get_club_version',
+    'get_collection_version',
+    'upsert_book',
+    'upsert_user',
+    'upsert_club',
+    'search',
+    'get_user_books',
+    'get_book_reviews',
+    'get_review_comments'
 ]
@@ -6,6 +6,13 @@ from .data_models import (
     StatUserBook,
     Club,
     StatusEnum,
+    BulkStatusEnum,
+    BulkItem,
+    MissingStatusEnum,
+    MissingItem,
+    UpsertStatusEnum,
+    SearchTypeEnum,
+    SearchHit,
     Review,
     Comment,
     CommentMason
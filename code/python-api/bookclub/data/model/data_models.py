@@ -12,6 +12,32 @@ class StatusEnum(str, Enum):
     reading = 'reading'
 
 
+class BulkStatusEnum(str, Enum):
+    created = 'created'
+    exists = 'exists'
+    duplicate = 'duplicate'
+    invalid = 'invalid'
+    not_found = 'not_found'
+
+
+class SearchTypeEnum(str, Enum):
+    book = 'book'
+    club = 'club'
+    review = 'review'
+
+
+class MissingStatusEnum(str, Enum):
+    not_found = 'not_found'
+    deleted = 'deleted'
+
+
+class UpsertStatusEnum(str, Enum):
+    created = 'created'
+    recreated = 'recreated'
+    updated = 'updated'
+    unchanged = 'unchanged'
+
+
 class User(MasonBase):
     username: str = Field(min_length=1, max_length=60)
     description: Optional[str] = Field(max_length=250)
@@ -110,6 +136,37 @@ class CommentMason(Comment, MasonBase):
     pass
 
 
+class SearchHit(MasonBase):
+    """
+    Search result, handle is the book handle for reviews and user is the review author
+    """
+    type: SearchTypeEnum
+    handle: str
+    user: Optional[str]
+    title: Optional[str]
+    score: float
+
+
+class MissingItem(BaseModel):
+    """
+    Requested handle without an item in a batch get, handle is the username for users
+    """
+    handle: str
+    status: MissingStatusEnum
+
+
+class BulkItem(BaseModel):
+    """
+    Outcome of a single item in a bulk import
+
+    Index is the position of the item in the request, handle is the username for users.
+    """
+    index: int
+    handle: Optional[str]
+    status: BulkStatusEnum
+    message: Optional[str]
+
+
 """
 ####  ## ##### ##   ##   ##
 ####  ## ##    ##   ##   ##
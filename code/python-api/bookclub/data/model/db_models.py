@@ -25,6 +25,7 @@ class Book(Base):
     description = Column(Text(collation='utf8mb4_unicode_ci'))
     pages = Column(INTEGER(11), index=True)
     deleted = Column(TINYINT(1), nullable=False, index=True, server_default=text("0"))
+    version = Column(INTEGER(11), nullable=False, server_default=text("0"))
     created_at = Column(DateTime, server_default=text("current_timestamp()"))
     updated_at = Column(DateTime)
 
@@ -43,6 +44,19 @@ t_books_statistics = Table(
 )
 
 
+t_book_stats = Table(
+    'book_stats', metadata,
+    Column('book_id', ForeignKey('books.id', ondelete='CASCADE', onupdate='CASCADE'), primary_key=True),
+    Column('reviews', BIGINT(20), nullable=False, server_default=text("0")),
+    Column('stars', BIGINT(20), nullable=False, server_default=text("0")),
+    Column('readers', BIGINT(20), nullable=False, server_default=text("0")),
+    Column('completed', BIGINT(20), nullable=False, server_default=text("0")),
+    Column('pending', BIGINT(20), nullable=False, server_default=text("0")),
+    Column('liked', BIGINT(20), nullable=False, server_default=text("0")),
+    Column('disliked', BIGINT(20), nullable=False, server_default=text("0"))
+)
+
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -51,6 +65,7 @@ class User(Base):
     password_hash = Column(VARCHAR(64))
     description = Column(String(256, 'utf8mb4_unicode_ci'))
     deleted = Column(TINYINT(1), nullable=False, index=True, server_default=text("0"))
+    version = Column(INTEGER(11), nullable=False, server_default=text("0"))
     created_at = Column(DateTime, server_default=text("current_timestamp()"))
     updated_at = Column(DateTime)
 
@@ -63,6 +78,7 @@ class Club(Base):
     handle = Column(String(64, 'utf8mb4_unicode_ci'), nullable=False, unique=True)
     description = Column(String(2048, 'utf8mb4_unicode_ci'))
     deleted = Column(TINYINT(1), nullable=False, index=True, server_default=text("0"))
+    version = Column(INTEGER(11), nullable=False, server_default=text("0"))
     created_at = Column(DateTime, server_default=text("current_timestamp()"))
     updated_at = Column(DateTime)
 
@@ -70,6 +86,13 @@ class Club(Base):
     users = relationship('User', secondary='club_user_link')
 
 
+t_collection_versions = Table(
+    'collection_versions', metadata,
+    Column('name', String(16, 'utf8mb4_unicode_ci'), primary_key=True),
+    Column('version', BIGINT(20), nullable=False, server_default=text("0"))
+)
+
+
 class Comment(Base):
     __tablename__ = 'comments'
 
@@ -89,11 +112,12 @@ class Review(Base):
     __tablename__ = 'reviews'
     __table_args__ = (
         Index('reviews_user_id', 'user_id', 'book_id', unique=True),
+        Index('reviews_book_id', 'book_id', 'created_at')
     )
 
     id = Column(INTEGER(11), primary_key=True)
     user_id = Column(ForeignKey('users.id', ondelete='SET NULL', onupdate='CASCADE'))
-    book_id = Column(ForeignKey('books.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False, index=True)
+    book_id = Column(ForeignKey('books.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
     stars = Column(TINYINT(4), nullable=False, server_default=text("3"))
     title = Column(String(128, 'utf8mb4_unicode_ci'), nullable=False)
     content = Column(Text(collation='utf8mb4_unicode_ci'))
@@ -1,23 +1,87 @@
-from typing import List
+from typing import List, Optional
+
+from pydantic import BaseModel
 
 from .data_models import *
 from ...mason import *
 
+DEFAULT_PAGE_SIZE: int = 50
+MAX_PAGE_SIZE: int = 200
+MAX_SEARCH_OFFSET: int = 1000
+MAX_BATCH_SIZE: int = 200
+
+
+class Page(BaseModel):
+    """
+    Keyset pagination parameters for collections
+
+    Both cursors are identifiers (handle or username) of an item in the collection.
+    Only one of them should be present, after takes precedence.
+    """
+    limit: int = DEFAULT_PAGE_SIZE
+    after: Optional[str]
+    before: Optional[str]
+
+
+class SearchPage(BaseModel):
+    """
+    Offset pagination for ranked results, deep pages are limited by MAX_SEARCH_OFFSET
+    """
+    limit: int = DEFAULT_PAGE_SIZE
+    offset: int = 0
+
 
 class Users(MasonBase):
     items: List[User]
+    missing: Optional[List[MissingItem]]
 
 
 class Books(MasonBase):
     items: List[Book]
+    missing: Optional[List[MissingItem]]
 
 
 class Clubs(MasonBase):
     items: List[Club]
+    missing: Optional[List[MissingItem]]
+
+
+class Reviews(MasonBase):
+    items: List[Review]
+
+
+class Comments(MasonBase):
+    items: List[CommentMason]
+
+
+class UserBooks(MasonBase):
+    items: List[UserBook]
+
+
+class SearchResults(MasonBase):
+    query: str
+    items: List[SearchHit]
+
+
+class BulkReport(MasonBase):
+    created: int
+    failed: int
+    items: List[BulkItem]
 
 
 __all__ = [
+    'DEFAULT_PAGE_SIZE',
+    'MAX_PAGE_SIZE',
+    'MAX_SEARCH_OFFSET',
+    'MAX_BATCH_SIZE',
+    'Page',
+    'SearchPage',
     'Users',
     'Books',
-    'Clubs'
+    'Clubs',
+    'UserBooks',
+    'Reviews',
+    'Comments',
+    'SearchResults',
+    'BulkReport'
 ]
@@ -0,0 +1,99 @@
+"""
+Connection pool instrumentation
+
+Pool classes timing every checkout, so the pool can be sized from data instead of guesses.
+"""
+from time import perf_counter
+from typing import Dict, Any
+
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, Pool
+
+from ..utils.metrics import POOL_WAIT, POOL_CHECKOUT, POOL_FAILURES, POOL_CHECKED_OUT, POOL_OVERFLOW
+
+
+class PoolMetrics:
+    """
+    Pool checkout metrics
+
+    wait is the time spent getting a connection out of the pool (including opening new ones),
+    checkout is the full checkout latency including pre-ping. Failures are timeouts and connection errors.
+    The histograms are the process metrics, the diagnostics show the samples of the current process.
+    """
+
+    def __init__(self):
+        self.wait = POOL_WAIT
+        self.checkout = POOL_CHECKOUT
+        self.failures = 0
+
+    def stats(self, pool: Pool) -> Dict[str, Any]:
+        """
+        Current state of a pool and the recorded metrics
+
+        :param pool:    Pool to report on
+        :return:        Dict of stats
+        """
+        out = {
+            'status': pool.status(),
+            'failures': self.failures,
+            'wait': self.wait.snapshot(),
+            'checkout': self.checkout.snapshot()
+        }
+        if isinstance(pool, QueuePool):
+            out.update({
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow()
+            })
+        return out
+
+
+metrics = PoolMetrics()
+
+
+class _Instrumented:
+    """
+    Mix-in for timing pool checkouts
+
+    Also updates the shared process metrics, the gauges after every checkout and return.
+    """
+
+    def _gauges(self):
+        POOL_CHECKED_OUT.set(self.checkedout())
+        POOL_OVERFLOW.set(max(0, self.overflow()))
+
+    def connect(self):
+        start = perf_counter()
+        try:
+            return super(_Instrumented, self).connect()
+        finally:
+            metrics.checkout.observe(perf_counter() - start)
+            self._gauges()
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super(_Instrumented, self)._do_get()
+        except Exception:
+            metrics.failures += 1
+            POOL_FAILURES.inc()
+            raise
+        finally:
+            metrics.wait.observe(perf_counter() - start)
+
+    def _do_return_conn(self, conn):
+        try:
+            return super(_Instrumented, self)._do_return_conn(conn)
+        finally:
+            self._gauges()
+
+
+class InstrumentedQueuePool(_Instrumented, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_Instrumented, AsyncAdaptedQueuePool):
+    pass
+
+
+__all__ = ['PoolMetrics', 'metrics', 'InstrumentedQueuePool', 'InstrumentedAsyncQueuePool']
@@ -0,0 +1,315 @@
+"""
+Response cache for GET resources
+
+Stores the serialized Mason body and the ETag of a response by route and url. Every entry carries tags of the data
+it shows, e.g. 'Book' for the book collection and 'Book:handle' for a single book, and the generation of every tag
+at the time its data was read. The data access functions bump the generations of the tags they write, once during
+the write and once more after the commit, so entries built from older data are never served again.
+
+The memory backend is process local, entries in other workers are only dropped by the TTL. The file backend keeps
+entries and generations in a directory, so all workers on a host share the cache and its invalidations.
+Disabled unless book_club_response_cache is set to 'memory' or 'file:<directory>', the file backend needs fcntl
+and isn't available on Windows.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from typing import NamedTuple, Optional, Tuple, Dict, Iterable, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from ..utils.metrics import RESPONSE_CACHE_LOOKUPS
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_GENERATION = struct.Struct('Q')
+
+_PENDING = 'bookclub_response_tags'
+
+
+def tag(kind: str, handle: str = None) -> str:
+    """
+    Tag of a collection or of a single entity in it
+
+    Handles are compared case-insensitively like in the database, so the handle is casefolded.
+
+    :param kind:    ORM class name of the entity
+    :param handle:  Handle (username for users) or None for the collection
+    :return:        Tag
+    """
+    return kind if handle is None else f"{kind}:{handle.casefold()}"
+
+
+class Cached(NamedTuple):
+    """
+    Cached response, generations are those of tags when the data was read
+    """
+    expires: float
+    tags: Tuple[str, ...]
+    generations: Tuple[int, ...]
+    etag: Optional[str]
+    body: bytes
+
+
+class MemoryBackend:
+    """
+    LRU store in process memory
+    """
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self._lock = Lock()
+        self._entries: Dict[str, Cached] = OrderedDict()
+        self._generations: Dict[str, int] = dict()
+
+    def load(self, key: str) -> Optional[Cached]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def store(self, key: str, entry: Cached):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def generations(self, tags: Sequence[str]) -> Tuple[int, ...]:
+        return tuple(self._generations.get(t, 0) for t in tags)
+
+    def bump(self, tags: Iterable[str]):
+        with self._lock:
+            for t in tags:
+                self._generations[t] = self._generations.get(t, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileBackend:
+    """
+    Store shared by processes through a directory
+
+    Entries are files named by the hash of their key and replaced atomically. Generations are counters in a
+    memory mapped file, tags are hashed to a fixed number of slots, so a collision only drops more entries.
+    Counters are incremented under an exclusive lock of the file and read without one. The oldest entries
+    are pruned when there are more than size of them.
+    """
+
+    def __init__(self, directory: str, size: int = 1024, slots: int = 4096):
+        if fcntl is None:
+            raise ValueError("The file response cache needs fcntl, use 'memory' on this platform")
+        self.directory = directory
+        self.size = size
+        self.slots = slots
+        self._stores = 0
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(os.path.join(directory, 'generations'), 'a+b')
+        if os.fstat(self._file.fileno()).st_size < slots * _GENERATION.size:
+            self._file.truncate(slots * _GENERATION.size)
+        self._generations = mmap.mmap(self._file.fileno(), slots * _GENERATION.size)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.entry')
+
+    def _slot(self, tag_: str) -> int:
+        return zlib.crc32(tag_.encode('utf-8')) % self.slots * _GENERATION.size
+
+    def load(self, key: str) -> Optional[Cached]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        header, _, body = data.partition(b'\n')
+        expires, tags, generations, etag = json.loads(header)
+        return Cached(expires, tuple(tags), tuple(generations), etag, body)
+
+    def store(self, key: str, entry: Cached):
+        if self.size <= 0:
+            return
+        header = json.dumps([entry.expires, entry.tags, entry.generations, entry.etag]).encode('utf-8')
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header + b'\n' + entry.body)
+            os.replace(temporary, self._path(key))
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self._stores += 1
+        if self._stores % (self.size // 8 + 1) == 0:
+            self._prune()
+
+    def _prune(self):
+        entries = list()
+        for name in os.listdir(self.directory):
+            if name.endswith('.entry'):
+                try:
+                    entries.append((os.stat(os.path.join(self.directory, name)).st_mtime, name))
+                except OSError:
+                    continue
+        entries.sort()
+        for _, name in entries[:max(0, len(entries) - self.size)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+
+    def generations(self, tags: Sequence[str]) -> Tuple[int, ...]:
+        return tuple(_GENERATION.unpack_from(self._generations, self._slot(t))[0] for t in tags)
+
+    def bump(self, tags: Iterable[str]):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            for t in tags:
+                slot = self._slot(t)
+                _GENERATION.pack_into(self._generations, slot, _GENERATION.unpack_from(self._generations, slot)[0] + 1)
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.entry'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+
+
+class ResponseCache:
+    """
+    Response cache over a backend, does nothing without one
+    """
+
+    def __init__(self, backend=None, ttl: float = 60):
+        self.backend = backend
+        self.ttl = ttl
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def ticket(self, tags: Sequence[str]) -> Tuple[Tuple[str, ...], Tuple[int, ...]]:
+        """
+        Generations of tags before the data of a response is read
+
+        :param tags:    Tags of the response
+        :return:        Ticket for put
+        """
+        tags = tuple(tags)
+        return tags, self.backend.generations(tags)
+
+    def get(self, key: str) -> Optional[Cached]:
+        """
+        Get a response
+
+        :param key: Cache key
+        :return:    Response or None if not cached, expired or invalidated
+        """
+        entry = self.backend.load(key)
+        if entry is None or entry.expires < time.time() or self.backend.generations(entry.tags) != entry.generations:
+            RESPONSE_CACHE_LOOKUPS.inc('miss')
+            return None
+        RESPONSE_CACHE_LOOKUPS.inc('hit')
+        return entry
+
+    def put(self, key: str, ticket: Tuple[Tuple[str, ...], Tuple[int, ...]], body: bytes, etag: Optional[str]):
+        """
+        Cache a response, it is dropped on the next get if its tags were invalidated after the ticket
+
+        :param key:     Cache key
+        :param ticket:  Ticket taken before the data was read
+        :param body:    Serialized body
+        :param etag:    ETag of the response
+        """
+        tags, generations = ticket
+        self.backend.store(key, Cached(time.time() + self.ttl, tags, generations, etag, body))
+
+    def invalidate(self, *tags: str):
+        """
+        Invalidate all responses with any of the tags
+
+        :param tags: Tags
+        """
+        if self.backend is not None and len(tags) != 0:
+            self.backend.bump(tags)
+
+    def invalidate_on_commit(self, db: Session, *tags: str):
+        """
+        Invalidate now and again when the transaction commits
+
+        Responses built by other requests before the commit would otherwise be cached with the old data.
+
+        :param db:      ORM Session
+        :param tags:    Tags
+        """
+        if self.backend is None:
+            return
+        self.invalidate(*tags)
+        db.info.setdefault(_PENDING, set()).update(tags)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+def backend(setting: Optional[str], size: int):
+    """
+    Create a backend from the book_club_response_cache setting
+
+    :param setting: 'memory', 'file:<directory>' or None
+    :param size:    Maximum number of entries
+    :return:        Backend or None
+    """
+    if not setting:
+        return None
+    if setting == 'memory':
+        return MemoryBackend(size)
+    if setting.startswith('file:'):
+        return FileBackend(setting[len('file:'):], size)
+    raise ValueError(f"Unknown response cache: {setting}")
+
+
+responses = ResponseCache(
+    backend(os.getenv("book_club_response_cache"), int(os.getenv("book_club_response_cache_size", 1024))),
+    ttl=float(os.getenv("book_club_response_cache_ttl", 60))
+)
+
+
+@event.listens_for(Session, "after_commit")
+def _commit(session: Session):
+    """
+    Savepoints commit too, the tags are kept for the outermost transaction
+    """
+    if session.get_nested_transaction() is not None:
+        return
+    tags = session.info.pop(_PENDING, None)
+    if tags:
+        responses.invalidate(*tags)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _rollback(session: Session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_PENDING, None)
+
+
+__all__ = ['tag', 'Cached', 'MemoryBackend', 'FileBackend', 'ResponseCache', 'responses']
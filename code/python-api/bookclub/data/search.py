@@ -0,0 +1,161 @@
+"""
+In-process full-text search
+
+Fallback for databases without a full-text index (e.g. SQLite in tests). MySQL uses FULLTEXT indexes instead.
+Documents are ranked with BM25, the indexes are rebuilt from the database when a collection version changes
+or after a transaction that wrote indexed documents commits, databases without version triggers rely on the latter.
+"""
+import math
+import re
+from collections import defaultdict
+from threading import Lock
+from typing import Dict, List, Tuple, Hashable, Iterable, Optional, Callable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+_PENDING = 'bookclub_search_indexes'
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    Split text into lowercase words
+
+    :param text:    Text
+    :return:        Tokens
+    """
+    return TOKEN.findall(text.casefold()) if text else []
+
+
+class InvertedIndex:
+    """
+    Term to document postings with BM25 scoring
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[Hashable, int]] = defaultdict(dict)
+        self.lengths: Dict[Hashable, int] = dict()
+
+    def add(self, key: Hashable, text: str):
+        tokens = tokenize(text)
+        self.lengths[key] = len(tokens)
+        for token in tokens:
+            postings = self.postings[token]
+            postings[key] = postings.get(key, 0) + 1
+
+    def search(self, query: str) -> List[Tuple[Hashable, float]]:
+        """
+        Find documents containing any of the query terms
+
+        :param query:   Query text
+        :return:        Tuples of (key, score), best first
+        """
+        n = len(self.lengths)
+        if n == 0:
+            return []
+        average = sum(self.lengths.values()) / n
+        scores: Dict[Hashable, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / average)
+                scores[key] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda i: -i[1])
+
+
+class SearchIndexes:
+    """
+    Lazily built inverted indexes, one per document type
+
+    Each index is tagged with the version of the data it was built from.
+    """
+
+    def __init__(self):
+        self.indexes: Dict[str, Tuple[str, InvertedIndex]] = dict()
+        self._lock = Lock()
+
+    def get(
+            self,
+            name: str,
+            version: str,
+            load: Callable[[], Iterable[Tuple[Hashable, str]]]
+    ) -> InvertedIndex:
+        """
+        Get an index, rebuilding it if the data version changed
+
+        :param name:    Index name
+        :param version: Current version of the indexed data
+        :param load:    Loads (key, text) for every document
+        :return:        Index
+        """
+        with self._lock:
+            current = self.indexes.get(name)
+            if current is not None and current[0] == version:
+                return current[1]
+        index = InvertedIndex()
+        for key, text in load():
+            index.add(key, text)
+        with self._lock:
+            self.indexes[name] = (version, index)
+        return index
+
+    def invalidate(self, *names: str):
+        """
+        Drop indexes, they are rebuilt on the next search
+
+        :param names:   Index names
+        """
+        with self._lock:
+            for name in names:
+                self.indexes.pop(name, None)
+
+    def invalidate_on_commit(self, db: Session, *names: str):
+        """
+        Drop indexes now and again when the transaction commits
+
+        Indexes built by other requests before the commit would otherwise keep the old documents.
+
+        :param db:      ORM Session
+        :param names:   Index names
+        """
+        self.invalidate(*names)
+        db.info.setdefault(_PENDING, set()).update(names)
+
+    def clear(self):
+        with self._lock:
+            self.indexes.clear()
+
+
+indexes = SearchIndexes()
+
+
+@event.listens_for(Session, "after_commit")
+def _commit(session: Session):
+    """
+    Savepoints commit too, the names are kept for the outermost transaction
+    """
+    if session.get_nested_transaction() is not None:
+        return
+    names = session.info.pop(_PENDING, None)
+    if names:
+        indexes.invalidate(*names)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _clear(session: Session, previous_transaction):
+    """
+    Versions are reused after a rollback, so indexes built inside the transaction can't be trusted
+    """
+    if previous_transaction.parent is None:
+        session.info.pop(_PENDING, None)
+    indexes.clear()
+
+
+__all__ = ['tokenize', 'InvertedIndex', 'SearchIndexes', 'indexes']
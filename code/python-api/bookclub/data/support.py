@@ -1,49 +1,280 @@
-from typing import Generator
+import json
+import re
+import time
+from threading import Lock
+from typing import Generator, AsyncGenerator, Dict, Optional, Tuple
 
 from fastapi import Depends
-from sqlalchemy import create_engine
+from pydantic import BaseSettings
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session
 
+from .pool import InstrumentedQueuePool, InstrumentedAsyncQueuePool
+from ..utils import logger, timing
+from ..utils.metrics import ROLLBACKS
+
 engine: Engine
 SessionLocal: sessionmaker
+async_mode: bool = False
+
+"""
+Url and settings of the configured database until its engine is created
+"""
+_pending: Optional[Tuple[str, 'EngineSettings']] = None
+_pending_lock = Lock()
+
+
+class EngineSettings(BaseSettings):
+    """
+    Engine and connection pool settings
+
+    Read from environment variables prefixed with book_club_db_ (e.g. book_club_db_pool_size),
+    keyword arguments take precedence. Session variables are given as JSON in the environment.
+
+    pool_pre_ping checks connections on every checkout (pessimistic), without it disconnects are
+    only noticed when a statement fails (optimistic).
+
+    Statements running longer than slow_query_ms are logged, a negative value disables the log.
+    """
+    pool_size: int = 2
+    max_overflow: int = 18
+    pool_timeout: float = 30
+    pool_recycle: int = 50
+    pool_pre_ping: bool = True
+    pool_reset_on_return: Optional[str] = 'rollback'
+    statement_cache_size: int = 500
+    session_variables: Dict[str, str] = dict()
+    slow_query_ms: float = 500
+
+    class Config:
+        env_prefix = 'book_club_db_'
+
+    def engine_options(self) -> Dict:
+        return dict(
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            pool_timeout=self.pool_timeout,
+            pool_recycle=self.pool_recycle,
+            pool_pre_ping=self.pool_pre_ping,
+            pool_reset_on_return=self.pool_reset_on_return,
+            query_cache_size=self.statement_cache_size
+        )
+
+
+def _session_variables(e: Engine, variables: Dict[str, str]):
+    """
+    Set session variables on every new connection
+
+    :param e:           Engine
+    :param variables:   Variable names and values
+    """
+    for name in variables:
+        if re.fullmatch(r"\w+", name) is None:
+            raise ValueError(f"Invalid session variable name: {name}")
+
+    @event.listens_for(e, "connect")
+    def connect(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        try:
+            for k, v in variables.items():
+                cursor.execute(f"SET SESSION {k} = %s", (v,))
+        finally:
+            cursor.close()
+
+
+def _instrument(e: Engine, slow_query_ms: float):
+    """
+    Count and time statements for the current request and log slow ones
+
+    :param e:               Engine
+    :param slow_query_ms:   Slow query threshold in milliseconds, negative to disable
+    """
+    slow_log = logger.getChild('sql')
+
+    @event.listens_for(e, "before_cursor_execute")
+    def before(conn, *_):
+        conn.info['query_started'] = time.perf_counter()
+
+    @event.listens_for(e, "after_cursor_execute")
+    def after(conn, _cursor, statement, _parameters, _context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop('query_started', time.perf_counter())
+        timing.query(elapsed)
+        if 0 <= slow_query_ms <= elapsed * 1000:
+            current = timing.current.get()
+            slow_log.warning(json.dumps(dict(
+                event="slow_query",
+                ms=round(elapsed * 1000, 3),
+                path=current.path if current is not None else None,
+                executemany=executemany,
+                statement=statement[:1000]
+            )))
 
 
 # Dependency
 # https://fastapi.tiangolo.com/tutorial/sql-databases/
 def database() -> Generator[Session, None, None]:
-    db: Session = SessionLocal()
+    db: Session = ready()()
     try:
         with db.begin():
             yield db
+    except Exception:
+        ROLLBACKS.inc('error')
+        raise
     finally:
         db.close()
 
 
-def init(url: str, test: bool = True):
+_database_code = database.__code__
+
+
+def _test_database() -> Generator[Session, None, None]:
+    """
+    Every transaction is rolled back, only those ended by an error count as rollbacks
+    """
+    db: Session = ready()()
+    try:
+        db.begin()
+        yield db
+        db.rollback()
+    except Exception:
+        ROLLBACKS.inc('error')
+        raise
+    finally:
+        db.close()
+
+
+async def _async_database() -> AsyncGenerator:
+    db = ready()()
+    try:
+        async with db.begin():
+            yield db
+    except Exception:
+        ROLLBACKS.inc('error')
+        raise
+    finally:
+        await db.close()
+
+
+async def _async_test_database() -> AsyncGenerator:
+    db = ready()()
+    try:
+        await db.begin()
+        yield db
+        await db.rollback()
+    except Exception:
+        ROLLBACKS.inc('error')
+        raise
+    finally:
+        await db.close()
+
+
+def configure(url: str, test: bool = True, asynchronous: bool = False, settings: EngineSettings = None, **kwargs):
+    """
+    Select the session dependency, the engine is created by ready() or on first use
+
+    Replaces an engine created for an earlier configuration.
+
+    :param url:             Database url, needs an async driver (e.g. mysql+aiomysql) if asynchronous
+    :param test:            Roll back all transactions
+    :param asynchronous:    Use an async engine, database() will yield AsyncSession instances
+    :param settings:        Engine settings (default: from environment and kwargs)
+    :param kwargs:          Overrides for EngineSettings fields
+    """
+    global _pending
+    global async_mode
+    with _pending_lock:
+        globals().pop('engine', None)
+        globals().pop('SessionLocal', None)
+        async_mode = asynchronous
+        _pending = (url, settings if settings is not None else EngineSettings(**kwargs))
+        if asynchronous:
+            database.__code__ = (_async_test_database if test else _async_database).__code__
+        else:
+            database.__code__ = _test_database.__code__ if test else _database_code
+
+
+def ready() -> sessionmaker:
+    """
+    Create the engine of the configured database unless it exists
+
+    :return: Session factory
+    """
     global engine
     global SessionLocal
-    engine = create_engine(
-        url,
-        pool_size=2,
-        pool_pre_ping=True,
-        pool_reset_on_return='rollback',
-        pool_recycle=50,
-        max_overflow=18
-    )
-    SessionLocal = sessionmaker(autocommit=False, bind=engine)
-    if test:
-        def __database() -> Session:
-            db: Session = SessionLocal()
-            try:
-                db.begin()
-                yield db
-                db.rollback()
-            finally:
-                db.close()
-
-        database.__code__ = __database.__code__
-
-
-__all__ = ['init', 'database', 'Session', 'Generator', 'Depends', 'IntegrityError']
+    global _pending
+    factory = globals().get('SessionLocal')
+    if factory is not None:
+        return factory
+    with _pending_lock:
+        if 'SessionLocal' in globals():
+            return SessionLocal
+        if _pending is None:
+            raise RuntimeError("Database is not configured, call init() or configure() first")
+        url, settings = _pending
+        if async_mode:
+            from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+            engine = create_async_engine(url, poolclass=InstrumentedAsyncQueuePool, **settings.engine_options())
+            _session_variables(engine.sync_engine, settings.session_variables)
+            _instrument(engine.sync_engine, settings.slow_query_ms)
+            SessionLocal = sessionmaker(autocommit=False, bind=engine, class_=AsyncSession)
+        else:
+            engine = create_engine(url, poolclass=InstrumentedQueuePool, **settings.engine_options())
+            _session_variables(engine, settings.session_variables)
+            _instrument(engine, settings.slow_query_ms)
+            SessionLocal = sessionmaker(autocommit=False, bind=engine)
+        _pending = None
+        return SessionLocal
+
+
+def init(url: str, test: bool = True, asynchronous: bool = False, settings: EngineSettings = None, **kwargs):
+    """
+    Create the engine and select the session dependency
+
+    :param url:             Database url, needs an async driver (e.g. mysql+aiomysql) if asynchronous
+    :param test:            Roll back all transactions
+    :param asynchronous:    Use an async engine, database() will yield AsyncSession instances
+    :param settings:        Engine settings (default: from environment and kwargs)
+    :param kwargs:          Overrides for EngineSettings fields
+    """
+    configure(url, test, asynchronous, settings, **kwargs)
+    ready()
+
+
+async def dispose():
+    """
+    Close the pooled connections of the engine if it was created, it stays usable
+    """
+    e = globals().get('engine')
+    if e is None:
+        return
+    if async_mode:
+        await e.dispose()
+    else:
+        e.dispose()
+
+
+def sync_engine() -> Engine:
+    """
+    The synchronous engine, for async engines this is the proxied engine
+
+    Use this for events and pool access.
+
+    :return: Engine
+    """
+    ready()
+    return engine.sync_engine if async_mode else engine
+
+
+def __getattr__(name: str):
+    """
+    Create the engine when engine or SessionLocal is first read from the module
+    """
+    if name in ('engine', 'SessionLocal') and _pending is not None:
+        ready()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ['init', 'configure', 'ready', 'dispose', 'database', 'Session', 'Generator', 'Depends', 'IntegrityError', 'EngineSettings', 'sync_engine']
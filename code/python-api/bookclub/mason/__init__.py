@@ -12,3 +12,7 @@ from .mason import (
     EncodingEnum,
     datetime
 )
+from .response import (
+    MasonResponse,
+    dumps
+)
@@ -0,0 +1,78 @@
+"""
+Fast-path response class for Mason models
+
+Handlers returning a MasonResponse skip FastAPI response_model validation and jsonable_encoder.
+The models are already valid when they leave the handlers, so they are only dumped once.
+
+Uses orjson if it is available and falls back to the standard library json.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+from ..utils.timing import serializing
+
+
+def _default(o: Any) -> Any:
+    """
+    Serializer for values not natively supported by the encoder
+    """
+    if isinstance(o, BaseModel):
+        return o.dict(by_alias=True, exclude_none=True, exclude_defaults=True)
+    elif isinstance(o, (datetime, date)):
+        return o.isoformat()
+    elif isinstance(o, Decimal):
+        return float(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+try:
+    import orjson
+
+
+    def _dumps(content: Any) -> bytes:
+        return orjson.dumps(content, default=_default)
+
+except ImportError:  # pragma: no cover
+    import json
+
+
+    def _dumps(content: Any) -> bytes:
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+            default=_default
+        ).encode("utf-8")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Dump content to JSON bytes
+
+    Models are written out by alias excluding None and default values,
+    same as the response_model_exclude_* settings used in the routers.
+
+    :param content: Model or JSON compatible content
+    :return:        Bytes
+    """
+    if isinstance(content, BaseModel):
+        content = _default(content)
+    return _dumps(content)
+
+
+class MasonResponse(JSONResponse):
+    """
+    Response for Mason models
+    """
+
+    def render(self, content: Any) -> bytes:
+        with serializing():
+            return dumps(content)
+
+
+__all__ = ['MasonResponse', 'dumps']
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from .paths import path, control
+from ..data.pool import metrics
+from ..data.support import sync_engine
+from ..mason import MasonResponse
+from ..utils.metrics import exposition
+
+diagnostics = APIRouter(prefix="/diagnostics")
+exporter = APIRouter()
+
+
+@diagnostics.get("/pool", response_class=MasonResponse)
+async def get_pool_diagnostics(request: Request):
+    """
+    Connection pool state and checkout latency histograms (seconds)
+    """
+    out = metrics.stats(sync_engine().pool)
+    out["@controls"] = {
+        "self": control(href=path(request, "get_pool_diagnostics")),
+        "bc:home": control(href=path(request, "entrypoint"))
+    }
+    return MasonResponse(out)
+
+
+@exporter.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Metrics of all worker processes in the Prometheus text format
+    """
+    return PlainTextResponse(exposition(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+__all__ = ['diagnostics', 'exporter']
@@ -1,16 +1,27 @@
+import json
 from functools import partial
-from typing import Optional, TypeVar, Callable
-from urllib.parse import quote
+from hashlib import sha1
+from typing import Optional, TypeVar, Callable, AsyncIterator, Dict, Type, Tuple, Union, Awaitable, List, Set, Any
+from urllib.parse import quote, urlencode
 
-from fastapi import APIRouter, Response, Request
+from fastapi import APIRouter, Response, Request, Query, Body
 from fastapi.exceptions import HTTPException
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 
 from ..data import *
-from ..mason import MasonBase, Control, Namespace
+from ..data import async_access as access
+from ..data.data_access import BULK_BATCH_SIZE
+from ..data.responses import responses, tag
+from ..mason import MasonBase, Control, Namespace, MasonResponse, dumps
 
 entry = APIRouter()
-entry.get = partial(entry.get, response_model_exclude_defaults=True, response_model_exclude_none=True)
+entry.get = partial(
+    entry.get,
+    response_class=MasonResponse,
+    response_model_exclude_defaults=True,
+    response_model_exclude_none=True
+)
 
 """
 Replace this with a 'better' version that will quote absolutely everything.
@@ -20,29 +31,87 @@ Similarly all incoming new models have to be sanitized.
 """
 quote = partial(quote, safe="")
 
+NDJSON: str = 'application/x-ndjson'
+
+
+"""
+Path templates of all named routes, e.g. get_book_resource -> /books/{book}
+
+Resolved from the application router once and reused for every control after that.
+"""
+templates: Dict[str, str] = dict()
+
+
+def template(request: Request, func: str) -> str:
+    """
+    Get the path template of a route
+
+    :param request: Request
+    :param func:    Path function to get the template for
+    :return:        Path template
+    """
+    try:
+        return templates[func]
+    except KeyError:
+        for route in request.app.router.routes:
+            if hasattr(route, 'path_format'):
+                templates.setdefault(route.name, route.path_format)
+        return templates[func]
+
+
+def base(request: Request) -> str:
+    """
+    Base url of a request without the trailing slash
+
+    Cached in the request state, so it is only built once per request.
+
+    :param request: Request
+    :return:        Base url
+    """
+    try:
+        return request.state.base
+    except AttributeError:
+        request.state.base = str(request.base_url).rstrip("/")
+        return request.state.base
+
 
 def path(request: Request, func: str, **kwargs) -> str:
     """
     Resolve path from request
-    Until router can resolve full paths, this will stay here
+
+    Fills in the route template with plain string formatting instead of going through url_for,
+    so path arguments must be quoted beforehand.
 
     :param request:     Request
     :param func:        Path function to resolve from
     :param kwargs:      Path arguments
     :return:            Path string
     """
-    return request.url_for(func, **kwargs)
+    return base(request) + template(request, func).format(**kwargs)
+
+
+def control(href: str, **kwargs) -> Control:
+    """
+    Create a Control without validation
+
+    Only for hrefs built by this module, those are always valid urls.
+
+    :param href:    Control href
+    :param kwargs:  Pass-through to Control
+    :return:        Control
+    """
+    return Control.construct(href=href, **kwargs)
 
 
 T = TypeVar('T', bound=MasonBase)
 
 
-def append_(request: Request, control: str, path_function: str, out: T, **kwargs) -> T:
+def append_(request: Request, name: str, path_function: str, out: T, **kwargs) -> T:
     """
     Append a Control to a Model
 
     :param request:             Request
-    :param control:             Control name to append
+    :param name:                Control name to append
     :param path_function:       Name of path function to resolve Control href from
     :param out:                 Model to append to
     :param kwargs:              Pass-through to Control
@@ -52,7 +121,7 @@ def append_(request: Request, control: str, path_function: str, out: T, **kwargs
         out.controls = dict()
     try:
         out.controls.update({
-            control: Control(
+            name: control(
                 href=path(request, path_function, **{
                     path_function.split("_")[1]: quote(out.handle if hasattr(out, 'handle') else out.username)
                 }),
@@ -113,7 +182,7 @@ def append_home_link(request: Request, out: T) -> T:
     if out.controls is None:
         out.controls = dict()
     out.controls.update({
-        "bc:home": Control(
+        "bc:home": control(
             href=path(request, "entrypoint")
         )
     })
@@ -156,13 +225,176 @@ def append_single_resource_controls(out: T, resource: str, request: Request) ->
     return out
 
 
-def append_collection_resource_controls(out: T, resource: str, request: Request) -> T:
+def page_path(request: Request, page: Union[Page, SearchPage]) -> str:
+    """
+    Resolve the path to another page of the current collection
+
+    Query parameters not related to paging are preserved.
+
+    :param request: Request
+    :param page:    Page to link to
+    :return:        Path string
+    """
+    query = [(k, v) for k, v in request.query_params.multi_items() if k not in page.__fields__]
+    query.extend(page.dict(exclude_none=True).items())
+    return str(request.url.replace(query=urlencode(query)))
+
+
+def append_page_links(
+        request: Request,
+        out: T,
+        next_page: Optional[Union[Page, SearchPage]],
+        prev_page: Optional[Union[Page, SearchPage]]
+) -> T:
+    """
+    Appends next and prev links to a collection model
+
+    :param request:     Request
+    :param out:         Model to append to
+    :param next_page:   Next page or None if this is the last one
+    :param prev_page:   Previous page or None if this is the first one
+    :return:            Model
+    """
+    if out.controls is None:
+        out.controls = dict()
+    if next_page is not None:
+        out.controls["next"] = control(href=page_path(request, next_page), method="GET")
+    if prev_page is not None:
+        out.controls["prev"] = control(href=page_path(request, prev_page), method="GET")
+    return out
+
+
+def page(
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        after: Optional[str] = None,
+        before: Optional[str] = None
+) -> Page:
+    """
+    Paging query dependency for collections
+    """
+    return Page(limit=limit, after=after, before=before)
+
+
+"""
+Filter query dependencies for collections, the names are checked against the allowlists in data access
+"""
+
+
+def user_filters(prefix: Optional[str] = Query(None, min_length=1, max_length=60)) -> Dict[str, Any]:
+    return dict(prefix=prefix)
+
+
+def book_filters(
+        min_pages: Optional[int] = Query(None, ge=0),
+        max_pages: Optional[int] = Query(None, ge=0)
+) -> Dict[str, Any]:
+    return dict(min_pages=min_pages, max_pages=max_pages)
+
+
+def club_filters(owner: Optional[str] = Query(None, min_length=1, max_length=60)) -> Dict[str, Any]:
+    return dict(owner=owner)
+
+
+def etag(request: Request, version: Optional[str]) -> Optional[str]:
+    """
+    Strong ETag of a representation
+
+    Controls and paging depend on the request url, so it is a part of the tag together with the data version.
+
+    :param request: Request
+    :param version: Version of the data or None if unknown
+    :return:        Quoted ETag or None
+    """
+    if version is None:
+        return None
+    return '"' + sha1(f"{request.url}|{version}".encode()).hexdigest() + '"'
+
+
+def not_modified(request: Request, tag: Optional[str]) -> bool:
+    """
+    Whether If-None-Match matches the current ETag
+
+    :param request: Request
+    :param tag:     Current ETag
+    :return:        True if a 304 should be sent
+    """
+    header = request.headers.get("if-none-match")
+    if tag is None or header is None:
+        return False
+    return any(t.strip() in ("*", tag, "W/" + tag) for t in header.split(","))
+
+
+async def conditional(request: Request, tag: Optional[str], build: Callable[[], Awaitable[Response]]) -> Response:
+    """
+    Answer 304 Not Modified without building the body if the client has the current representation
+
+    :param request: Request
+    :param tag:     Current ETag
+    :param build:   Builds the full response
+    :return:        Response with the ETag header
+    """
+    if not_modified(request, tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    response = await build()
+    if tag is not None:
+        response.headers["ETag"] = tag
+    return response
+
+
+async def cached(
+        request: Request,
+        tags: Tuple[str, ...],
+        version: Callable[[], Awaitable[Optional[str]]],
+        build: Callable[[], Awaitable[Response]]
+) -> Response:
+    """
+    Conditional response served from the response cache if it is enabled
+
+    A hit doesn't touch the database. A miss takes a ticket of the tags before reading the version and the data,
+    so a write during the request keeps the response out of the cache. Handles in the path match case-insensitively
+    and the controls are built from the stored handle, so the path is casefolded in the key.
+
+    :param request: Request
+    :param tags:    Tags of the data in the response
+    :param version: Reads the data version for the ETag
+    :param build:   Builds the full response
+    :return:        Response with the ETag header
+    """
+    if not responses.enabled:
+        return await conditional(request, etag(request, await version()), build)
+    key = f"{request.scope['endpoint'].__name__}|{request.url.replace(path=request.url.path.casefold())}"
+    hit = responses.get(key)
+    if hit is not None:
+        if not_modified(request, hit.etag):
+            return Response(status_code=304, headers={"ETag": hit.etag})
+        return Response(
+            hit.body,
+            media_type=MasonResponse.media_type,
+            headers={"ETag": hit.etag} if hit.etag is not None else None
+        )
+    ticket = responses.ticket(tags)
+    current = etag(request, await version())
+    response = await conditional(request, current, build)
+    if response.status_code == 200:
+        responses.put(key, ticket, response.body, current)
+    return response
+
+
+def append_collection_resource_controls(
+        out: T,
+        resource: str,
+        request: Request,
+        next_page: Page = None,
+        prev_page: Page = None
+) -> T:
     """
     Common links for all collection resources
 
     :param out:         Collection model going out
     :param resource:    SINGULAR NOUN of resource in question
     :param request:     Request object
+    :param next_page:   Next page of the collection if any
+    :param prev_page:   Previous page of the collection if any
     :return:            Model object
     """
     for item in out.items:
@@ -170,17 +402,90 @@ def append_collection_resource_controls(out: T, resource: str, request: Request)
     append_home_link(request, out)
     append_namespace(request, out)
     out.controls.update({
-        "self": Control(
+        "self": control(
             href=path(request, "get_" + resource + "s_resource"),
             method="GET"
         ),
 
-        "add": Control(
+        "add": control(
             href=path(request, "add_" + resource + "_resource"),
             method="POST"
         )
     })
-    return out
+    return append_page_links(request, out, next_page, prev_page)
+
+
+async def batch_get(
+        request: Request,
+        resource: str,
+        get: Callable[[List[str], Session], Awaitable[T]],
+        handles: List[str],
+        db: Session
+) -> MasonResponse:
+    """
+    Items of a collection by handle in one query, handles without an item are listed as missing
+
+    :param request:     Request object
+    :param resource:    SINGULAR NOUN of resource in question
+    :param get:         Async batch data access function
+    :param handles:     Handles (usernames for users)
+    :param db:          ORM Session
+    :return:            Collection without page links
+    """
+    return MasonResponse(append_collection_resource_controls(await get(handles, db), resource, request))
+
+
+def streaming(request: Request, stream: bool) -> bool:
+    """
+    Whether a streaming collection representation was requested
+
+    :param request: Request
+    :param stream:  Value of the stream query flag
+    :return:        True if streaming should be used
+    """
+    return stream or NDJSON in request.headers.get("accept", "")
+
+
+async def stream_collection(
+        request: Request,
+        resource: str,
+        source: Callable[..., AsyncIterator[T]],
+        p: Page,
+        **kwargs
+) -> StreamingResponse:
+    """
+    Stream a collection as NDJSON, one item with its controls per line
+
+    The stream opens its own session, so it stays valid for as long as the response is being written.
+    The whole collection is streamed unless the limit is given in the query. The first item is fetched before
+    responding, so an unknown sort or cursor is reported with a status code instead of breaking off the body.
+
+    :param request:     Request object
+    :param resource:    SINGULAR NOUN of resource in question
+    :param source:      Async data access function streaming the items
+    :param p:           Requested page, after is the handle to resume after
+    :param kwargs:      Pass-through to source
+    :return:            Streaming response
+    """
+    if p.before is not None:
+        raise HTTPException(400, "Streaming doesn't support before")
+    limit = p.limit if "limit" in request.query_params else None
+
+    async def lines() -> AsyncIterator[bytes]:
+        async with access.session() as db:
+            async for item in source(db, p.after, limit=limit, **kwargs):
+                yield dumps(append_single_resource_controls(item, resource, request)) + b"\n"
+
+    async def body(first: bytes, rest: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        yield first
+        async for line in rest:
+            yield line
+
+    items = lines()
+    try:
+        return StreamingResponse(body(await items.__anext__(), items), media_type=NDJSON)
+    except StopAsyncIteration:
+        return Response(media_type=NDJSON)
 
 
 class Entrypoint(MasonBase):
@@ -215,23 +520,28 @@ async def entrypoint(request: Request, query: HelloQuery = Depends()):
         message=query.message or "none"
     )
     hm.controls = {
-        "bc:books-all": Control(
+        "bc:books-all": control(
             title="Books Collection",
             href=path(request, "get_books_resource")
         ),
-        "bc:users-all": Control(
+        "bc:users-all": control(
             title="Users Collection",
             href=path(request, "get_users_resource")
         ),
-        "bc:clubs-all": Control(
+        "bc:clubs-all": control(
             title="Clubs Collection",
             href=path(request, "get_clubs_resource")
         ),
-        "self": Control(
+        "bc:search": control(
+            title="Search",
+            href=path(request, "search_resource") + "{?q,type,limit,offset}",
+            isHrefTemplate=True
+        ),
+        "self": control(
             href=path(request, "entrypoint")
         )
     }
-    return append_namespace(request, append_home_link(request, hm))
+    return MasonResponse(append_namespace(request, append_home_link(request, hm)))
 
 
 """
@@ -244,18 +554,131 @@ async def entrypoint(request: Request, query: HelloQuery = Depends()):
 
 
 @entry.get("/users", response_model=Users)
-async def get_users_resource(request: Request, db: Session = Depends(database)):
-    return append_collection_resource_controls(get_users(db), "user", request)
+async def get_users_resource(
+        request: Request,
+        p: Page = Depends(page),
+        filters: Dict[str, Any] = Depends(user_filters),
+        sort: Optional[str] = None,
+        stream: bool = False,
+        username: Optional[List[str]] = Query(None),
+        db: Session = Depends(database)
+):
+    if username is not None:
+        return await cached(
+            request,
+            (tag("User"),),
+            lambda: access.get_collection_version("users", db),
+            lambda: batch_get(request, "user", access.get_users_by_handle, username, db)
+        )
+    if streaming(request, stream):
+        return await stream_collection(request, "user", access.stream_users, p, filters=filters, sort=sort)
+
+    async def build() -> Response:
+        users, next_page, prev_page = await access.get_users(db, p, filters=filters, sort=sort)
+        return MasonResponse(append_collection_resource_controls(users, "user", request, next_page, prev_page))
+
+    return await cached(request, (tag("User"),), lambda: access.get_collection_version("users", db), build)
 
 
 @entry.get("/books", response_model=Books)
-async def get_books_resource(request: Request, db: Session = Depends(database)):
-    return append_collection_resource_controls(get_books(db), "book", request)
+async def get_books_resource(
+        request: Request,
+        p: Page = Depends(page),
+        filters: Dict[str, Any] = Depends(book_filters),
+        sort: Optional[str] = None,
+        stream: bool = False,
+        handle: Optional[List[str]] = Query(None),
+        db: Session = Depends(database)
+):
+    if handle is not None:
+        return await cached(
+            request,
+            (tag("Book"),),
+            lambda: access.get_collection_version("books", db),
+            lambda: batch_get(request, "book", access.get_books_by_handle, handle, db)
+        )
+    if streaming(request, stream):
+        return await stream_collection(request, "book", access.stream_books, p, filters=filters, sort=sort)
+
+    async def build() -> Response:
+        books, next_page, prev_page = await access.get_books(db, p, filters=filters, sort=sort)
+        return MasonResponse(append_collection_resource_controls(books, "book", request, next_page, prev_page))
+
+    return await cached(request, (tag("Book"),), lambda: access.get_collection_version("books", db), build)
 
 
 @entry.get("/clubs", response_model=Clubs)
-async def get_clubs_resource(request: Request, db: Session = Depends(database)):
-    return append_collection_resource_controls(get_clubs(db), "club", request)
+async def get_clubs_resource(
+        request: Request,
+        p: Page = Depends(page),
+        filters: Dict[str, Any] = Depends(club_filters),
+        sort: Optional[str] = None,
+        stream: bool = False,
+        handle: Optional[List[str]] = Query(None),
+        db: Session = Depends(database)
+):
+    if handle is not None:
+        return await cached(
+            request,
+            (tag("Club"), tag("User")),
+            lambda: access.get_collection_version("clubs", db),
+            lambda: batch_get(request, "club", access.get_clubs_by_handle, handle, db)
+        )
+    if streaming(request, stream):
+        return await stream_collection(request, "club", access.stream_clubs, p, filters=filters, sort=sort)
+
+    async def build() -> Response:
+        clubs, next_page, prev_page = await access.get_clubs(db, p, filters=filters, sort=sort)
+        return MasonResponse(append_collection_resource_controls(clubs, "club", request, next_page, prev_page))
+
+    return await cached(
+        request,
+        (tag("Club"), tag("User")),
+        lambda: access.get_collection_version("clubs", db),
+        build
+    )
+
+
+"""
+Search, results link to the resource they were found in
+"""
+
+
+def append_search_hit_controls(hit: SearchHit, request: Request) -> SearchHit:
+    """
+    Links from a search hit to its resource
+
+    :param hit:     Search hit
+    :param request: Request object
+    :return:        Hit
+    """
+    if hit.type == SearchTypeEnum.book:
+        hit.controls = {"self": control(href=path(request, "get_book_resource", book=quote(hit.handle)))}
+    elif hit.type == SearchTypeEnum.club:
+        hit.controls = {"self": control(href=path(request, "get_club_resource", club=quote(hit.handle)))}
+    else:
+        hit.controls = {"bc:book": control(href=path(request, "get_book_resource", book=quote(hit.handle)))}
+        if hit.user is not None:
+            hit.controls["bc:user"] = control(href=path(request, "get_user_resource", user=quote(hit.user)))
+    return hit
+
+
+@entry.get("/search", response_model=SearchResults)
+async def search_resource(
+        request: Request,
+        q: str = Query(..., min_length=1, max_length=250),
+        type: Optional[List[SearchTypeEnum]] = Query(None),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+        db: Session = Depends(database)
+):
+    results, next_page, prev_page = await access.search(q, db, SearchPage(limit=limit, offset=offset), type)
+    for hit in results.items:
+        append_search_hit_controls(hit, request)
+    append_home_link(request, results)
+    append_namespace(request, results)
+    results.controls["self"] = control(href=str(request.url), method="GET")
+    return MasonResponse(append_page_links(request, results, next_page, prev_page))
 
 
 """
@@ -269,17 +692,120 @@ async def get_clubs_resource(request: Request, db: Session = Depends(database)):
 
 @entry.get("/users/{user}", response_model=User)
 async def get_user_resource(request: Request, user: str, db: Session = Depends(database)):
-    return append_single_resource_controls(get_user(user, db), "user", request)
+
+    async def build() -> Response:
+        return MasonResponse(append_single_resource_controls(await access.get_user(user, db), "user", request))
+
+    return await cached(request, (tag("User", user),), lambda: access.get_user_version(user, db), build)
 
 
 @entry.get("/books/{book}", response_model=Book)
 async def get_book_resource(request: Request, book: str, db: Session = Depends(database)):
-    return append_single_resource_controls(get_book(book, db), "book", request)
+
+    async def build() -> Response:
+        return MasonResponse(append_single_resource_controls(await access.get_book(book, db), "book", request))
+
+    return await cached(request, (tag("Book", book),), lambda: access.get_book_version(book, db), build)
 
 
 @entry.get("/clubs/{club}", response_model=Club)
 async def get_club_resource(request: Request, club: str, db: Session = Depends(database)):
-    return append_single_resource_controls(get_club(club, db), "club", request)
+
+    async def build() -> Response:
+        return MasonResponse(append_single_resource_controls(await access.get_club(club, db), "club", request))
+
+    return await cached(
+        request,
+        (tag("Club", club), tag("User")),
+        lambda: access.get_club_version(club, db),
+        build
+    )
+
+
+@entry.get("/users/{user}/books", response_model=UserBooks)
+async def get_user_books_resource(
+        request: Request,
+        user: str,
+        p: Page = Depends(page),
+        status: Optional[StatusEnum] = None,
+        stats: bool = False,
+        db: Session = Depends(database)
+):
+    books, next_page, prev_page = await access.get_user_books(user, db, p, status, stats)
+    for item in books.items:
+        item.controls = {
+            "bc:book": control(href=path(request, "get_book_resource", book=quote(item.handle)), method="GET")
+        }
+    append_home_link(request, books)
+    append_namespace(request, books)
+    books.controls.update({
+        "self": control(href=path(request, "get_user_books_resource", user=quote(user)), method="GET"),
+        "up": control(href=path(request, "get_user_resource", user=quote(user)), method="GET")
+    })
+    return MasonResponse(append_page_links(request, books, next_page, prev_page))
+
+
+def append_author_control(out: T, user: str, request: Request) -> T:
+    """
+    Links an item to its author, deleted authors have no resource
+
+    :param out:     Item
+    :param user:    Author username
+    :param request: Request object
+    :return:        Item
+    """
+    if out.controls is None:
+        out.controls = dict()
+    if user != "deleted":
+        out.controls["bc:user"] = control(href=path(request, "get_user_resource", user=quote(user)), method="GET")
+    return out
+
+
+@entry.get("/books/{book}/reviews", response_model=Reviews)
+async def get_book_reviews_resource(
+        request: Request,
+        book: str,
+        p: Page = Depends(page),
+        db: Session = Depends(database)
+):
+    reviews, next_page, prev_page = await access.get_book_reviews(book, db, p)
+    for item in reviews.items:
+        append_author_control(item, item.user, request)
+        if item.user != "deleted":
+            item.controls["bc:comments"] = control(
+                href=path(request, "get_review_comments_resource", book=quote(book), user=quote(item.user)),
+                method="GET"
+            )
+    append_home_link(request, reviews)
+    append_namespace(request, reviews)
+    reviews.controls.update({
+        "self": control(href=path(request, "get_book_reviews_resource", book=quote(book)), method="GET"),
+        "up": control(href=path(request, "get_book_resource", book=quote(book)), method="GET")
+    })
+    return MasonResponse(append_page_links(request, reviews, next_page, prev_page))
+
+
+@entry.get("/books/{book}/reviews/{user}/comments", response_model=Comments)
+async def get_review_comments_resource(
+        request: Request,
+        book: str,
+        user: str,
+        p: Page = Depends(page),
+        db: Session = Depends(database)
+):
+    comments, next_page, prev_page = await access.get_review_comments(user, book, db, p)
+    for item in comments.items:
+        append_author_control(item, item.user, request)
+    append_home_link(request, comments)
+    append_namespace(request, comments)
+    comments.controls.update({
+        "self": control(
+            href=path(request, "get_review_comments_resource", book=quote(book), user=quote(user)),
+            method="GET"
+        ),
+        "up": control(href=path(request, "get_book_reviews_resource", book=quote(book)), method="GET")
+    })
+    return MasonResponse(append_page_links(request, comments, next_page, prev_page))
 
 
 """
@@ -317,7 +843,7 @@ async def add_book_resource(
         db: Session = Depends(database)
 ):
     check_string(book.handle)
-    create_book(book, db)
+    await access.create_book(book, db)
     response.headers["Location"] = request.url_for("get_book_resource", book=quote(book.handle))
     response.status_code = 204
     return response
@@ -331,7 +857,7 @@ async def add_club_resource(
         db: Session = Depends(database)
 ):
     check_string(club.handle)
-    create_club(club, db)
+    await access.create_club(club, db)
     response.headers["Location"] = request.url_for("get_club_resource", club=quote(club.handle))
     response.status_code = 204
     return response
@@ -345,12 +871,156 @@ async def add_user_resource(
         db: Session = Depends(database)
 ):
     check_string(user.username)
-    create_user(user, db)
+    await access.create_user(user, db)
     response.headers["Location"] = request.url_for("get_user_resource", user=quote(user.username))
     response.status_code = 204
     return response
 
 
+"""
+Batch gets, the body is a JSON array of handles (usernames for users)
+"""
+
+
+@entry.post("/books:batchGet", response_model=Books, response_class=MasonResponse)
+async def get_books_batch(request: Request, handles: List[str] = Body(...), db: Session = Depends(database)):
+    return await batch_get(request, "book", access.get_books_by_handle, handles, db)
+
+
+@entry.post("/users:batchGet", response_model=Users, response_class=MasonResponse)
+async def get_users_batch(request: Request, handles: List[str] = Body(...), db: Session = Depends(database)):
+    return await batch_get(request, "user", access.get_users_by_handle, handles, db)
+
+
+@entry.post("/clubs:batchGet", response_model=Clubs, response_class=MasonResponse)
+async def get_clubs_batch(request: Request, handles: List[str] = Body(...), db: Session = Depends(database)):
+    return await batch_get(request, "club", access.get_clubs_by_handle, handles, db)
+
+
+"""
+Bulk imports, the body is a JSON array or NDJSON (one item per line)
+"""
+
+N = TypeVar('N', bound=BaseModel)
+
+
+def _invalid(index: int, message: str, item: BaseModel = None, key: str = None) -> BulkItem:
+    return BulkItem(
+        index=index,
+        handle=getattr(item, key) if item is not None else None,
+        status=BulkStatusEnum.invalid,
+        message=message
+    )
+
+
+async def bulk_items(request: Request, model: Type[N]) -> AsyncIterator[Tuple[int, Union[N, BulkItem]]]:
+    """
+    Parse and validate the items of a bulk request
+
+    NDJSON is parsed while the body is being received, so it never has to fit in memory at once.
+
+    :param request: Request
+    :param model:   Model to validate items with
+    :return:        Tuples of (index, model) or (index, invalid item status)
+    """
+
+    def parse(index: int, data: Union[bytes, dict]) -> Union[N, BulkItem]:
+        try:
+            return model.parse_raw(data) if isinstance(data, bytes) else model.parse_obj(data)
+        except ValidationError as e:
+            return _invalid(index, "; ".join(
+                f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+            ))
+
+    if NDJSON in request.headers.get("content-type", ""):
+        index = 0
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, parse(index, line)
+                    index += 1
+        if buffer.strip():
+            yield index, parse(index, buffer)
+    else:
+        try:
+            data = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(422, "Malformed JSON")
+        if not isinstance(data, list):
+            raise HTTPException(422, "Expected a JSON array or NDJSON")
+        for index, item in enumerate(data):
+            yield index, parse(index, item)
+
+
+async def bulk(
+        request: Request,
+        resource: str,
+        model: Type[N],
+        key: str,
+        create: Callable[[List[Tuple[int, N]], Session, Set[str]], Awaitable[List[BulkItem]]],
+        db: Session
+) -> MasonResponse:
+    """
+    Import items in batches and report the status of every item
+
+    Invalid items don't stop the import, everything valid is created in the same transaction.
+
+    :param request:     Request
+    :param resource:    SINGULAR NOUN of resource in question
+    :param model:       New model of the resource
+    :param key:         Identifier field of the model
+    :param create:      Async bulk data access function
+    :param db:          ORM Session
+    :return:            Bulk report
+    """
+    items: List[BulkItem] = list()
+    batch: List[Tuple[int, N]] = list()
+    seen: Set[str] = set()
+    async for index, item in bulk_items(request, model):
+        if isinstance(item, BulkItem):
+            items.append(item)
+            continue
+        try:
+            check_string(getattr(item, key))
+        except HTTPException as e:
+            items.append(_invalid(index, e.detail, item, key))
+            continue
+        batch.append((index, item))
+        if len(batch) == BULK_BATCH_SIZE:
+            items.extend(await create(batch, db, seen))
+            batch = list()
+    if len(batch) != 0:
+        items.extend(await create(batch, db, seen))
+    items.sort(key=lambda i: i.index)
+    created = sum(1 for i in items if i.status == BulkStatusEnum.created)
+    report = BulkReport(created=created, failed=len(items) - created, items=items)
+    append_home_link(request, report)
+    append_namespace(request, report)
+    report.controls.update({
+        "self": control(href=path(request, "add_" + resource + "s_bulk"), method="POST"),
+        "collection": control(href=path(request, "get_" + resource + "s_resource"), method="GET")
+    })
+    return MasonResponse(report)
+
+
+@entry.post("/books:bulk", response_model=BulkReport, response_class=MasonResponse)
+async def add_books_bulk(request: Request, db: Session = Depends(database)):
+    return await bulk(request, "book", NewBook, "handle", access.bulk_create_books, db)
+
+
+@entry.post("/users:bulk", response_model=BulkReport, response_class=MasonResponse)
+async def add_users_bulk(request: Request, db: Session = Depends(database)):
+    return await bulk(request, "user", NewUser, "username", access.bulk_create_users, db)
+
+
+@entry.post("/clubs:bulk", response_model=BulkReport, response_class=MasonResponse)
+async def add_clubs_bulk(request: Request, db: Session = Depends(database)):
+    return await bulk(request, "club", NewClub, "handle", access.bulk_create_clubs, db)
+
+
 """
 ###### ######   ## ########## 
 ##     ##   ##  ##     ##     
@@ -364,54 +1034,30 @@ entry.put = partial(entry.put, status_code=200, responses={304: {}, 201: {}, 409
 
 
 def _edit_(
-        get: Callable,
-        update: Callable,
-        create: Callable,
-        delete: Callable,
+        upsert: Callable[[str, E, Session], UpsertStatusEnum],
         response: Response,
         existing: str,
         new_model: E,
         db: Session,
-        location: bool = False,
-        check_identity: bool = True,
-        simple_update: bool = False,
-        url: str = None
-
+        check_identity: bool = True
 ):
+    """
+    Create or replace a resource
+
+    Responds with 201 if the resource was (re)created, 200 if it changed and 304 if it didn't.
+    """
+    identity = (new_model.handle if hasattr(new_model, 'handle') else new_model.username)
     # Don't change state
-    if check_identity:
-        identity = (new_model.handle if hasattr(new_model, 'handle') else new_model.username)
-        if existing != identity:
-            raise HTTPException(409, f"Entity identity doesn't match resource, expected: {existing} got: {identity}")
-    exists = False
-    deleted = False
-    if not simple_update:
-        try:
-            get(existing, db)
-            exists = True
-        except HTTPException as e:
-            # Ah fuck we have to do some mental gymnastics
-            if 'deleted' in e.detail:
-                exists = True
-                deleted = True
-            elif 'exists' in e.detail or 'taken' in e.detail:
-                exists = True
-    if (exists and not deleted) or simple_update:
-        changed = update(existing, new_model, db)
-        if changed is not None:
-            if location:
-                # request.url_for("get_user_resource", user=new_user.username)
-                response.headers["Location"] = url
-                response.status_code = 204
-            else:
-                response.status_code = 200
-        else:
-            response.status_code = 304
-    else:
-        check_string((new_model.handle if hasattr(new_model, 'handle') else new_model.username))
-        delete(existing, db)
-        create(new_model, db)
+    if check_identity and existing != identity:
+        raise HTTPException(409, f"Entity identity doesn't match resource, expected: {existing} got: {identity}")
+    check_string(identity)
+    status = upsert(existing, new_model, db)
+    if status in (UpsertStatusEnum.created, UpsertStatusEnum.recreated):
         response.status_code = 201
+    elif status == UpsertStatusEnum.updated:
+        response.status_code = 200
+    else:
+        response.status_code = 304
     return response
 
 
@@ -423,11 +1069,9 @@ async def edit_user_resource(
         response: Response,
         db: Session = Depends(database)
 ):
-    return _edit_(
-        get_user,
-        update_user,
-        create_user,
-        partial(delete_user, hard=True),
+    return await access.call(
+        _edit_,
+        upsert_user,
         response,
         user,
         new_user,
@@ -443,11 +1087,9 @@ async def edit_book_resource(
         response: Response,
         db: Session = Depends(database)
 ):
-    return _edit_(
-        get_book,
-        update_book,
-        create_book,
-        partial(delete_book, hard=True),
+    return await access.call(
+        _edit_,
+        upsert_book,
         response,
         book,
         new_book,
@@ -463,11 +1105,9 @@ async def edit_club_resource(
         response: Response,
         db: Session = Depends(database)
 ):
-    return _edit_(
-        get_club,
-        update_club,
-        create_club,
-        partial(delete_club, hard=True),
+    return await access.call(
+        _edit_,
+        upsert_club,
         response,
         club,
         new_club,
@@ -486,20 +1126,20 @@ async def edit_club_resource(
 
 @entry.delete("/users/{user}", status_code=204)
 async def delete_user_resource(user: str, response: Response, db: Session = Depends(database)):
-    delete_user(user, db)
+    await access.delete_user(user, db)
     response.status_code = 204
     return response
 
 
 @entry.delete("/books/{book}", status_code=204)
 async def delete_book_resource(book: str, response: Response, db: Session = Depends(database)):
-    delete_book(book, db)
+    await access.delete_book(book, db)
     response.status_code = 204
     return response
 
 
 @entry.delete("/clubs/{club}", status_code=204)
 async def delete_club_resource(club: str, response: Response, db: Session = Depends(database)):
-    delete_club(club, db)
+    await access.delete_club(club, db)
     response.status_code = 204
     return response
@@ -4,6 +4,7 @@ import logging
 from .exceptions import (
     HTTPException,
     AlreadyExists,
+    BadRequest,
     NotFound,
     Unauthorized,
     InternalError,
@@ -4,6 +4,12 @@ Shorthands for some common exceptions
 from fastapi import HTTPException
 
 
+class BadRequest(HTTPException):
+
+    def __init__(self, msg: str):
+        super(BadRequest, self).__init__(400, msg)
+
+
 class NotFound(HTTPException):
 
     def __init__(self, msg: str):
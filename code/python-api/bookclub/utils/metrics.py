@@ -0,0 +1,367 @@
+"""
+Prometheus metrics shared between worker processes
+
+Every process writes its samples to its own memory mapped file in book_club_metrics_dir, so workers never
+wait for each other and a scrape of any worker sees all of them. Counters and histograms are summed over
+all files, also those of exited workers, gauges only over the processes that are still running.
+Without the directory the samples stay in process memory.
+
+The directory has to be emptied before the workers start, like with prometheus_client.
+"""
+import json
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, List, Tuple, Iterator, Optional, Sequence, Any
+
+ENV_DIR = 'book_club_metrics_dir'
+
+_USED = struct.Struct('q')
+_LENGTH = struct.Struct('i')
+_VALUE = struct.Struct('d')
+
+"""
+Histogram bucket upper bounds in seconds
+"""
+BUCKETS: List[float] = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+def _entries(data, used: int) -> Iterator[Tuple[str, int]]:
+    """
+    Keys and value offsets of a store
+
+    An entry is the key length, the key padded to 8 bytes and a double.
+    """
+    position = _USED.size
+    while position < used:
+        length = _LENGTH.unpack_from(data, position)[0]
+        key = bytes(data[position + _LENGTH.size:position + _LENGTH.size + length]).decode('utf-8')
+        position += _LENGTH.size + length
+        position += (8 - position % 8) % 8
+        yield key, position
+        position += _VALUE.size
+
+
+class Values:
+    """
+    Append-only key to double mapping in a file or in memory, written by a single process
+
+    The lock only serializes the threads of the owning process.
+    """
+
+    def __init__(self, filename: Optional[str] = None, size: int = 1 << 16):
+        self.pid = os.getpid()
+        self.filename = filename
+        self._lock = Lock()
+        self._positions: Dict[str, int] = dict()
+        if filename is None:
+            self._file = None
+            self._data = bytearray(size)
+        else:
+            self._file = open(filename, 'a+b')
+            if os.fstat(self._file.fileno()).st_size < size:
+                self._file.truncate(size)
+            self._data = mmap.mmap(self._file.fileno(), 0)
+        self._used = max(_USED.unpack_from(self._data, 0)[0], _USED.size)
+        for key, position in _entries(self._data, self._used):
+            self._positions[key] = position
+
+    def _grow(self, needed: int):
+        size = len(self._data)
+        while size < needed:
+            size *= 2
+        if self._file is None:
+            self._data.extend(bytes(size - len(self._data)))
+        else:
+            self._data.close()
+            self._file.truncate(size)
+            self._data = mmap.mmap(self._file.fileno(), 0)
+
+    def _position(self, key: str) -> int:
+        position = self._positions.get(key)
+        if position is not None:
+            return position
+        encoded = key.encode('utf-8')
+        start = self._used + _LENGTH.size + len(encoded)
+        position = start + (8 - start % 8) % 8
+        if position + _VALUE.size > len(self._data):
+            self._grow(position + _VALUE.size)
+        _LENGTH.pack_into(self._data, self._used, len(encoded))
+        self._data[self._used + _LENGTH.size:self._used + _LENGTH.size + len(encoded)] = encoded
+        _VALUE.pack_into(self._data, position, 0.0)
+        self._used = position + _VALUE.size
+        _USED.pack_into(self._data, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def inc(self, key: str, amount: float = 1.0):
+        with self._lock:
+            position = self._position(key)
+            _VALUE.pack_into(self._data, position, _VALUE.unpack_from(self._data, position)[0] + amount)
+
+    def set(self, key: str, value: float):
+        with self._lock:
+            position = self._position(key)
+            _VALUE.pack_into(self._data, position, value)
+
+    def items(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            return [(k, _VALUE.unpack_from(self._data, p)[0]) for k, p in self._positions.items()]
+
+
+def read(filename: str) -> List[Tuple[str, float]]:
+    """
+    Read the samples of another process
+
+    :param filename:    Store file
+    :return:            Keys and values
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if len(data) < _USED.size:
+        return []
+    used = min(_USED.unpack_from(data, 0)[0], len(data))
+    return [(k, _VALUE.unpack_from(data, p)[0]) for k, p in _entries(data, used) if p + _VALUE.size <= used]
+
+
+_values: Optional[Values] = None
+_values_lock = Lock()
+
+
+def values() -> Values:
+    """
+    Store of the current process, a forked worker gets a new one
+    """
+    global _values
+    current = _values
+    if current is not None and current.pid == os.getpid():
+        return current
+    with _values_lock:
+        if _values is None or _values.pid != os.getpid():
+            directory = os.getenv(ENV_DIR)
+            _values = Values(os.path.join(directory, f"metrics_{os.getpid()}.db") if directory else None)
+        return _values
+
+
+def _key(name: str, labels: Dict[str, str]) -> str:
+    return json.dumps([name, labels], sort_keys=True, separators=(',', ':'))
+
+
+class Metric:
+    """
+    Base for metrics with a fixed set of label names, sample keys are built once per label values
+    """
+    kind: str = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._keys: Dict[Tuple, str] = dict()
+        registry[name] = self
+
+    def _sample(self, labels: Tuple[str, ...], suffix: str = '', le: str = None) -> str:
+        key = self._keys.get((labels, suffix, le))
+        if key is None:
+            if len(labels) != len(self.labels):
+                raise ValueError(f"{self.name} needs labels {self.labels}")
+            names = {k: str(v) for k, v in zip(self.labels, labels)}
+            if le is not None:
+                names['le'] = le
+            key = self._keys[(labels, suffix, le)] = _key(self.name + suffix, names)
+        return key
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        values().inc(self._sample(labels), amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels: str):
+        values().set(self._sample(labels), value)
+
+
+class Histogram(Metric):
+    """
+    Histogram with fixed buckets, bucket samples are stored per bucket and made cumulative on export
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: List[float] = None):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = list(buckets or BUCKETS)
+        self.bounds = [repr(float(b)) for b in self.buckets] + ['+Inf']
+
+    def observe(self, value: float, *labels: str):
+        store = values()
+        store.inc(self._sample(labels, '_bucket', self.bounds[bisect_left(self.buckets, value)]))
+        store.inc(self._sample(labels, '_sum'), value)
+        store.inc(self._sample(labels, '_count'))
+
+    def snapshot(self, *labels: str) -> Dict[str, Any]:
+        """
+        Samples of the current process
+
+        counts[i] is the number of values in (buckets[i - 1], buckets[i]], the last count is for values over all buckets
+
+        :param labels:  Label values
+        :return:        Dict of buckets, counts, count and sum
+        """
+        store = dict(values().items())
+        return {
+            'buckets': list(self.buckets),
+            'counts': [int(store.get(self._sample(labels, '_bucket', b), 0)) for b in self.bounds],
+            'count': int(store.get(self._sample(labels, '_count'), 0)),
+            'sum': store.get(self._sample(labels, '_sum'), 0.0)
+        }
+
+
+registry: Dict[str, Metric] = dict()
+
+
+def _alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def samples() -> Dict[str, float]:
+    """
+    Samples of all processes added up
+
+    :return: Sample keys and values
+    """
+    out: Dict[str, float] = dict()
+    directory = os.getenv(ENV_DIR)
+    if directory:
+        values()
+        stores = list()
+        for filename in os.listdir(directory):
+            pid = filename[len('metrics_'):-len('.db')]
+            if filename.startswith('metrics_') and filename.endswith('.db') and pid.isdigit():
+                try:
+                    stores.append((int(pid), read(os.path.join(directory, filename))))
+                except OSError:
+                    continue
+    else:
+        stores = [(os.getpid(), values().items())]
+    for pid, items in stores:
+        alive = None
+        for key, value in items:
+            metric = registry.get(json.loads(key)[0])
+            if metric is not None and metric.kind == 'gauge':
+                if alive is None:
+                    alive = _alive(pid)
+                if not alive:
+                    continue
+            out[key] = out.get(key, 0.0) + value
+    return out
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _line(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        name += '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + '}'
+    return f"{name} {value!r}"
+
+
+def exposition() -> str:
+    """
+    All metrics in the Prometheus text format
+
+    :return: Text
+    """
+    grouped: Dict[str, List[Tuple[str, Dict[str, str], float]]] = dict()
+    for key, value in samples().items():
+        name, labels = json.loads(key)
+        base = name
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in registry:
+                base = name[:-len(suffix)]
+        grouped.setdefault(base, list()).append((name, labels, value))
+    lines = list()
+    for metric in registry.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        found = grouped.get(metric.name, [])
+        if isinstance(metric, Histogram):
+            series: Dict[str, Dict[str, float]] = dict()
+            for name, labels, value in found:
+                le = labels.pop('le', None)
+                suffix = name[len(metric.name):]
+                series.setdefault(_key('', labels), dict())[le if suffix == '_bucket' else suffix] = value
+            for key, parts in sorted(series.items()):
+                labels = json.loads(key)[1]
+                total = 0.0
+                for bound in metric.bounds:
+                    total += parts.get(bound, 0.0)
+                    lines.append(_line(metric.name + '_bucket', dict(labels, le=bound), total))
+                lines.append(_line(metric.name + '_sum', labels, parts.get('_sum', 0.0)))
+                lines.append(_line(metric.name + '_count', labels, parts.get('_count', 0.0)))
+        else:
+            for name, labels, value in sorted(found, key=lambda s: sorted(s[1].items())):
+                lines.append(_line(name, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+"""
+Application metrics
+"""
+REQUEST_DURATION = Histogram(
+    'bookclub_request_duration_seconds',
+    'Request latency by route function',
+    ['route']
+)
+RESPONSES = Counter('bookclub_responses_total', 'Responses by route function and status code', ['route', 'status'])
+ERRORS = Counter('bookclub_errors_total', 'Mason error responses by exception handler', ['handler', 'status'])
+POOL_WAIT = Histogram('bookclub_pool_wait_seconds', 'Time spent getting a connection from the pool')
+POOL_CHECKOUT = Histogram('bookclub_pool_checkout_seconds', 'Connection checkout latency including pre-ping')
+POOL_FAILURES = Counter('bookclub_pool_failures_total', 'Pool checkout timeouts and connection errors')
+POOL_CHECKED_OUT = Gauge('bookclub_pool_checked_out', 'Connections checked out from the pool')
+POOL_OVERFLOW = Gauge('bookclub_pool_overflow', 'Connections open over the pool size')
+ROLLBACKS = Counter(
+    'bookclub_db_rollbacks_total',
+    'Transactions the database dependency rolled back because of an error',
+    ['reason']
+)
+CACHE_LOOKUPS = Counter('bookclub_entity_cache_lookups_total', 'Entity cache lookups', ['result'])
+CACHE_ENTRIES = Gauge('bookclub_entity_cache_entries', 'Entries in the entity cache')
+RESPONSE_CACHE_LOOKUPS = Counter('bookclub_response_cache_lookups_total', 'Response cache lookups', ['result'])
+
+__all__ = [
+    'Values',
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'registry',
+    'samples',
+    'exposition',
+    'REQUEST_DURATION',
+    'RESPONSES',
+    'ERRORS',
+    'POOL_WAIT',
+    'POOL_CHECKOUT',
+    'POOL_FAILURES',
+    'POOL_CHECKED_OUT',
+    'POOL_OVERFLOW',
+    'ROLLBACKS',
+    'CACHE_LOOKUPS',
+    'CACHE_ENTRIES',
+    'RESPONSE_CACHE_LOOKUPS',
+]
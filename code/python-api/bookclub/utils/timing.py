@@ -0,0 +1,98 @@
+"""
+Per request timings
+
+The instrumentation middleware starts a RequestTimings for every request and the engine events and
+Mason serialization add to the current one. Blocking work runs in the threadpool with a copy of
+the request context, so it updates the same object.
+
+Streaming responses are produced after the middleware returns, their queries are not counted.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Optional, Dict, Any, Tuple, Iterator
+
+
+class RequestTimings:
+    """
+    Statement count and time spent per phase, in seconds
+    """
+    __slots__ = ('path', 'started', 'queries', 'db', 'serialize')
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total: float) -> str:
+        """
+        Server-Timing header value, handler is the time not spent in the database or serializing
+
+        :param total:   Total time of the request
+        :return:        Header value
+        """
+        return (
+            f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries", '
+            f'serialize;dur={self.serialize * 1000:.2f}, '
+            f'handler;dur={max(0.0, total - self.db - self.serialize) * 1000:.2f}, '
+            f'total;dur={total * 1000:.2f}'
+        )
+
+    def as_dict(self, total: float) -> Dict[str, Any]:
+        return dict(
+            queries=self.queries,
+            db_ms=round(self.db * 1000, 3),
+            serialize_ms=round(self.serialize * 1000, 3),
+            handler_ms=round(max(0.0, total - self.db - self.serialize) * 1000, 3),
+            total_ms=round(total * 1000, 3)
+        )
+
+
+current: ContextVar[Optional[RequestTimings]] = ContextVar('bookclub_request_timings', default=None)
+
+
+def start(path: str = None) -> Tuple[RequestTimings, Token]:
+    """
+    Start timing a request in the current context
+
+    :param path:    Request path
+    :return:        Tuple(timings, token to reset the context with)
+    """
+    timings = RequestTimings(path)
+    return timings, current.set(timings)
+
+
+def query(elapsed: float):
+    """
+    Record an executed statement
+
+    :param elapsed: Execution time in seconds
+    """
+    timings = current.get()
+    if timings is not None:
+        timings.queries += 1
+        timings.db += elapsed
+
+
+@contextmanager
+def serializing() -> Iterator[None]:
+    """
+    Record the time spent in the block as serialization
+    """
+    timings = current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serialize += time.perf_counter() - started
+
+
+__all__ = ['RequestTimings', 'current', 'start', 'query', 'serializing']
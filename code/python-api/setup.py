@@ -16,6 +16,9 @@ setup(
         "uvicorn"
     ],
     extras_require={
-        "dev": ["pytest", "requests"]
+        "dev": ["pytest", "requests"],
+        "fast": ["orjson"],
+        "async": ["aiomysql"],
+        "bench": ["httpx"]
     }
 )
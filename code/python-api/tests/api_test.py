@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy.exc import IntegrityError
@@ -35,3 +37,123 @@ def test_db(db: Session):
         with db.begin_nested():
             db.add(u2)
             db.flush()
+
+
+def test_control_templates():
+    from bookclub.resources.paths import path, quote
+    from starlette.requests import Request
+    request = Request({
+        "type": "http",
+        "app": api,
+        "router": api.router,
+        "scheme": "http",
+        "server": ("test", 80),
+        "path": "/",
+        "headers": []
+    })
+    for func, kwargs in [
+        ("entrypoint", {}),
+        ("get_books_resource", {}),
+        ("get_book_resource", {"book": quote("a handle/with?odd&chars")}),
+        ("edit_user_resource", {"user": quote("user")}),
+    ]:
+        assert path(request, func, **kwargs) == request.url_for(func, **kwargs)
+
+
+def test_etag_after_recreate():
+    handle = "etag-" + str(id(client))
+    assert client.post("/books", json={"handle": handle, "full_name": "First"}).status_code == 204
+    first = client.get(f"/books/{handle}").headers["etag"]
+    assert client.delete(f"/books/{handle}").status_code == 204
+    assert client.put(f"/books/{handle}", json={"handle": handle, "full_name": "Second"}).status_code == 201
+    response = client.get(f"/books/{handle}", headers={"If-None-Match": first})
+    assert response.status_code == 200 and response.json()["full_name"] == "Second"
+    assert response.headers["etag"] != first
+
+
+def test_etag_after_update():
+    handle = "etag-update-" + str(id(client))
+    assert client.post("/books", json={"handle": handle, "full_name": "First"}).status_code == 204
+    first = client.get(f"/books/{handle}").headers["etag"]
+    collection = client.get("/books").headers["etag"]
+    assert client.put(f"/books/{handle}", json={"handle": handle, "full_name": "Second"}).status_code == 200
+    response = client.get(f"/books/{handle}", headers={"If-None-Match": first})
+    assert response.status_code == 200 and response.json()["full_name"] == "Second"
+    assert client.get("/books", headers={"If-None-Match": collection}).status_code == 200
+
+
+def test_stream_sort_limit():
+    response = client.get("/books", params={"stream": "true", "sort": "-pages", "limit": 2})
+    assert response.status_code == 200
+    lines = [json.loads(x) for x in response.text.splitlines()]
+    assert len(lines) <= 2
+    pages = [b.get("pages", -1) for b in lines]
+    assert pages == sorted(pages, reverse=True)
+    assert client.get("/books", params={"stream": "true", "sort": "full_name"}).status_code == 400
+    assert client.get("/books", params={"stream": "true", "before": "a"}).status_code == 400
+
+
+def test_lazy_startup():
+    import subprocess
+    import sys
+    code = """
+import sys
+import bookclub.app
+assert 'bookclub.resources.paths' not in sys.modules and 'bookclub.data.support' not in sys.modules
+from fastapi.testclient import TestClient
+from bookclub.data import support
+app = bookclub.app.create_app(bookclub.app.Settings(db_url='sqlite://'))
+assert 'engine' not in vars(support)
+with TestClient(app):
+    assert 'engine' in vars(support)
+"""
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_response_cache():
+    from sqlalchemy import event
+    from bookclub.data import support
+    from bookclub.data.responses import responses, MemoryBackend
+    statements = list()
+
+    def record(_conn, _cursor, statement, *_):
+        statements.append(statement)
+
+    engine = support.sync_engine()
+    responses.backend = MemoryBackend(16)
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        first = client.get("/books", params={"limit": 1})
+        assert first.status_code == 200
+        del statements[:]
+        second = client.get("/books", params={"limit": 1})
+        assert statements == []
+        assert second.content == first.content and second.headers.get("etag") == first.headers.get("etag")
+        tag = first.headers.get("etag")
+        if tag is not None:
+            assert client.get("/books", params={"limit": 1}, headers={"If-None-Match": tag}).status_code == 304
+        handle = "cache-" + str(id(statements))
+        assert client.post("/books", json={"handle": handle, "full_name": "Cached"}).status_code == 204
+        del statements[:]
+        client.get("/books", params={"limit": 1})
+        assert statements != []
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+        responses.backend = None
+
+
+def test_response_cache_handle_case():
+    from bookclub.data.responses import responses, MemoryBackend
+    handle = "Case-" + str(id(client))
+    responses.backend = MemoryBackend(16)
+    try:
+        assert client.post("/books", json={"handle": handle, "full_name": "Cased"}).status_code == 204
+        assert client.get(f"/books/{handle.lower()}").status_code == 200
+        first = client.get(f"/books/{handle.upper()}")
+        assert first.json()["full_name"] == "Cased"
+        assert client.put(f"/books/{handle}", json={"handle": handle, "full_name": "Recased"}).status_code == 200
+        assert client.get(f"/books/{handle.lower()}").json()["full_name"] == "Recased"
+        assert client.delete(f"/books/{handle.upper()}").status_code == 204
+        assert client.get(f"/books/{handle.lower()}").status_code == 404
+    finally:
+        responses.backend = None
@@ -0,0 +1,58 @@
+import time
+
+from bookclub.data.cache import EntityCache, Ref
+
+
+def test_lru():
+    cache = EntityCache(size=2, ttl=60)
+    cache.put(('Book', 'a'), Ref(1, False, 'a'))
+    cache.put(('Book', 'b'), Ref(2, False, 'b'))
+    assert cache.get(('Book', 'a')).id == 1
+    cache.put(('Book', 'c'), Ref(3, False, 'c'))
+    assert cache.get(('Book', 'b')) is None
+    assert cache.get(('Book', 'a')) is not None
+    assert cache.stats() == {'size': 2, 'hits': 2, 'misses': 1}
+
+
+def test_ttl_and_invalidate():
+    cache = EntityCache(size=10, ttl=0.01)
+    cache.put(('User', 'a'), Ref(1, False, 'a'))
+    cache.put(('User', 'b'), Ref(2, False, 'b'))
+    cache.invalidate(('User', 'b'))
+    assert cache.get(('User', 'b')) is None
+    time.sleep(0.02)
+    assert cache.get(('User', 'a')) is None
+    assert cache.stats()['size'] == 0
+
+
+def test_stale_put():
+    cache = EntityCache(size=2, ttl=60)
+    since = cache.generation
+    cache.invalidate(('User', 'a'))
+    cache.put(('User', 'a'), Ref(1, False, 'a'), since)
+    assert cache.get(('User', 'a')) is None
+    cache.put(('User', 'b'), Ref(2, False, 'b'), since)
+    assert cache.get(('User', 'b')) is not None
+    cache.invalidate(('User', 'c'), ('User', 'd'))
+    cache.put(('User', 'a'), Ref(1, False, 'a'), since)
+    assert cache.get(('User', 'a')) is None
+    cache.put(('User', 'a'), Ref(1, False, 'a'), cache.generation)
+    assert cache.get(('User', 'a')) is not None
+
+
+def test_transaction_end():
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import Session
+    from bookclub.data.cache import entities
+    entities.put(('User', 'kept'), Ref(1, False, 'kept'))
+    db = Session(create_engine("sqlite://"))
+    db.execute(text("SELECT 1"))
+    entities.invalidate_on_commit(db, ('User', 'written'))
+    entities.put_read(db, ('User', 'written'), Ref(2, False, 'written'))
+    assert entities.get(('User', 'written')) is None
+    assert entities.get_read(db, ('User', 'written')).id == 2
+    entities.put(('User', 'written'), Ref(2, False, 'written'))
+    db.rollback()
+    assert entities.get(('User', 'written')) is None
+    assert entities.get(('User', 'kept')) is not None
+    assert db.info == {}
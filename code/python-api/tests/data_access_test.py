@@ -1,7 +1,10 @@
 import random as rnd
 import string
+from contextlib import contextmanager
+from typing import List
 
 import pytest
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 
 # noinspection PyUnresolvedReferences
@@ -19,6 +22,24 @@ from bookclub.utils import *
 #   - Comment: create, get, update, delete
 #   - UBL:
 
+@contextmanager
+def count_queries(db: Session) -> List[str]:
+    """
+    Record all statements executed on the session engine
+    """
+    statements = list()
+
+    def record(_conn, _cursor, statement, *_):
+        statements.append(statement)
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
 @pytest.fixture()
 def handle() -> str:
     return ''.join([rnd.choice(string.ascii_letters + string.digits) for _ in range(0, rnd.randint(1, 60))])
@@ -120,6 +141,7 @@ def test_ubl_create(ubl: da.NewUserBook, db: Session):
             da.store_user_book(da.NewUserBook(**ubl.dict()), db)
     da.store_user_book(da.NewUserBook(**ubl.dict()), db, overwrite=True)
     assert ubl is not None
+    assert not db.new and not db.dirty
 
 
 #
@@ -143,6 +165,16 @@ def test_book_get(ubl: da.NewUserBook, db: Session):
         da.get_book(ubl.handle, db, stats=False, user=ubl.user)
 
 
+def test_book_stats_rebuild(ubl: da.NewUserBook, db: Session):
+    before = da.get_book(ubl.handle, db, stats=True)
+    da.rebuild_book_stats(db)
+    assert da.get_book(ubl.handle, db, stats=True) == before
+    from bookclub.data.model.db_models import t_book_stats
+    db.execute(t_book_stats.update().values(pending=0))
+    da.rebuild_book_stats(db)
+    assert da.get_book(ubl.handle, db, stats=True) == before
+
+
 #
 # DELETE
 #
@@ -174,3 +206,325 @@ def test_delete_club(club: str, db: Session):
     da.delete_club(c, db)
     with pytest.raises(NotFound):
         da.delete_club(club, db)
+
+
+#
+# COLLECTIONS
+#
+
+def test_books_pagination(db: Session):
+    prefix = ''.join([rnd.choice(string.ascii_letters) for _ in range(0, 20)])
+    created = [
+        da.create_book(da.NewBook(handle=f"{prefix}{i}", full_name="A paged book"), db)
+        for i in range(0, 5)
+    ]
+    seen = list()
+    page = da.Page(limit=2, after=prefix)
+    while page is not None:
+        books, page, prev_page = da.get_books(db, page)
+        assert len(books.items) <= 2
+        assert prev_page is not None
+        seen.extend(b.handle for b in books.items)
+    assert seen == sorted(seen, key=str.casefold)
+    assert len(seen) == len(set(seen))
+    assert all(c in seen for c in created)
+    books, next_page, prev_page = da.get_books(db, da.Page(limit=2, before=created[2]))
+    assert [b.handle for b in books.items] == created[:2]
+    assert next_page.after == created[1]
+
+
+def test_books_stream(book: str, db: Session):
+    streamed = [b.handle for b in da.stream_books(db)]
+    assert book in streamed
+    assert streamed == sorted(streamed, key=str.casefold)
+    assert book not in [b.handle for b in da.stream_books(db, after=book)]
+
+
+def test_clubs_owner_queries(db: Session):
+    prefix = ''.join([rnd.choice(string.ascii_letters) for _ in range(0, 20)])
+    for i in range(0, 5):
+        da.create_user(da.NewUser(username=f"{prefix}{i}"), db)
+        da.create_club(da.NewClub(handle=f"{prefix}{i}", owner=f"{prefix}{i}"), db)
+    db.flush()
+    db.expire_all()
+    with count_queries(db) as statements:
+        clubs, _, _ = da.get_clubs(db, da.Page(limit=5, after=prefix))
+    assert [c.owner for c in clubs.items] == [f"{prefix}{i}" for i in range(0, 5)]
+    assert len(statements) == 1
+    db.expire_all()
+    with count_queries(db) as statements:
+        assert da.get_club(f"{prefix}0", db).owner == f"{prefix}0"
+    assert len(statements) == 1
+
+
+def test_entity_cache(book: str, db: Session):
+    from bookclub.data.cache import entities
+    from bookclub.data.data_access import _ref
+    from bookclub.data.model.db_models import Book
+    ref = _ref(Book, book, db)
+    assert entities.get(('Book', book)) is None
+    hits = entities.hits
+    assert _ref(Book, book, db) == ref
+    assert entities.hits == hits + 1
+    da.delete_book(book, db)
+    with pytest.raises(NotFound):
+        _ref(Book, book, db)
+
+
+def test_entity_cache_case(book: str, db: Session):
+    from bookclub.data.data_access import _ref
+    from bookclub.data.model.db_models import Book
+    ref = _ref(Book, book.upper(), db)
+    assert _ref(Book, book.lower(), db) == ref
+    da.delete_book(book.lower(), db)
+    with pytest.raises(NotFound):
+        _ref(Book, book.upper(), db)
+
+
+def test_ubl_stale_ref(book: str, user: str, db: Session):
+    from bookclub.data.cache import entities, Ref
+    from bookclub.data.data_access import _key
+    from bookclub.data.model.db_models import Book
+    entities.put(_key(Book, book), Ref(-1, False, book))
+    stored = da.store_user_book(da.NewUserBook(user=user, handle=book, reading_status='reading'), db)
+    assert stored.handle == book
+    gone = book[:32] + "-gone"
+    entities.put(_key(Book, gone), Ref(-1, False, gone))
+    with pytest.raises(NotFound):
+        da.store_user_book(da.NewUserBook(user=user, handle=gone, reading_status='reading'), db)
+
+
+def test_async_access(book: str, db: Session):
+    import asyncio
+    from bookclub.data import async_access
+
+    async def run():
+        streamed = [b.handle async for b in async_access.stream_books(db)]
+        return await async_access.get_book(book, db), streamed
+
+    async_book, streamed = asyncio.run(run())
+    assert async_book == da.get_book(book, db)
+    assert book in streamed
+
+
+def test_bulk_create(book: str, user: str, db: Session):
+    prefix = ''.join([rnd.choice(string.ascii_letters) for _ in range(0, 20)])
+    books = [(i, da.NewBook(handle=f"{prefix}{i}", full_name="Bulk")) for i in range(0, 10)]
+    books.append((10, da.NewBook(handle=book, full_name="Exists")))
+    books.append((11, da.NewBook(handle=f"{prefix}0", full_name="Duplicate")))
+    with count_queries(db) as statements:
+        items = da.bulk_create_books(books, db)
+    assert [i.status for i in items] == ['created'] * 10 + ['exists', 'duplicate']
+    assert len([s for s in statements if 'SAVEPOINT' not in s.upper()]) == 2
+    assert da.get_book(f"{prefix}9", db).full_name == "Bulk"
+    clubs = [(0, da.NewClub(handle=prefix, owner=user)), (1, da.NewClub(handle=prefix + "x", owner=prefix))]
+    items = da.bulk_create_clubs(clubs, db)
+    assert [i.status for i in items] == ['created', 'not_found']
+    assert da.get_club(prefix, db).owner == user
+
+
+def test_versions(book: str, db: Session):
+    version = da.get_book_version(book, db)
+    collection = da.get_collection_version('books', db)
+    da.update_book(book, da.NewBook(handle=book, full_name="Changed"), db)
+    db.flush()
+    assert da.get_book_version(book, db) != version
+    assert da.get_collection_version('books', db) != collection
+    da.delete_book(book, db)
+    db.flush()
+    assert da.get_book_version(book, db) is None
+
+
+def test_upsert(book: str, db: Session):
+    new = da.NewBook(handle=book, full_name="Upserted")
+    with count_queries(db) as statements:
+        assert da.upsert_book(book, new, db) == da.UpsertStatusEnum.updated
+    assert len(statements) == 2
+    assert da.upsert_book(book, new, db) == da.UpsertStatusEnum.unchanged
+    da.delete_book(book, db)
+    assert da.upsert_book(book, new, db) == da.UpsertStatusEnum.recreated
+    assert da.get_book(book, db).full_name == "Upserted"
+    handle = book + "x" if len(book) < 60 else book[:-1]
+    assert da.upsert_book(handle, da.NewBook(handle=handle, full_name="New"), db) == da.UpsertStatusEnum.created
+
+
+def test_upsert_club_owner(club: str, user: str, db: Session):
+    owned = da.NewClub(handle=club, description=club * 2, owner=user)
+    assert da.upsert_club(club, owned, db) == da.UpsertStatusEnum.unchanged
+    assert da.upsert_club(club, da.NewClub(handle=club, description=club * 2), db) == da.UpsertStatusEnum.updated
+    assert da.get_club(club, db).owner is None
+    assert da.upsert_club(club, owned, db) == da.UpsertStatusEnum.updated
+    assert da.get_club(club, db).owner == user
+
+
+def test_books_filter_sort(db: Session):
+    prefix = ''.join([rnd.choice(string.ascii_letters) for _ in range(0, 20)])
+    for i in range(0, 6):
+        da.create_book(da.NewBook(handle=f"{prefix}{i}", full_name="Sorted", pages=1000000 + i % 3), db)
+    filters = dict(min_pages=1000000, max_pages=1000002)
+    seen = list()
+    page = da.Page(limit=4)
+    while page is not None:
+        books, page, _ = da.get_books(db, page, filters=filters, sort='-pages')
+        seen.extend((b.pages, b.handle) for b in books.items)
+    assert [p for p, _ in seen] == [1000002, 1000002, 1000001, 1000001, 1000000, 1000000]
+    assert sorted(h for _, h in seen) == [f"{prefix}{i}" for i in range(0, 6)]
+    with pytest.raises(BadRequest):
+        da.get_books(db, sort='full_name')
+
+
+def test_books_stream_sort(db: Session):
+    prefix = ''.join([rnd.choice(string.ascii_letters) for _ in range(0, 20)])
+    for i in range(0, 6):
+        da.create_book(da.NewBook(handle=f"{prefix}{i}", full_name="Sorted", pages=1000000 + i % 3), db)
+    filters = dict(min_pages=1000000, max_pages=1000002)
+    paged, _, _ = da.get_books(db, da.Page(limit=6), filters=filters, sort='-pages')
+    streamed = [b.handle for b in da.stream_books(db, filters=filters, sort='-pages')]
+    assert streamed == [b.handle for b in paged.items]
+    assert [b.handle for b in da.stream_books(db, streamed[1], filters=filters, sort='-pages', limit=3)] == streamed[2:5]
+    with pytest.raises(BadRequest):
+        list(da.stream_books(db, sort='full_name'))
+
+
+def test_search_after_write(db: Session):
+    word = ''.join([rnd.choice(string.ascii_lowercase) for _ in range(0, 20)])
+    assert da.search(word, db)[0].items == []
+    handle = da.create_book(da.NewBook(handle=word, full_name=f"{word} tales"), db)
+    assert [h.handle for h in da.search(word, db)[0].items] == [handle]
+
+
+def test_user_books(ubl: da.UserBook, db: Session):
+    da.get_user_books(ubl.user, db)
+    with count_queries(db) as statements:
+        books, next_page, _ = da.get_user_books(ubl.user, db, da.Page(limit=1), stats=True)
+    assert len(statements) == 1
+    assert next_page is None
+    assert books.items[0].handle == ubl.handle
+    assert books.items[0].reading_status == da.StatusEnum.pending
+    assert da.get_user_books(ubl.user, db, status=da.StatusEnum.reading)[0].items == []
+
+
+def test_review_feeds(book: str, db: Session):
+    from bookclub.data.model.db_models import Comment, t_review_comment_link
+    from bookclub.data.data_access import _find_review
+    prefix = ''.join([rnd.choice(string.ascii_letters) for _ in range(0, 20)])
+    for i in range(0, 3):
+        da.create_user(da.NewUser(username=f"{prefix}{i}"), db)
+        da.create_review(da.NewReview(user=f"{prefix}{i}", book=book, stars=3, title="Feed"), db)
+    review = _find_review(f"{prefix}0", book, db)
+    for i in range(0, 3):
+        uuid = da.create_comment(da.NewComment(user=f"{prefix}{i}", content=f"Comment {i}"), db)
+        comment = db.query(Comment).filter_by(uuid=uuid).one()
+        db.execute(t_review_comment_link.insert().values(review_id=review.id, comment_id=comment.id))
+    db.flush()
+    db.expire_all()
+    with count_queries(db) as statements:
+        assert da.get_review(f"{prefix}0", book, db).user == f"{prefix}0"
+    assert len(statements) == 1
+    seen = list()
+    page = da.Page(limit=2)
+    while page is not None:
+        reviews, page, _ = da.get_book_reviews(book, db, page)
+        seen.extend(r.user for r in reviews.items)
+    assert sorted(seen) == [f"{prefix}{i}" for i in range(0, 3)]
+    with count_queries(db) as statements:
+        comments, next_page, _ = da.get_review_comments(f"{prefix}0", book, db, da.Page(limit=2))
+    assert len(statements) == 2
+    assert [c.content for c in comments.items] == ["Comment 0", "Comment 1"]
+    comments, next_page, _ = da.get_review_comments(f"{prefix}0", book, db, next_page)
+    assert [c.user for c in comments.items] == [f"{prefix}2"]
+    assert next_page is None
+    with pytest.raises(NotFound):
+        da.get_review(f"{prefix}1", book + "x" if len(book) < 60 else book[:-1], db)
+
+
+def test_projection_reads(club: str, user: str, book: str, db: Session):
+    da.create_review(da.NewReview(user=user, book=book, stars=4, title="Projected"), db)
+    uuid = da.create_comment(da.NewComment(user=user, content="Projected"), db)
+    db.flush()
+    db.expunge_all()
+    assert da.get_user(user, db).username == user
+    assert da.get_book(book, db).handle == book
+    assert da.get_club(club, db).owner == user
+    assert da.get_review(user, book, db).stars == 4
+    assert da.get_comment(uuid, db).user == user
+    assert da.get_users(db, da.Page(limit=1, after=user[:-1]))[0].items
+    assert da.get_books(db, da.Page(limit=1, after=book[:-1]))[0].items
+    assert len(db.identity_map) == 0
+    da.delete_user(user, db)
+    db.flush()
+    assert da.get_club(club, db).owner == "deleted"
+    assert da.get_club(club, db, bypass_delete=True).owner == user
+
+
+def test_constraint_errors(book: str, user: str, db: Session):
+    from sqlalchemy.exc import IntegrityError
+    from bookclub.data.data_access import _violation
+    with count_queries(db) as statements:
+        with pytest.raises(AlreadyExists):
+            with db.begin_nested():
+                da.create_book(da.NewBook(handle=book, full_name="Duplicate"), db)
+    assert not [s for s in statements if 'count(' in s.lower()]
+    other = da.create_book(da.NewBook(handle=book[:-1] + ('x' if book[-1] != 'x' else 'y'), full_name="Other"), db)
+    with pytest.raises(AlreadyExists):
+        with db.begin_nested():
+            da.update_book(other, da.NewBook(handle=book, full_name="Rename"), db)
+    with pytest.raises(AlreadyExists):
+        with db.begin_nested():
+            da.create_user(da.NewUser(username=user), db)
+    assert da.get_book(other, db).full_name == "Other"
+
+    def error(*args) -> IntegrityError:
+        import pymysql
+        return IntegrityError("INSERT", {}, pymysql.err.IntegrityError(*args))
+
+    assert _violation(error(1062, "Duplicate entry 'x' for key 'handle'"), 'mysql') == 'unique'
+    assert _violation(error(1452, "Cannot add or update a child row"), 'mysql') == 'foreign_key'
+    assert _violation(error(1048, "Column 'handle' cannot be null"), 'mysql') is None
+
+    from bookclub.data.data_access import _constraints, _violates
+    from bookclub.data.model.db_models import Book, UserBook
+    assert _violates(error(1062, "Duplicate entry 'x' for key 'idx_books_handle'"), 'handle')
+    assert not _violates(error(1062, "Duplicate entry '1-2' for key 'reviews_user_id'"), 'username')
+
+    def sqlite_error(message: str) -> IntegrityError:
+        import sqlite3
+        return IntegrityError("INSERT", {}, sqlite3.IntegrityError(message))
+
+    with pytest.raises(AlreadyExists, match="already exists"):
+        with _constraints(Book, book, db):
+            raise sqlite_error("UNIQUE constraint failed: books.handle")
+    with pytest.raises(AlreadyExists, match="Conflicting UserBook"):
+        with _constraints(UserBook, book, db):
+            raise sqlite_error("UNIQUE constraint failed: user_books.user_id, user_books.book_id")
+
+
+def test_writes_without_savepoints(book: str, user: str, db: Session):
+    with count_queries(db) as statements:
+        da.update_book(book, da.NewBook(handle=book, full_name="No savepoint"), db)
+        da.update_user(user, da.NewUser(username=user, description="No savepoint"), db)
+        da.store_user_book(da.NewUserBook(user=user, handle=book, reading_status='reading'), db)
+        uuid = da.create_comment(da.NewComment(user=user, content="No savepoint"), db)
+        da.delete_comment(da.Comment(uuid=uuid, user=user, content="No savepoint"), db)
+        db.flush()
+    assert statements
+    assert not [s for s in statements if s.upper().startswith(('SAVEPOINT', 'RELEASE'))]
+
+
+def test_batch_get(book: str, club: str, user: str, db: Session):
+    gone = da.create_book(da.NewBook(handle=book[:-1] + ('x' if book[-1] != 'x' else 'y'), full_name="Gone"), db)
+    da.delete_book(gone, db)
+    db.flush()
+    with count_queries(db) as statements:
+        books = da.get_books_by_handle([gone, book, "no such book", book], db)
+    assert len(statements) == 1
+    assert [b.handle for b in books.items] == [book]
+    assert [(m.handle, m.status) for m in books.missing] == [
+        (gone, da.MissingStatusEnum.deleted),
+        ("no such book", da.MissingStatusEnum.not_found)
+    ]
+    assert [u.username for u in da.get_users_by_handle([user], db).items] == [user]
+    assert da.get_clubs_by_handle([club], db).items[0].owner == user
+    assert da.get_clubs_by_handle([], db).items == []
+    with pytest.raises(BadRequest):
+        da.get_books_by_handle([str(i) for i in range(0, da.MAX_BATCH_SIZE + 1)], db)
@@ -42,3 +42,18 @@ def test_mason():
     assert name.controls['self'].href == 'https://self.self'
     assert 'up' in name.controls
     assert 'ns' in name.namespaces
+
+
+def test_mason_response():
+    """
+    Fast path must produce the same document as the response_model path
+    """
+    from fastapi.encoders import jsonable_encoder
+    d = json.loads(sample)
+    name: Name = Name.parse_obj(d)
+    name.controls['up'].encoding = EncodingEnum.none
+    name.controls['time'] = Control.construct(href='https://time', description=None)
+    expected = jsonable_encoder(name, by_alias=True, exclude_none=True, exclude_defaults=True)
+    assert json.loads(MasonResponse(name).body) == expected
+    assert 'encoding' not in expected['@controls']['up']
+    assert 'description' not in expected['@controls']['time']
@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+
+from fastapi.testclient import TestClient
+
+from bookclub import api
+from bookclub.utils import metrics
+
+
+def test_values_file(tmp_path):
+    filename = str(tmp_path / "metrics_1.db")
+    values = metrics.Values(filename, size=64)
+    for i in range(0, 100):
+        values.inc(f"key-{i % 10}", i)
+    values.set("gauge", 2.5)
+    assert sorted(metrics.read(filename)) == sorted(values.items())
+    assert dict(values.items())["key-9"] == sum(range(9, 100, 10))
+    assert dict(metrics.Values(filename).items())["gauge"] == 2.5
+
+
+def _child(counter: metrics.Counter, gauge: metrics.Gauge):
+    counter.inc("child")
+    gauge.set(5)
+
+
+def test_processes(tmp_path, monkeypatch):
+    monkeypatch.setenv(metrics.ENV_DIR, str(tmp_path))
+    monkeypatch.setattr(metrics, "_values", None)
+    counter = metrics.Counter("test_processes_total", "Test", ["who"])
+    gauge = metrics.Gauge("test_processes_gauge", "Test")
+    try:
+        counter.inc("child")
+        counter.inc("parent")
+        process = multiprocessing.get_context("fork").Process(target=_child, args=(counter, gauge))
+        process.start()
+        process.join()
+        text = metrics.exposition()
+        assert 'test_processes_total{who="child"} 2.0' in text
+        assert 'test_processes_total{who="parent"} 1.0' in text
+        assert 'test_processes_gauge 5' not in text
+        assert len(os.listdir(tmp_path)) == 2
+    finally:
+        del metrics.registry[counter.name]
+        del metrics.registry[gauge.name]
+
+
+def test_histogram_snapshot():
+    histogram = metrics.Histogram("test_snapshot_seconds", "Test", buckets=[0.1, 1])
+    try:
+        for v in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(v)
+        snapshot = histogram.snapshot()
+        assert snapshot['counts'] == [2, 1, 1]
+        assert snapshot['count'] == 4
+    finally:
+        del metrics.registry[histogram.name]
+
+
+def test_histogram_exposition():
+    histogram = metrics.Histogram("test_histogram_seconds", "Test", buckets=[0.1, 1])
+    try:
+        for v in [0.05, 0.5, 5]:
+            histogram.observe(v)
+        text = metrics.exposition()
+        assert 'test_histogram_seconds_bucket{le="0.1"} 1.0' in text
+        assert 'test_histogram_seconds_bucket{le="1.0"} 2.0' in text
+        assert 'test_histogram_seconds_bucket{le="+Inf"} 3.0' in text
+        assert 'test_histogram_seconds_count 3.0' in text
+    finally:
+        del metrics.registry[histogram.name]
+
+
+def test_metrics_endpoint():
+    client = TestClient(api)
+    client.get("/")
+    client.get("/nope")
+    text = client.get("/metrics").text
+    assert 'bookclub_responses_total{route="entrypoint",status="200"}' in text
+    assert 'bookclub_errors_total{handler="starlette",status="404"}' in text
+    assert '# TYPE bookclub_request_duration_seconds histogram' in text
+
+
+def test_rollbacks_count_errors(monkeypatch):
+    import pytest
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from bookclub.data import support
+    monkeypatch.setattr(support, 'ready', lambda: sessionmaker(bind=create_engine('sqlite://')))
+    key = metrics.ROLLBACKS._sample(('error',))
+    before = dict(metrics.values().items()).get(key, 0.0)
+    for _ in support._test_database():
+        pass
+    assert dict(metrics.values().items()).get(key, 0.0) == before
+    failing = support._test_database()
+    next(failing)
+    with pytest.raises(ValueError):
+        failing.throw(ValueError())
+    assert dict(metrics.values().items()).get(key, 0.0) == before + 1
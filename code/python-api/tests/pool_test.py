@@ -0,0 +1,22 @@
+from sqlalchemy import create_engine
+
+from bookclub.data.pool import InstrumentedQueuePool, metrics
+from bookclub.data.support import EngineSettings
+
+
+def test_engine_settings(monkeypatch):
+    monkeypatch.setenv('book_club_db_pool_size', '7')
+    monkeypatch.setenv('book_club_db_session_variables', '{"wait_timeout": "600"}')
+    settings = EngineSettings(max_overflow=3)
+    assert settings.pool_size == 7
+    assert settings.max_overflow == 3
+    assert settings.session_variables == {'wait_timeout': '600'}
+    assert settings.engine_options()['query_cache_size'] == 500
+
+
+def test_pool_metrics():
+    engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0)
+    count = metrics.checkout.snapshot()['count']
+    with engine.connect():
+        assert metrics.stats(engine.pool)['checked_out'] == 1
+    assert metrics.checkout.snapshot()['count'] == count + 1
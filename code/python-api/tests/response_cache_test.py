@@ -0,0 +1,71 @@
+import time
+
+import pytest
+from sqlalchemy.orm import Session
+
+from bookclub.data.responses import ResponseCache, MemoryBackend, FileBackend, tag
+
+
+def test_memory_lru_and_tags():
+    cache = ResponseCache(MemoryBackend(size=2), ttl=60)
+    for key in ('a', 'b'):
+        cache.put(key, cache.ticket((tag('Book', key), tag('Book'))), key.encode(), f'"{key}"')
+    assert cache.get('a').body == b'a'
+    cache.put('c', cache.ticket((tag('Book', 'c'),)), b'c', None)
+    assert cache.get('b') is None
+    cache.invalidate(tag('Book', 'a'))
+    assert cache.get('a') is None
+    assert cache.get('c').etag is None
+
+
+def test_invalidated_while_building():
+    cache = ResponseCache(MemoryBackend(), ttl=60)
+    ticket = cache.ticket((tag('Club', 'x'),))
+    cache.invalidate(tag('Club', 'x'))
+    cache.put('x', ticket, b'old', None)
+    assert cache.get('x') is None
+
+
+def test_ttl():
+    cache = ResponseCache(MemoryBackend(), ttl=0.01)
+    cache.put('a', cache.ticket(()), b'a', None)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+
+def test_file_backend_shared(tmp_path):
+    one = ResponseCache(FileBackend(str(tmp_path), size=4), ttl=60)
+    two = ResponseCache(FileBackend(str(tmp_path), size=4), ttl=60)
+    one.put('a', one.ticket((tag('User', 'a'),)), b'{"a": 1}\n', '"a"')
+    assert two.get('a') == one.get('a')
+    assert two.get('a').body == b'{"a": 1}\n'
+    two.invalidate(tag('User', 'a'))
+    assert one.get('a') is None
+    for i in range(0, 20):
+        one.put(str(i), one.ticket(()), b'x', None)
+    assert len(list(tmp_path.glob('*.entry'))) <= 4 + 4 // 8 + 1
+
+
+def test_file_backend_without_fcntl(tmp_path, monkeypatch):
+    from bookclub.data import responses
+    monkeypatch.setattr(responses, 'fcntl', None)
+    assert isinstance(responses.backend('memory', 8), MemoryBackend)
+    with pytest.raises(ValueError):
+        responses.backend(f"file:{tmp_path}", 8)
+
+
+def test_invalidate_on_commit():
+    from bookclub.data.responses import responses
+    backend = responses.backend
+    responses.backend = MemoryBackend()
+    try:
+        db = Session()
+        db.begin()
+        responses.invalidate_on_commit(db, tag('Book', 'a'))
+        ticket = responses.ticket((tag('Book', 'a'),))
+        responses.put('a', ticket, b'a', None)
+        assert responses.get('a') is not None
+        db.commit()
+        assert responses.get('a') is None
+    finally:
+        responses.backend = backend
@@ -0,0 +1,52 @@
+from bookclub.data.search import InvertedIndex, SearchIndexes, tokenize
+
+
+def test_tokenize():
+    assert tokenize("The Hobbit, or There and Back Again") == ['the', 'hobbit', 'or', 'there', 'and', 'back', 'again']
+    assert tokenize(None) == []
+
+
+def test_ranking():
+    index = InvertedIndex()
+    index.add('dune', "Dune desert planet spice")
+    index.add('hobbit', "The Hobbit dragon")
+    index.add('sands', "Desert desert sands")
+    results = index.search("desert")
+    assert [k for k, _ in results] == ['sands', 'dune']
+    assert index.search("nothing") == []
+
+
+def test_rebuild_on_version():
+    indexes = SearchIndexes()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [('a', 'some text')]
+
+    indexes.get('books', '1', load)
+    indexes.get('books', '1', load)
+    assert len(loads) == 1
+    assert indexes.get('books', '2', load).search('text')[0][0] == 'a'
+    assert len(loads) == 2
+
+
+def test_invalidate_on_commit():
+    from sqlalchemy.orm import Session
+    from bookclub.data.search import indexes
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [('a', 'some text')]
+
+    db = Session()
+    db.begin()
+    indexes.invalidate_on_commit(db, 'test')
+    indexes.get('test', '1', load)
+    indexes.get('test', '1', load)
+    assert len(loads) == 1
+    db.commit()
+    indexes.get('test', '1', load)
+    assert len(loads) == 2
+    indexes.invalidate('test')
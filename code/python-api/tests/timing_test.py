@@ -0,0 +1,42 @@
+import logging
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from bookclub import api
+from bookclub.data.support import _instrument
+from bookclub.utils import timing
+
+
+def test_server_timing():
+    t = timing.RequestTimings('/books')
+    t.queries = 3
+    t.db = 0.002
+    t.serialize = 0.001
+    header = t.server_timing(0.010)
+    assert header.startswith('db;dur=2.00;desc="3 queries", serialize;dur=1.00')
+    assert 'handler;dur=7.00' in header
+    assert t.as_dict(0.010)['handler_ms'] == 7.0
+
+
+def test_statement_hooks(caplog):
+    engine = create_engine('sqlite://')
+    _instrument(engine, 0)
+    timings, token = timing.start('/test')
+    try:
+        with caplog.at_level(logging.WARNING, logger='bookclub.sql'):
+            with engine.connect() as c:
+                c.execute(text("SELECT 1"))
+                c.execute(text("SELECT 2"))
+    finally:
+        timing.current.reset(token)
+    assert timings.queries == 2
+    assert timings.db > 0
+    assert len([r for r in caplog.records if '"/test"' in r.getMessage()]) == 2
+
+
+def test_middleware(caplog):
+    with caplog.at_level(logging.INFO, logger='bookclub.requests'):
+        response = TestClient(api).get('/')
+    assert response.headers['Server-Timing'].startswith('db;dur=0.00;desc="0 queries"')
+    assert any('"route": "entrypoint"' in r.getMessage() for r in caplog.records)